@@ -0,0 +1,74 @@
+"""Cache index (shelve) read and write cost at growing entry counts."""
+
+import random
+import shelve
+import time
+
+from benchmarks.common import measure, result
+
+
+def run(args, workdir) -> list[dict]:
+    from hylde import server, settings
+
+    results = []
+    original_db = settings.cachedbfile
+    try:
+        for size in args.index_sizes:
+            db_file = workdir / f"index-{size}.db"
+            settings.set("cachedbfile", str(db_file))
+            keys = [server.get_url_key(f"https://example.com/{i}") for i in range(size)]
+
+            start = time.perf_counter()
+            with shelve.open(db_file) as db:
+                for key in keys:
+                    db[key] = f"{key}/file.jpg"
+            populate = time.perf_counter() - start
+
+            results.append(
+                result(
+                    "cache.index.populate",
+                    {"entries": size},
+                    {
+                        "seconds": populate,
+                        "ops_per_second": size / populate if populate else None,
+                    },
+                )
+            )
+            results.append(
+                result(
+                    "cache.index.read",
+                    {"entries": size},
+                    measure(
+                        lambda keys=keys: server.get_cached_file(random.choice(keys)),
+                        args.index_repeat,
+                    ),
+                )
+            )
+            results.append(
+                result(
+                    "cache.index.write",
+                    {"entries": size},
+                    measure(
+                        lambda keys=keys: server.set_cached_file(
+                            random.choice(keys), "x/y.jpg"
+                        ),
+                        args.index_repeat,
+                    ),
+                )
+            )
+            results.append(
+                result(
+                    "cache.index.read_batch",
+                    {"entries": size, "batch": 1000},
+                    measure(
+                        lambda keys=keys, size=size: server.get_cached_files(
+                            random.sample(keys, min(1000, size))
+                        ),
+                        max(args.index_repeat // 10, 1),
+                    ),
+                )
+            )
+    finally:
+        settings.set("cachedbfile", original_db)
+
+    return results
@@ -0,0 +1,66 @@
+"""`_move_file_to_cache` and `_zip_files_to_cache` throughput across file sizes."""
+
+import os
+import shutil
+import time
+import uuid
+from pathlib import Path
+
+from benchmarks.common import result
+
+
+def _make_file(directory: Path, size: int) -> Path:
+    path = directory / f"{uuid.uuid4()}" / "file.bin"
+    os.makedirs(path.parent, exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(os.urandom(min(size, 1 << 20)) * (size // (1 << 20) or 1))
+        f.truncate(size)
+    return path
+
+
+def _throughput(seconds: list[float], n_bytes: int) -> dict:
+    total = sum(seconds)
+    return {
+        "count": len(seconds),
+        "mean_ms": total / len(seconds) * 1000,
+        "max_ms": max(seconds) * 1000,
+        "mb_per_second": n_bytes * len(seconds) / total / 1e6 if total else None,
+    }
+
+
+def run(args, workdir) -> list[dict]:
+    from hylde import wrapper
+
+    results = []
+    source = workdir / "ingest-source"
+    cache = workdir / "ingest-cache"
+    for size in args.file_sizes:
+        # single files are moved, usually a rename on the same filesystem
+        seconds = []
+        for i in range(args.ingest_repeat):
+            f = _make_file(source, size)
+            t0 = time.perf_counter()
+            wrapper._move_file_to_cache(cache, f, f"move-{size}-{i}")
+            seconds.append(time.perf_counter() - t0)
+        results.append(
+            result("ingest.move", {"file_size": size}, _throughput(seconds, size))
+        )
+
+        # multi-file results are stored into a zip
+        seconds = []
+        for i in range(args.ingest_repeat):
+            files = [_make_file(source, size) for _ in range(args.files_per_zip)]
+            t0 = time.perf_counter()
+            wrapper._zip_files_to_cache(cache, files, f"zip-{size}-{i}")
+            seconds.append(time.perf_counter() - t0)
+        results.append(
+            result(
+                "ingest.zip",
+                {"file_size": size, "files": args.files_per_zip},
+                _throughput(seconds, size * args.files_per_zip),
+            )
+        )
+        shutil.rmtree(cache, ignore_errors=True)
+        shutil.rmtree(source, ignore_errors=True)
+
+    return results
@@ -0,0 +1,40 @@
+"""`get_downloader_for_url` dispatch cost with large pattern sets."""
+
+from benchmarks.common import measure, result
+from benchmarks.fakes import make_downloader
+
+
+def run(args, workdir) -> list[dict]:
+    from hylde import registry
+
+    results = []
+    original = list(registry.DOWNLOADER_PATTERNS)
+    fake = make_downloader("registry", workdir)
+    fallback = make_downloader("fallback", workdir)
+    try:
+        for size in args.pattern_counts:
+            registry.DOWNLOADER_PATTERNS[:] = [
+                (rf"https?://(?:www\.)?host{i}\.example/(?:f|i|v)/.", fake)
+                for i in range(size)
+            ] + [(".", fallback)]
+
+            cases = {
+                "first": "https://host0.example/f/abc",
+                "last": f"https://host{size - 1}.example/f/abc",
+                "fallback": "https://unmatched.example/file.jpg",
+            }
+            for case, url in cases.items():
+                results.append(
+                    result(
+                        "registry.dispatch",
+                        {"patterns": size, "match": case},
+                        measure(
+                            lambda url=url: registry.get_downloader_for_url(url),
+                            args.repeat,
+                        ),
+                    )
+                )
+    finally:
+        registry.DOWNLOADER_PATTERNS[:] = original
+
+    return results
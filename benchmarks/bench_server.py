@@ -0,0 +1,87 @@
+"""`/file` request path: cold downloads through a stand-in origin and cache-hit serving."""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.common import measure, result, summarize
+from benchmarks.fakes import OriginServer, constant, make_downloader
+
+
+def _get(client, url: str) -> int:
+    resp = client.get("/file", query_string={"url": url})
+    resp.get_data()
+    resp.close()
+    return resp.status_code
+
+
+def run(args, workdir) -> list[dict]:
+    from hylde import registry, server
+
+    results = []
+    with OriginServer() as origin:
+        fake = make_downloader(
+            "origin",
+            workdir / "downloads",
+            size=constant(args.file_size),
+            origin=origin,
+        )
+        registry.register_downloader(r"^bench://", fake, index=0)
+        client = server.app.test_client()
+
+        # cache misses: download through the fake downloader, then serve
+        samples = []
+        for i in range(args.cold_requests):
+            t0 = time.perf_counter()
+            status = _get(client, f"bench://cold/{i}")
+            samples.append(time.perf_counter() - t0)
+            assert status == 200, f"cold request returned {status}"
+        results.append(
+            result(
+                "server.file.cold",
+                {"file_size": args.file_size},
+                summarize(samples),
+            )
+        )
+
+        # cache hits
+        urls = [f"bench://hit/{i}" for i in range(args.hit_urls)]
+        for url in urls:
+            assert _get(client, url) == 200
+        counter = iter(range(10**12))
+        results.append(
+            result(
+                "server.file.hit",
+                {"file_size": args.file_size, "urls": len(urls), "concurrency": 1},
+                measure(
+                    lambda: _get(client, urls[next(counter) % len(urls)]), args.requests
+                ),
+            )
+        )
+
+        # cache hits from concurrent clients
+        def worker(offset: int) -> list[float]:
+            local_client = server.app.test_client()
+            samples = []
+            for i in range(args.requests // args.concurrency):
+                t0 = time.perf_counter()
+                _get(local_client, urls[(offset + i) % len(urls)])
+                samples.append(time.perf_counter() - t0)
+            return samples
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(args.concurrency) as pool:
+            per_thread = list(pool.map(worker, range(args.concurrency)))
+        elapsed = time.perf_counter() - start
+        results.append(
+            result(
+                "server.file.hit",
+                {
+                    "file_size": args.file_size,
+                    "urls": len(urls),
+                    "concurrency": args.concurrency,
+                },
+                summarize([s for samples in per_thread for s in samples], elapsed),
+            )
+        )
+
+    return results
@@ -0,0 +1,104 @@
+"""Shared helpers for the benchmark suite."""
+
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+
+def setup_environment(workdir: Path):
+    """
+    Point hylde at a throwaway cache and config before it is imported.
+    Must run before the first `import hylde`.
+    """
+    os.environ.setdefault("HYLDE_CACHEDIR", str(workdir / "cache"))
+    os.environ.setdefault("HYLDE_CACHEDBFILE", str(workdir / "cache.db"))
+    os.environ.setdefault("HYLDE_LOGFILE", str(workdir / "hylde.log"))
+    os.environ.setdefault("HYLDE_JOURNALFILE", str(workdir / "journal.jsonl"))
+    os.environ.setdefault("HYLDE_LOGLEVEL", "WARNING")
+    # results go to stdout as JSON, keep log lines off it from the first import on
+    os.environ.setdefault("HYLDE_STDOUTLEVEL", "WARNING")
+    os.environ.setdefault("HYLDE_RATELIMIT__ENABLED", "false")
+    os.environ.setdefault("HYLDE_DOWNLOADER__JDOWNLOADER__EMAIL", "benchmark")
+    os.environ.setdefault("HYLDE_DOWNLOADER__JDOWNLOADER__PASSWORD", "benchmark")
+    os.environ.setdefault("HYLDE_MAXTIMEOUT", "30")
+
+
+def silence_logging():
+    """Drop hylde's log sinks so logging does not dominate the measurements."""
+    from hylde import lolg
+
+    lolg.remove()
+
+
+def make_workdir() -> Path:
+    return Path(tempfile.mkdtemp(prefix="hylde-bench-"))
+
+
+def summarize(samples: list[float], total_seconds: float | None = None) -> dict:
+    """Return latency percentiles in milliseconds and throughput for samples in seconds."""
+    ordered = sorted(samples)
+    total = total_seconds if total_seconds is not None else sum(samples)
+
+    def percentile(p: float) -> float:
+        index = min(round(p / 100 * (len(ordered) - 1)), len(ordered) - 1)
+        return ordered[index] * 1000
+
+    return {
+        "count": len(ordered),
+        "mean_ms": statistics.fmean(ordered) * 1000,
+        "p50_ms": percentile(50),
+        "p90_ms": percentile(90),
+        "p99_ms": percentile(99),
+        "max_ms": ordered[-1] * 1000,
+        "ops_per_second": len(ordered) / total if total else None,
+    }
+
+
+def measure(func, repeat: int) -> dict:
+    """Call func repeat times and summarize the per-call latency."""
+    samples = []
+    start = time.perf_counter()
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - t0)
+    return summarize(samples, time.perf_counter() - start)
+
+
+def result(name: str, params: dict, metrics: dict) -> dict:
+    return {"name": name, "params": params, "metrics": metrics}
+
+
+def environment() -> dict:
+    """Describe the machine and code a result file was produced with."""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    from importlib.metadata import PackageNotFoundError, version
+
+    try:
+        hylde_version = version("hylde")
+    except PackageNotFoundError:
+        hylde_version = None
+
+    return {
+        "hylde_version": hylde_version,
+        "git_commit": commit,
+        "python": sys.version.split()[0],
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "timestamp": time.time(),
+    }
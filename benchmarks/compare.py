@@ -0,0 +1,90 @@
+"""
+Compare two benchmark result files and report regressions.
+
+    python -m benchmarks.compare baseline.json candidate.json --threshold 0.1
+"""
+
+import argparse
+import json
+import sys
+
+# metric -> True if higher is better
+TRACKED_METRICS = {
+    "p50_ms": False,
+    "p99_ms": False,
+    "mean_ms": False,
+    "ops_per_second": True,
+    "mb_per_second": True,
+    "rate_429": False,
+    "rate_503": False,
+    "duplicate_downloads": False,
+    "threads_max": False,
+}
+
+
+def _key(entry: dict) -> tuple:
+    return entry["name"], json.dumps(entry["params"], sort_keys=True)
+
+
+def compare(baseline: dict, candidate: dict, threshold: float) -> list[dict]:
+    """Return one row per tracked metric present in both files."""
+    base = {_key(e): e["metrics"] for e in baseline["results"]}
+    rows = []
+    for entry in candidate["results"]:
+        old = base.get(_key(entry))
+        if old is None:
+            continue
+        for metric, higher_is_better in TRACKED_METRICS.items():
+            before, after = old.get(metric), entry["metrics"].get(metric)
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            worse = -change if higher_is_better else change
+            rows.append(
+                {
+                    "name": entry["name"],
+                    "params": entry["params"],
+                    "metric": metric,
+                    "baseline": before,
+                    "candidate": after,
+                    "change": change,
+                    "regression": worse > threshold,
+                }
+            )
+    return rows
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="relative change treated as regression",
+    )
+    parser.add_argument("--json", action="store_true", help="print rows as JSON")
+    args = parser.parse_args(argv)
+
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    with open(args.candidate, encoding="utf-8") as f:
+        candidate = json.load(f)
+
+    rows = compare(baseline, candidate, args.threshold)
+    if args.json:
+        print(json.dumps(rows, indent=2))
+    else:
+        for row in rows:
+            flag = "REGRESSION" if row["regression"] else ""
+            print(
+                f"{row['name']:<24} {json.dumps(row['params'], sort_keys=True):<50} "
+                f"{row['metric']:<15} {row['baseline']:>12.3f} -> {row['candidate']:>12.3f} "
+                f"({row['change']:+.1%}) {flag}"
+            )
+    return 1 if any(row["regression"] for row in rows) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
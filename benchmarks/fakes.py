@@ -0,0 +1,141 @@
+"""Stand-in downloader modules and a local HTTP origin for benchmarks and load tests."""
+
+import math
+import os
+import random
+import re
+import threading
+import time
+import types
+import uuid
+from collections.abc import Callable
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import requests
+
+
+class _OriginHandler(BaseHTTPRequestHandler):
+    """Serve `/bytes/<n>` as n zero bytes, honouring single Range requests."""
+
+    protocol_version = "HTTP/1.1"
+    chunk = b"\0" * 65536
+
+    def do_HEAD(self):
+        self._respond(body=False)
+
+    def do_GET(self):
+        self._respond(body=True)
+
+    def _respond(self, body: bool):
+        match = re.fullmatch(r"/bytes/(\d+)(?:/.*)?", self.path)
+        if not match:
+            self.send_error(404)
+            return
+        size = int(match.group(1))
+        start, end = 0, size - 1
+        status = 200
+        if range_header := self.headers.get("Range"):
+            first, _, last = range_header.removeprefix("bytes=").partition("-")
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+            status = 206
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Accept-Ranges", "bytes")
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.end_headers()
+
+        remaining = end - start + 1 if body else 0
+        while remaining > 0:
+            data = self.chunk[: min(remaining, len(self.chunk))]
+            self.wfile.write(data)
+            remaining -= len(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class OriginServer:
+    """Local HTTP server that fake downloaders fetch file bodies from."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self.httpd = ThreadingHTTPServer((host, port), _OriginHandler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def url_for(self, size: int, name: str = "file.bin") -> str:
+        return f"{self.base_url}/bytes/{size}/{name}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def constant(value: float) -> Callable[[], float]:
+    return lambda: value
+
+
+def lognormal(median: float, sigma: float = 0.5) -> Callable[[], float]:
+    """Distribution with a long right tail, as seen for real download times."""
+    if median <= 0:
+        return constant(0)
+    mu = math.log(median)
+    return lambda: random.lognormvariate(mu, sigma)
+
+
+def make_downloader(
+    name: str,
+    output_dir: Path,
+    latency: Callable[[], float] | None = None,
+    size: Callable[[], float] | None = None,
+    origin: OriginServer | None = None,
+    failure_rate: float = 0.0,
+    retryable_rate: float = 0.0,
+    calls: list | None = None,
+) -> types.ModuleType:
+    """
+    Build a module with the `download_url(url, url_key)` contract of `hylde.downloaders`.
+    Files are fetched from origin when given, otherwise written locally.
+    """
+    latency = latency or constant(0)
+    size = size or constant(1024)
+    module = types.ModuleType(f"benchmarks.fakes.{name}")
+
+    def download_url(url: str, url_key: str) -> list[Path] | None:
+        if calls is not None:
+            calls.append(url_key)
+        time.sleep(max(latency(), 0))
+        roll = random.random()
+        if roll < failure_rate:
+            return None
+        if roll < failure_rate + retryable_rate:
+            return []
+
+        n_bytes = max(int(size()), 0)
+        target = output_dir / f"{uuid.uuid4()}" / "file.bin"
+        os.makedirs(target.parent, exist_ok=True)
+        if origin is not None:
+            with requests.get(origin.url_for(n_bytes), stream=True, timeout=30) as r:
+                r.raise_for_status()
+                with open(target, "wb") as f:
+                    f.writelines(r.iter_content(65536))
+        else:
+            with open(target, "wb") as f:
+                f.truncate(n_bytes)
+        return [target]
+
+    module.download_url = download_url  # type:ignore[attr-defined]
+    return module
@@ -0,0 +1,419 @@
+"""
+Replay request traces against hylde the way Hydrus clients poll it.
+
+    python -m benchmarks.loadgen --clients 20 --urls 500 --duplicate-rate 0.2
+    python -m benchmarks.loadgen --trace recorded.jsonl --output report.json
+    python -m benchmarks.loadgen --clients 5 --write-trace synthetic.jsonl
+
+Each trace line is a JSON object `{"t": <seconds from start>, "url": <url>, "client": <id>}`.
+Clients behave like Hydrus' file download queues: a few workers per client fetch
+`/file?url=...` one after another and retry on 429 and 503 until they get the
+file, a 500, or run out of attempts.
+"""
+
+import argparse
+import json
+import logging
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+from benchmarks.common import (
+    environment,
+    make_workdir,
+    result,
+    setup_environment,
+    summarize,
+)
+
+
+@dataclass
+class TraceEntry:
+    t: float
+    url: str
+    client: int = 0
+
+
+@dataclass
+class Outcome:
+    url: str
+    client: int
+    final_status: int | None
+    attempts: int
+    started: float
+    finished: float
+    statuses: list[int] = field(default_factory=list)
+    latencies: list[float] = field(default_factory=list)
+
+
+def read_trace(path: str) -> list[TraceEntry]:
+    with open(path, encoding="utf-8") as f:
+        entries = [TraceEntry(**json.loads(line)) for line in f if line.strip()]
+    return sorted(entries, key=lambda e: e.t)
+
+
+def write_trace(path: str, trace: list[TraceEntry]):
+    with open(path, "w", encoding="utf-8") as f:
+        f.writelines(
+            json.dumps({"t": e.t, "url": e.url, "client": e.client}) + "\n"
+            for e in trace
+        )
+
+
+def synthetic_trace(
+    clients: int,
+    urls: int,
+    duplicate_rate: float,
+    duration: float,
+    seed: int | None = None,
+) -> list[TraceEntry]:
+    """
+    Spread urls over clients and duration. A share of the requests repeats urls
+    already asked for, by the same or another client, like overlapping subscriptions.
+    """
+    rng = random.Random(seed)
+    unique = [f"bench://load/{i}" for i in range(urls)]
+    trace = []
+    for i, url in enumerate(unique):
+        trace.append(TraceEntry(rng.uniform(0, duration), url, i % clients))
+    for _ in range(int(urls * duplicate_rate)):
+        trace.append(
+            TraceEntry(
+                rng.uniform(0, duration), rng.choice(unique), rng.randrange(clients)
+            )
+        )
+    return sorted(trace, key=lambda e: e.t)
+
+
+class HydrusClient:
+    """A Hydrus instance polling hylde with a fixed number of download workers."""
+
+    def __init__(self, base_url: str, args):
+        import requests
+
+        self.base_url = base_url
+        self.args = args
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=args.workers_per_client)
+        self.session.mount("http://", adapter)
+        self.pool = ThreadPoolExecutor(args.workers_per_client)
+
+    def submit(self, entry: TraceEntry):
+        return self.pool.submit(self.fetch, entry)
+
+    def _retry_delay(self, headers) -> float:
+        if self.args.retry_delay is not None:
+            delay = self.args.retry_delay
+        else:
+            delay = float(headers.get("Retry-After", self.args.default_retry_delay))
+        return delay * self.args.time_scale
+
+    def fetch(self, entry: TraceEntry) -> Outcome:
+        import requests
+
+        outcome = Outcome(entry.url, entry.client, None, 0, time.perf_counter(), 0.0)
+        while outcome.attempts < self.args.max_attempts:
+            outcome.attempts += 1
+            t0 = time.perf_counter()
+            try:
+                resp = self.session.get(
+                    f"{self.base_url}/file",
+                    params={"url": entry.url},
+                    timeout=self.args.request_timeout,
+                )
+                # read the whole body so the latency includes the transfer
+                _ = resp.content
+            except requests.RequestException:
+                outcome.statuses.append(0)
+                outcome.latencies.append(time.perf_counter() - t0)
+                time.sleep(self.args.default_retry_delay * self.args.time_scale)
+                continue
+            outcome.statuses.append(resp.status_code)
+            outcome.latencies.append(time.perf_counter() - t0)
+            outcome.final_status = resp.status_code
+            if resp.status_code in (429, 503):
+                time.sleep(self._retry_delay(resp.headers))
+                continue
+            break
+        outcome.finished = time.perf_counter()
+        return outcome
+
+    def close(self):
+        self.pool.shutdown(wait=True)
+        self.session.close()
+
+
+class ThreadSampler:
+    """Sample process thread count and hylde's active downloads in the background."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.samples: list[tuple[int, int]] = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        from hylde import server
+
+        while not self._stop.wait(self.interval):
+            self.samples.append((threading.active_count(), len(server.active_threads)))
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def summary(self) -> dict:
+        if not self.samples:
+            return {}
+        process, downloads = zip(*self.samples)
+        return {
+            "threads_max": max(process),
+            "threads_mean": sum(process) / len(process),
+            "active_downloads_max": max(downloads),
+            "active_downloads_mean": sum(downloads) / len(downloads),
+        }
+
+
+def _count_duplicates(downloads: list[tuple[str, bool]]) -> int:
+    """Count downloads of url keys that had already been downloaded successfully."""
+    done, duplicates = set(), 0
+    for url_key, succeeded in downloads:
+        if url_key in done:
+            duplicates += 1
+        elif succeeded:
+            done.add(url_key)
+    return duplicates
+
+
+def report(
+    outcomes: list[Outcome], downloads: list[tuple[str, bool]], elapsed: float
+) -> dict:
+    statuses = Counter(s for o in outcomes for s in o.statuses)
+    total = sum(statuses.values())
+    finals = Counter(o.final_status for o in outcomes)
+
+    completion = [o.finished - o.started for o in outcomes if o.final_status == 200]
+    # per-request latency at the top level so benchmarks.compare tracks it
+    metrics = summarize([lat for o in outcomes for lat in o.latencies], elapsed)
+    metrics.update(
+        {
+            "requests": total,
+            "urls_requested": len(outcomes),
+            "elapsed_seconds": elapsed,
+            "status_counts": {str(k): v for k, v in sorted(statuses.items())},
+            "rate_429": statuses[429] / total if total else 0,
+            "rate_503": statuses[503] / total if total else 0,
+            "rate_500": statuses[500] / total if total else 0,
+            "connection_errors": statuses[0],
+            "final_status_counts": {
+                str(k): v for k, v in sorted(finals.items(), key=str)
+            },
+            "gave_up": sum(1 for o in outcomes if o.final_status in (429, 503, None)),
+            "attempts_max": max((o.attempts for o in outcomes), default=0),
+            "downloads_started": len(downloads),
+            "downloads_unique": len({url_key for url_key, _ in downloads}),
+            "duplicate_downloads": _count_duplicates(downloads),
+            "completion_latency": summarize(completion) if completion else None,
+        }
+    )
+    return metrics
+
+
+def run_load(
+    args, trace: list[TraceEntry], base_url: str, downloads: list[tuple[str, bool]]
+) -> dict:
+    clock_start = time.perf_counter()
+    clients: dict[int, HydrusClient] = {}
+    futures = []
+    with ThreadSampler(args.sample_interval) as sampler:
+        for entry in trace:
+            delay = entry.t * args.time_scale - (time.perf_counter() - clock_start)
+            if delay > 0:
+                time.sleep(delay)
+            if entry.client not in clients:
+                clients[entry.client] = HydrusClient(base_url, args)
+            futures.append(clients[entry.client].submit(entry))
+        outcomes = [f.result() for f in futures]
+        for client in clients.values():
+            client.close()
+    elapsed = time.perf_counter() - clock_start
+
+    metrics = report(outcomes, downloads, elapsed)
+    metrics.update(sampler.summary())
+    return metrics
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--output", "-o", help="write JSON report to this file instead of stdout"
+    )
+    parser.add_argument(
+        "--trace", help="replay this JSON lines trace instead of a synthetic one"
+    )
+    parser.add_argument("--write-trace", help="save the trace used for this run")
+    # synthetic trace
+    parser.add_argument(
+        "--clients", type=int, default=10, help="simulated Hydrus instances"
+    )
+    parser.add_argument(
+        "--urls", type=int, default=200, help="distinct urls in a synthetic trace"
+    )
+    parser.add_argument(
+        "--duplicate-rate",
+        type=float,
+        default=0.2,
+        help="repeated requests per distinct url",
+    )
+    parser.add_argument(
+        "--duration",
+        type=float,
+        default=10.0,
+        help="seconds over which requests arrive",
+    )
+    parser.add_argument("--seed", type=int, default=None)
+    # client behaviour
+    parser.add_argument(
+        "--workers-per-client",
+        type=int,
+        default=2,
+        help="concurrent downloads per client",
+    )
+    parser.add_argument(
+        "--max-attempts", type=int, default=20, help="requests per url before giving up"
+    )
+    parser.add_argument(
+        "--retry-delay",
+        type=float,
+        default=None,
+        help="fixed retry delay, ignores Retry-After",
+    )
+    parser.add_argument(
+        "--default-retry-delay",
+        type=float,
+        default=5.0,
+        help="delay without Retry-After",
+    )
+    parser.add_argument("--request-timeout", type=float, default=120.0)
+    parser.add_argument(
+        "--time-scale",
+        type=float,
+        default=1.0,
+        help="multiply trace offsets and retry delays",
+    )
+    # fake downloader
+    parser.add_argument(
+        "--latency", type=float, default=2.0, help="median download seconds"
+    )
+    parser.add_argument(
+        "--latency-sigma",
+        type=float,
+        default=0.8,
+        help="lognormal spread of download time",
+    )
+    parser.add_argument(
+        "--size", type=int, default=1 << 20, help="median file size in bytes"
+    )
+    parser.add_argument(
+        "--size-sigma", type=float, default=1.0, help="lognormal spread of file size"
+    )
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--retryable-rate", type=float, default=0.0)
+    # server
+    parser.add_argument(
+        "--maxtimeout", type=float, default=None, help="override hylde's maxtimeout"
+    )
+    parser.add_argument(
+        "--sample-interval", type=float, default=0.1, help="thread sampling interval"
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    trace = (
+        read_trace(args.trace)
+        if args.trace
+        else synthetic_trace(
+            args.clients, args.urls, args.duplicate_rate, args.duration, args.seed
+        )
+    )
+    if args.write_trace:
+        write_trace(args.write_trace, trace)
+
+    workdir = make_workdir()
+    setup_environment(workdir)
+
+    from werkzeug.serving import make_server
+
+    from benchmarks.common import silence_logging
+    from benchmarks.fakes import OriginServer, lognormal, make_downloader
+    from hylde import registry, server, settings
+
+    silence_logging()
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    if args.maxtimeout is not None:
+        settings.set("maxtimeout", args.maxtimeout)
+
+    downloads: list[tuple[str, bool]] = []
+    with OriginServer() as origin:
+        fake = make_downloader(
+            "load",
+            workdir / "downloads",
+            latency=lognormal(args.latency, args.latency_sigma),
+            size=lognormal(args.size, args.size_sigma),
+            origin=origin,
+            failure_rate=args.failure_rate,
+            retryable_rate=args.retryable_rate,
+        )
+        fake_download_url = fake.download_url
+
+        def download_url(url, url_key):
+            files = fake_download_url(url, url_key)
+            downloads.append((url_key, bool(files)))
+            return files
+
+        fake.download_url = download_url
+        registry.register_downloader(r"^bench://", fake, index=0)
+
+        # a threaded WSGI server, so every waiting request holds a thread like in production
+        httpd = make_server("127.0.0.1", 0, server.app, threaded=True)
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        base_url = f"http://127.0.0.1:{httpd.server_port}"
+
+        print(f"Replaying {len(trace)} requests against {base_url}...", file=sys.stderr)
+        try:
+            metrics = run_load(args, trace, base_url, downloads)
+        finally:
+            httpd.shutdown()
+
+    params = {
+        k: v
+        for k, v in vars(args).items()
+        if k not in ("output", "write_trace", "sample_interval")
+    }
+    params["maxtimeout"] = settings.maxtimeout
+    output = {
+        "environment": environment(),
+        "arguments": params,
+        "results": [result("loadgen", params, metrics)],
+    }
+    text = json.dumps(output, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
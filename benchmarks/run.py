@@ -0,0 +1,140 @@
+"""
+Run the hylde benchmark suite and write machine-readable results.
+
+    python -m benchmarks.run --output results.json
+    python -m benchmarks.run --quick --only server,registry
+    python -m benchmarks.run --full --only cache  # large sizes, takes hours
+"""
+
+import argparse
+import json
+import shutil
+import sys
+
+from benchmarks.common import environment, make_workdir, setup_environment
+
+# sizes of the default run and of --full
+INDEX_SIZES = ([1_000, 10_000], [10_000, 100_000, 1_000_000])
+PATTERN_COUNTS = ([3, 100, 1000], [3, 100, 1000, 10_000])
+FILE_SIZES = ([64 * 1024, 1 << 20, 16 << 20], [64 * 1024, 1 << 20, 16 << 20, 128 << 20])
+
+
+def _int_list(value: str) -> list[int]:
+    return [int(v) for v in value.split(",") if v]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--output", "-o", help="write JSON results to this file instead of stdout"
+    )
+    parser.add_argument(
+        "--only", help="comma separated suites: server,cache,registry,ingest"
+    )
+    parser.add_argument(
+        "--quick", action="store_true", help="small sizes for a fast smoke run"
+    )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="large index, pattern and file sizes, takes hours",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=2000, help="calls per latency measurement"
+    )
+    parser.add_argument(
+        "--requests", type=int, default=5000, help="cache-hit /file requests"
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=8, help="threads for concurrent cache hits"
+    )
+    parser.add_argument(
+        "--cold-requests", type=int, default=50, help="cache-miss /file requests"
+    )
+    parser.add_argument(
+        "--hit-urls", type=int, default=100, help="distinct cached urls"
+    )
+    parser.add_argument(
+        "--file-size", type=int, default=256 * 1024, help="bytes per served file"
+    )
+    parser.add_argument(
+        "--index-repeat",
+        type=int,
+        help="index reads and writes per size, each reopens the index "
+        "(default 200, --repeat with --full)",
+    )
+    parser.add_argument("--index-sizes", type=_int_list)
+    parser.add_argument("--pattern-counts", type=_int_list)
+    parser.add_argument("--file-sizes", type=_int_list)
+    parser.add_argument(
+        "--ingest-repeat", type=int, default=5, help="ingests per file size"
+    )
+    parser.add_argument("--files-per-zip", type=int, default=4)
+    args = parser.parse_args(argv)
+
+    if args.index_sizes is None:
+        args.index_sizes = INDEX_SIZES[args.full]
+    if args.pattern_counts is None:
+        args.pattern_counts = PATTERN_COUNTS[args.full]
+    if args.file_sizes is None:
+        args.file_sizes = FILE_SIZES[args.full]
+    if args.index_repeat is None:
+        args.index_repeat = args.repeat if args.full else min(args.repeat, 200)
+    if args.quick:
+        args.repeat = min(args.repeat, 200)
+        args.requests = min(args.requests, 500)
+        args.cold_requests = min(args.cold_requests, 10)
+        args.hit_urls = min(args.hit_urls, 20)
+        args.index_sizes = [10_000]
+        args.index_repeat = min(args.index_repeat, 50)
+        args.pattern_counts = [3, 100]
+        args.file_sizes = [64 * 1024, 1 << 20]
+        args.ingest_repeat = min(args.ingest_repeat, 2)
+    return args
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    workdir = make_workdir()
+    setup_environment(workdir)
+
+    from benchmarks import bench_cache, bench_ingest, bench_registry, bench_server
+    from benchmarks.common import silence_logging
+
+    silence_logging()
+    suites = {
+        "server": bench_server.run,
+        "cache": bench_cache.run,
+        "registry": bench_registry.run,
+        "ingest": bench_ingest.run,
+    }
+    selected = args.only.split(",") if args.only else list(suites)
+    unknown = set(selected) - set(suites)
+    if unknown:
+        print(f"Unknown suites: {', '.join(sorted(unknown))}", file=sys.stderr)
+        return 2
+
+    results = []
+    try:
+        for name in selected:
+            print(f"Running {name} benchmarks...", file=sys.stderr)
+            results.extend(suites[name](args, workdir))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "environment": environment(),
+        "arguments": {k: v for k, v in vars(args).items() if k != "output"},
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,6 +3,8 @@ import logging
 from loguru import logger as lolg
 from dynaconf import Dynaconf  # type:ignore
 
+from hylde.util import is_key_sampled
+
 # get settings
 settings = Dynaconf(
     envvar_prefix="HYLDE",
@@ -13,20 +15,37 @@ settings = Dynaconf(
     ],
 )
 
+
+_INFO = lolg.level("INFO").no
+
+
+def _sample_debug(record) -> bool:
+    """Drop DEBUG and TRACE records of url keys outside the debug sample."""
+    if record["level"].no >= _INFO:
+        return True
+    url_key = record["extra"].get("url_key")
+    return url_key is None or is_key_sampled(url_key, settings.debugsamplerate)
+
+
 # configure Loguru
+# sink writes move to a background thread, records are still formatted by the caller
 lolg.remove()
 lolg.add(
     sys.stdout,
-    level="DEBUG",
+    level=settings.stdoutlevel,
     colorize=True,
+    enqueue=settings.logenqueue,
+    filter=_sample_debug,
 )
 lolg.add(
     settings.logfile,
     rotation="1 MB",
     retention="7 days",
     level=settings.loglevel,
+    enqueue=settings.logenqueue,
+    filter=_sample_debug,
 )
-lolg.info(f"Writing {settings.loglevel} log to: {settings.logfile}")
+lolg.info("Writing {} log to: {}", settings.loglevel, settings.logfile)
 
 
 # bridge gallery-dl stdlib logging -> loguru
@@ -0,0 +1,144 @@
+import os
+import struct
+import zipfile
+from pathlib import Path
+
+from hylde import lolg, settings
+from hylde.util import TTLCache
+
+# local file header: signature, 22 bytes of versions, flags, sizes and crc, name and extra length
+_LOCAL_HEADER = struct.Struct("<4s22sHH")
+_LOCAL_HEADER_SIGNATURE = b"PK\x03\x04"
+
+
+class Member:
+    """A file in a ZIP archive and where its data starts."""
+
+    __slots__ = ("compress_size", "compress_type", "index", "name", "offset", "size")
+
+    def __init__(
+        self,
+        index: int,
+        name: str,
+        offset: int,
+        size: int,
+        compress_size: int,
+        compress_type: int,
+    ):
+        self.index = index
+        self.name = name
+        self.offset = offset
+        self.size = size
+        self.compress_size = compress_size
+        self.compress_type = compress_type
+
+    @property
+    def stored(self) -> bool:
+        return self.compress_type == zipfile.ZIP_STORED
+
+    def as_dict(self) -> dict:
+        return {
+            "index": self.index,
+            "name": self.name,
+            "size": self.size,
+            "stored": self.stored,
+        }
+
+
+def read_members(path: Path) -> list[Member]:
+    """Read the central directory and local headers of a ZIP archive. Raise BadZipFile."""
+    members = []
+    with open(path, "rb") as f, zipfile.ZipFile(f) as zf:
+        for info in zf.infolist():
+            if info.is_dir():
+                continue
+            header = os.pread(f.fileno(), _LOCAL_HEADER.size, info.header_offset)
+            if len(header) != _LOCAL_HEADER.size:
+                raise zipfile.BadZipFile(f"Truncated local header of '{info.filename}'")
+            signature, _, name_length, extra_length = _LOCAL_HEADER.unpack(header)
+            if signature != _LOCAL_HEADER_SIGNATURE:
+                raise zipfile.BadZipFile(f"Bad local header of '{info.filename}'")
+            # the local extra field may differ from the one in the central directory
+            offset = (
+                info.header_offset + _LOCAL_HEADER.size + name_length + extra_length
+            )
+            members.append(
+                Member(
+                    len(members),
+                    info.filename,
+                    offset,
+                    info.file_size,
+                    info.compress_size,
+                    info.compress_type,
+                )
+            )
+    return members
+
+
+# archive path -> (mtime_ns, size, members)
+_index = TTLCache(maxsize=settings.archive.indexsize, ttl=settings.archive.indexttl)
+
+
+def get_members(path: Path) -> list[Member]:
+    """Return the members of an archive, reading its central directory only once per version."""
+    stat = path.stat()
+    key = str(path)
+    if (entry := _index.get(key)) is not None and entry[:2] == (
+        stat.st_mtime_ns,
+        stat.st_size,
+    ):
+        return entry[2]
+    members = read_members(path)
+    _index.set(key, (stat.st_mtime_ns, stat.st_size, members))
+    lolg.debug("Indexed {} members of '{}'", len(members), path)
+    return members
+
+
+def find_member(members: list[Member], selector: str) -> Member | None:
+    """Return the member with name selector, or at index selector if no name matches."""
+    for member in members:
+        if member.name == selector:
+            return member
+    if selector.isdigit() and int(selector) < len(members):
+        return members[int(selector)]
+    return None
+
+
+class StoredMemberReader:
+    """
+    Read-only file of the bytes of a stored member.
+    Reads use `os.pread` and never leave the member. Its `fileno` is positioned at the
+    member, so WSGI servers with sendfile support send the member without copying.
+    """
+
+    def __init__(self, path: Path, member: Member):
+        # closed by close(), which the WSGI server calls after sending the member
+        self._file = open(path, "rb")  # noqa: SIM115
+        self._position = member.offset
+        self._end = member.offset + member.size
+        os.lseek(self._file.fileno(), member.offset, os.SEEK_SET)
+
+    def read(self, size: int = -1) -> bytes:
+        remaining = self._end - self._position
+        if size < 0 or size > remaining:
+            size = remaining
+        if size <= 0:
+            return b""
+        data = os.pread(self._file.fileno(), size, self._position)
+        self._position += len(data)
+        return data
+
+    def fileno(self) -> int:
+        return self._file.fileno()
+
+    def close(self):
+        self._file.close()
+
+
+def open_member(path: Path, member: Member):
+    """Return a file of the uncompressed bytes of member."""
+    if member.stored:
+        return StoredMemberReader(path, member)
+    # compressed members of archives hylde did not create are decompressed while sent
+    with zipfile.ZipFile(path) as zf:
+        return zf.open(member.name)
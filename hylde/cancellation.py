@@ -0,0 +1,177 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+from hylde import lolg, metrics
+
+# reasons for cancelling a download
+REQUEST = "request"
+IDLE = "idle"
+HEDGE = "hedge"
+
+CANCELLATIONS = metrics.Counter(
+    "hylde_cancellations_total",
+    "Cancelled downloads by reason (request, idle, hedge).",
+    ("reason",),
+)
+
+
+class Cancelled(BaseException):
+    """
+    The download was cancelled because nobody wants its result anymore.
+    Like `KeyboardInterrupt` it is no `Exception`, so catch-all handlers in downloaders
+    and gallery-dl let it through.
+    """
+
+
+class CancelToken:
+    """
+    Cooperative cancellation of a single download.
+    Downloaders check it between files, chunks and polls. A token with an idle timeout
+    cancels itself once nobody touched it for that many seconds.
+    """
+
+    def __init__(
+        self,
+        url_key: str,
+        idle_timeout: float = 0,
+        parent: "CancelToken | None" = None,
+    ):
+        self.url_key = url_key
+        self.idle_timeout = idle_timeout
+        self.reason: str | None = None
+        self.touched = time.monotonic()
+        self._event = threading.Event()
+        self._children: list[CancelToken] = []
+        self._lock = threading.Lock()
+        self._parent = parent
+        if parent is not None:
+            parent._add_child(self)
+
+    def _add_child(self, child: "CancelToken"):
+        with self._lock:
+            self._children.append(child)
+        if self.reason is not None:
+            child.cancel(self.reason)
+
+    def child(self) -> "CancelToken":
+        """Return a token that is cancelled with this one but can be cancelled alone."""
+        return CancelToken(self.url_key, parent=self)
+
+    def touch(self):
+        """Note that a client still waits for the download."""
+        self.touched = time.monotonic()
+
+    def cancel(self, reason: str = REQUEST) -> bool:
+        """Cancel the download and its children. Return False if it was cancelled before."""
+        with self._lock:
+            if self.reason is not None:
+                return False
+            self.reason = reason
+            children = list(self._children)
+        self._event.set()
+        for child in children:
+            child.cancel(reason)
+        return True
+
+    @property
+    def cancelled(self) -> bool:
+        if self._parent is not None:
+            # the idle timeout belongs to the download, not to its attempts
+            return self._parent.cancelled or self._event.is_set()
+        if (
+            self.idle_timeout
+            and self.reason is None
+            and time.monotonic() - self.touched > self.idle_timeout
+            and self.cancel(IDLE)
+        ):
+            CANCELLATIONS.labels(reason=IDLE).inc()
+            lolg.info(
+                "Cancelling '{}' which nobody asked for in {}s",
+                self.url_key,
+                self.idle_timeout,
+            )
+        return self._event.is_set()
+
+    def check(self):
+        """Raise Cancelled if the download was cancelled."""
+        if self.cancelled:
+            raise Cancelled(self.reason)
+
+    def sleep(self, seconds: float):
+        """Sleep for seconds unless the download is cancelled meanwhile."""
+        deadline = time.monotonic() + seconds
+        while (remaining := deadline - time.monotonic()) > 0:
+            self.check()
+            # wake up now and then to notice idle timeouts
+            self._event.wait(min(remaining, 1))
+        self.check()
+
+
+# tokens of in-flight downloads by url_key
+_tokens: dict[str, CancelToken] = {}
+_lock = threading.Lock()
+
+# token of the download running in the current thread
+_current: contextvars.ContextVar[CancelToken | None] = contextvars.ContextVar(
+    "hylde_cancel_token", default=None
+)
+
+
+def start(url_key: str, idle_timeout: float = 0) -> CancelToken:
+    with _lock:
+        token = _tokens[url_key] = CancelToken(url_key, idle_timeout)
+    return token
+
+
+def get(url_key: str) -> CancelToken | None:
+    return _tokens.get(url_key)
+
+
+def touch(url_key: str):
+    """Note that a client still waits for url_key. Unknown url keys are ignored."""
+    if (token := _tokens.get(url_key)) is not None:
+        token.touch()
+
+
+def cancel(url_key: str, reason: str = REQUEST) -> bool:
+    """Cancel the in-flight download of url_key. Return False if there is none."""
+    if (token := _tokens.get(url_key)) is None or not token.cancel(reason):
+        return False
+    CANCELLATIONS.labels(reason=reason).inc()
+    lolg.info("Cancelling '{}' ({})", url_key, reason)
+    return True
+
+
+def finish(url_key: str):
+    with _lock:
+        _tokens.pop(url_key, None)
+
+
+@contextmanager
+def use(token: CancelToken | None):
+    """Make token the one that `current`, `check` and `sleep` use in this thread."""
+    reset = _current.set(token)
+    try:
+        yield token
+    finally:
+        _current.reset(reset)
+
+
+def current() -> CancelToken | None:
+    return _current.get()
+
+
+def check():
+    """Raise Cancelled if the download of this thread was cancelled."""
+    if (token := _current.get()) is not None:
+        token.check()
+
+
+def sleep(seconds: float):
+    """Sleep like `time.sleep` but raise Cancelled once the download of this thread is cancelled."""
+    if (token := _current.get()) is None:
+        time.sleep(seconds)
+    else:
+        token.sleep(seconds)
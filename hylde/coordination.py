@@ -0,0 +1,377 @@
+import abc
+import json
+import os
+import socket
+import threading
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from pathlib import Path
+from urllib.parse import urlsplit
+
+from hylde import lolg, metrics, settings
+
+LEASES = metrics.Counter(
+    "hylde_leases_total",
+    "Download claims by result (claimed, joined, takeover, lost).",
+    ("result",),
+)
+
+
+class RespError(Exception):
+    """Error reply of a Redis-compatible server."""
+
+
+def default_node_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class Coordinator(abc.ABC):
+    """
+    Cross-instance claims on url keys so only one instance downloads a url at a time.
+    Claims are leases that expire after `ttl` seconds unless renewed, so the downloads of
+    a crashed instance are taken over by the others. Held leases are renewed in the
+    background every third of their ttl.
+
+    Backends implement `_acquire`, `_renew`, `_release` and `holder`.
+    """
+
+    # whether instances share the cache index and have to take turns writing it
+    shared = True
+
+    def __init__(self, node_id: str, ttl: float):
+        self.node_id = node_id
+        self.ttl = ttl
+        self._held: set[str] = set()
+        self._lock = threading.Lock()
+        self._renewal: threading.Thread | None = None
+
+    def claim(self, url_key: str) -> bool:
+        """Claim url_key for this instance. Return False if another instance holds it."""
+        try:
+            claimed = self._acquire(url_key)
+        except (OSError, RespError) as e:
+            # an unreachable backend must not stop downloads
+            lolg.error("Could not claim '{}': {}. Downloading anyway...", url_key, e)
+            return True
+        LEASES.labels(result="claimed" if claimed else "joined").inc()
+        if claimed:
+            with self._lock:
+                self._held.add(url_key)
+                self._start_renewal()
+        return claimed
+
+    def release(self, url_key: str):
+        with self._lock:
+            if url_key not in self._held:
+                return
+            self._held.discard(url_key)
+        try:
+            self._release(url_key)
+        except (OSError, RespError) as e:
+            lolg.warning("Could not release claim on '{}': {}", url_key, e)
+
+    @abc.abstractmethod
+    def holder(self, url_key: str) -> str | None:
+        """Return the node id holding a live lease on url_key."""
+
+    @contextmanager
+    def index_lock(self, index_file: Path | str) -> Iterator[None]:
+        """Hold the cache index at index_file. Instances sharing it take turns through a file lock."""
+        # POSIX only, the local backend never gets here
+        import fcntl
+
+        with open(f"{index_file}.lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+    @abc.abstractmethod
+    def _acquire(self, url_key: str) -> bool:
+        """Take or refresh the lease on url_key. Return False if another node holds it."""
+
+    @abc.abstractmethod
+    def _renew(self, url_key: str) -> bool:
+        """Extend a lease this node holds. Return False if it was lost."""
+
+    @abc.abstractmethod
+    def _release(self, url_key: str):
+        """Drop the lease on url_key if this node still holds it."""
+
+    def _start_renewal(self):
+        if self._renewal is None:
+            self._renewal = threading.Thread(
+                target=self._renew_leases, name="hylde-lease-renewal", daemon=True
+            )
+            self._renewal.start()
+
+    def _renew_leases(self):
+        while True:
+            time.sleep(self.ttl / 3)
+            with self._lock:
+                held = list(self._held)
+            for url_key in held:
+                try:
+                    renewed = self._renew(url_key)
+                except (OSError, RespError) as e:
+                    lolg.warning("Could not renew claim on '{}': {}", url_key, e)
+                    continue
+                if not renewed:
+                    LEASES.labels(result="lost").inc()
+                    lolg.warning("Lost claim on '{}' to another instance", url_key)
+                    with self._lock:
+                        self._held.discard(url_key)
+
+
+class LocalCoordinator(Coordinator):
+    """Single instance. Every claim succeeds."""
+
+    shared = False
+
+    def claim(self, url_key: str) -> bool:
+        return True
+
+    def release(self, url_key: str):
+        pass
+
+    def holder(self, url_key: str) -> str | None:
+        return None
+
+    @contextmanager
+    def index_lock(self, index_file: Path | str) -> Iterator[None]:
+        # a single instance has the index to itself
+        yield
+
+    def _acquire(self, url_key: str) -> bool:
+        return True
+
+    def _renew(self, url_key: str) -> bool:
+        return True
+
+    def _release(self, url_key: str):
+        pass
+
+
+class FileCoordinator(Coordinator):
+    """
+    Leases as files in a directory on the shared volume.
+    A lease file holds its owner and expires `ttl` seconds after its last modification.
+    """
+
+    def __init__(self, node_id: str, ttl: float, directory: Path | str):
+        super().__init__(node_id, ttl)
+        self.directory = Path(directory)
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, url_key: str) -> Path:
+        return self.directory / f"{url_key}.lease"
+
+    def _read(self, path: Path) -> tuple[str | None, bool]:
+        """Return owner and whether the lease file is stale."""
+        try:
+            stale = path.stat().st_mtime + self.ttl < time.time()
+            text = path.read_text()
+        except FileNotFoundError:
+            return None, True
+        try:
+            owner = json.loads(text)["node"]
+        except (ValueError, KeyError, TypeError):
+            # not written yet or half written by a crashed instance
+            owner = None
+        return owner, stale
+
+    def _create(self, path: Path) -> bool:
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, "w") as f:
+            json.dump({"node": self.node_id, "since": time.time()}, f)
+        return True
+
+    def _acquire(self, url_key: str) -> bool:
+        path = self._path(url_key)
+        if self._create(path):
+            return True
+        owner, stale = self._read(path)
+        if owner == self.node_id and not stale:
+            return True
+        if not stale:
+            return False
+
+        # only one instance wins the rename of a stale lease
+        moved = path.with_name(f"{path.name}.{self.node_id}")
+        try:
+            os.rename(path, moved)
+        except FileNotFoundError:
+            return False
+        if moved.stat().st_mtime + self.ttl >= time.time():
+            # another instance took over in between: give its fresh lease back
+            try:
+                os.link(moved, path)
+            except FileExistsError:
+                pass
+            moved.unlink()
+            return False
+        moved.unlink()
+        lolg.info("Taking over stale claim of '{}' by '{}'", url_key, owner)
+        LEASES.labels(result="takeover").inc()
+        return self._create(path)
+
+    def _renew(self, url_key: str) -> bool:
+        path = self._path(url_key)
+        if self._read(path)[0] != self.node_id:
+            return False
+        os.utime(path)
+        return True
+
+    def _release(self, url_key: str):
+        path = self._path(url_key)
+        if self._read(path)[0] == self.node_id:
+            path.unlink(missing_ok=True)
+
+    def holder(self, url_key: str) -> str | None:
+        owner, stale = self._read(self._path(url_key))
+        return None if stale else owner
+
+
+class RespClient:
+    """Minimal client for the Redis serialization protocol (RESP2)."""
+
+    def __init__(self, url: str, timeout: float = 5):
+        parts = urlsplit(url)
+        self.host = parts.hostname or "localhost"
+        self.port = parts.port or 6379
+        self.password = parts.password
+        self.db = int(parts.path.lstrip("/") or 0)
+        self.timeout = timeout
+        self._sock: socket.socket | None = None
+        self._file = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        self._sock = socket.create_connection((self.host, self.port), self.timeout)
+        self._file = self._sock.makefile("rb")
+        if self.password:
+            self._call("AUTH", self.password)
+        if self.db:
+            self._call("SELECT", self.db)
+
+    def close(self):
+        if self._sock is not None:
+            self._sock.close()
+        self._sock = self._file = None
+
+    def _read_reply(self):
+        line = self._file.readline()
+        if not line:
+            raise ConnectionError("Connection closed by server")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload.decode()
+        if kind == b"-":
+            raise RespError(payload.decode())
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            if (length := int(payload)) < 0:
+                return None
+            data = self._file.read(length + 2)
+            return data[:-2].decode()
+        if kind == b"*":
+            if (length := int(payload)) < 0:
+                return None
+            return [self._read_reply() for _ in range(length)]
+        raise RespError(f"Unknown reply type: {line!r}")
+
+    def _call(self, *args):
+        encoded = [str(arg).encode() for arg in args]
+        command = b"*%d\r\n" % len(encoded) + b"".join(
+            b"$%d\r\n%s\r\n" % (len(arg), arg) for arg in encoded
+        )
+        self._sock.sendall(command)
+        return self._read_reply()
+
+    def execute(self, *args):
+        """Send a command and return its reply. Reconnect once after connection errors."""
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    if self._sock is None:
+                        self._connect()
+                    return self._call(*args)
+                except OSError:
+                    self.close()
+                    if attempt:
+                        raise
+
+
+class RedisCoordinator(Coordinator):
+    """
+    Leases as expiring keys on a Redis-compatible server.
+    Renewal and release check the owner and act in one script, so a lease that expired
+    and was taken over in between is never extended or deleted.
+    """
+
+    RENEW_SCRIPT = (
+        "if redis.call('GET', KEYS[1]) == ARGV[1] then "
+        "return redis.call('PEXPIRE', KEYS[1], ARGV[2]) else return 0 end"
+    )
+    RELEASE_SCRIPT = (
+        "if redis.call('GET', KEYS[1]) == ARGV[1] then "
+        "return redis.call('DEL', KEYS[1]) else return 0 end"
+    )
+
+    def __init__(self, node_id: str, ttl: float, url: str, prefix: str = "hylde"):
+        super().__init__(node_id, ttl)
+        self.client = RespClient(url)
+        self.prefix = prefix
+
+    def _key(self, url_key: str) -> str:
+        return f"{self.prefix}:lease:{url_key}"
+
+    def _acquire(self, url_key: str) -> bool:
+        key = self._key(url_key)
+        if self.client.execute(
+            "SET", key, self.node_id, "NX", "PX", int(self.ttl * 1000)
+        ):
+            return True
+        return self.client.execute("GET", key) == self.node_id
+
+    def _renew(self, url_key: str) -> bool:
+        return bool(
+            self.client.execute(
+                "EVAL",
+                self.RENEW_SCRIPT,
+                1,
+                self._key(url_key),
+                self.node_id,
+                int(self.ttl * 1000),
+            )
+        )
+
+    def _release(self, url_key: str):
+        self.client.execute(
+            "EVAL", self.RELEASE_SCRIPT, 1, self._key(url_key), self.node_id
+        )
+
+    def holder(self, url_key: str) -> str | None:
+        try:
+            return self.client.execute("GET", self._key(url_key))
+        except (OSError, RespError) as e:
+            lolg.warning("Could not look up claim on '{}': {}", url_key, e)
+            return None
+
+
+def get_coordinator() -> Coordinator:
+    """Return the coordinator configured in `coordination.backend`."""
+    config = settings.coordination
+    node_id = config.nodeid or default_node_id()
+    if config.backend == "local":
+        return LocalCoordinator(node_id, config.leasettl)
+    lolg.info("Coordinating downloads through '{}' as '{}'", config.backend, node_id)
+    if config.backend == "file":
+        directory = config.directory or Path(settings.cachedir) / ".leases"
+        return FileCoordinator(node_id, config.leasettl, directory)
+    if config.backend == "redis":
+        return RedisCoordinator(node_id, config.leasettl, config.redisurl)
+    raise ValueError(f"Unknown coordination backend: {config.backend}")
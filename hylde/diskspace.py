@@ -0,0 +1,321 @@
+import os
+import shutil
+import threading
+import time
+from collections.abc import Callable
+from contextlib import contextmanager
+from pathlib import Path
+
+from hylde import cancellation, lolg, metrics, progress, settings
+
+ADMISSIONS = metrics.Counter(
+    "hylde_disk_admissions_total",
+    "Downloads by admission result (admitted, deferred, rejected).",
+    ("result",),
+)
+EVICTED_BYTES = metrics.Counter(
+    "hylde_disk_evicted_bytes_total",
+    "Bytes of cached files deleted to make room for downloads.",
+)
+
+
+class DiskFull(Exception):
+    """There is not enough free space for a download, even after waiting and evicting."""
+
+    def __init__(self, directory: Path, missing: int):
+        super().__init__(f"{missing} more bytes needed in '{directory}'")
+        self.directory = directory
+        self.missing = missing
+
+
+def _existing(path: Path) -> Path:
+    """Return path or its closest existing parent, downloaders create their directories late."""
+    while not path.exists() and path != path.parent:
+        path = path.parent
+    return path
+
+
+def _device(path: Path) -> int:
+    return os.stat(_existing(path)).st_dev
+
+
+def _free(path: Path) -> int:
+    return shutil.disk_usage(_existing(path)).free
+
+
+class Reservation:
+    """
+    Space a single download holds until its result is in the cache.
+    - Its download directory holds the estimated size minus the bytes already written.
+    - The cache directory holds the full size as well if it is another volume, because
+      moving the files into the cache copies them, plus `ingest` bytes for zipping.
+    - Hedged attempts of the download share it and it holds the largest of their sizes.
+    """
+
+    def __init__(self, url_key: str, nbytes: int, cache_dir: Path):
+        self.url_key = url_key
+        self.nbytes = nbytes
+        self.estimated = True
+        # sizes reported by the attempts of a download, hedged attempts have their own tokens
+        self.sizes: dict[cancellation.CancelToken | None, int] = {}
+        self.ingest = 0
+        self.cache_dir = cache_dir
+        self.download_dir = cache_dir
+        self.cache_device = self._download_device = _device(cache_dir)
+
+    def set_download_dir(self, directory: Path):
+        self.download_dir = directory
+        self._download_device = _device(directory)
+
+    def volumes(self) -> dict[int, Path]:
+        return {
+            self._download_device: self.download_dir,
+            self.cache_device: self.cache_dir,
+        }
+
+    def remaining(self) -> int:
+        """Return the bytes the downloader has yet to write."""
+        p = progress.get(self.url_key)
+        return max(self.nbytes - (p.bytes_done if p else 0), 0)
+
+    def held(self, device: int) -> int:
+        """Return the bytes held on the volume device."""
+        held = 0
+        if device == self._download_device:
+            held += self.remaining()
+        if device == self.cache_device:
+            if device != self._download_device:
+                held += self.nbytes
+            held += self.ingest
+        return held
+
+    def as_dict(self) -> dict:
+        return {
+            "url_key": self.url_key,
+            "bytes": self.nbytes,
+            "estimated": self.estimated,
+            "remaining": self.remaining(),
+            "ingest": self.ingest,
+            "download_dir": str(self.download_dir),
+        }
+
+
+# admitted downloads by url_key
+_reservations: dict[str, Reservation] = {}
+# url keys waiting for space
+_waiting: set[str] = set()
+# released reservations wake up waiting downloads
+_condition = threading.Condition()
+_select_evictions: Callable[[int], list[tuple[str, int]]] | None = None
+_evict: Callable[[str], None] | None = None
+# one download at a time deletes cached files, the others wait for the space it freed
+_evicting = False
+
+
+def set_evictor(
+    select: Callable[[int], list[tuple[str, int]]] | None,
+    evict: Callable[[str], None] | None = None,
+):
+    """
+    Set the function that picks the cached files to delete to free at least n bytes, as
+    url keys and sizes, and the function that deletes the cached files of a url key.
+    """
+    global _select_evictions, _evict
+    _select_evictions, _evict = select, evict
+
+
+def _shortfall(reservation: Reservation) -> tuple[Path, int] | None:
+    """Return the first directory without room for reservation and the bytes it lacks."""
+    for device, directory in reservation.volumes().items():
+        needed = settings.diskspace.minfree + sum(
+            other.held(device)
+            for other in _reservations.values()
+            if other is not reservation
+        )
+        needed += reservation.held(device)
+        if (missing := needed - _free(directory)) > 0:
+            return directory, missing
+    return None
+
+
+def _make_room(reservation: Reservation) -> tuple[Path, int] | None:
+    """
+    Evict cached files if reservation does not fit. Return the shortfall that remains.
+    Called with `_condition` held, which is released while the files are deleted.
+    """
+    global _evicting
+    while _evicting:
+        _condition.wait()
+    shortfall = _shortfall(reservation)
+    if (
+        shortfall is None
+        or not settings.diskspace.evict
+        or _select_evictions is None
+        or _evict is None
+        or _device(shortfall[0]) != reservation.cache_device
+    ):
+        return shortfall
+
+    if not (evictions := _select_evictions(shortfall[1])):
+        return shortfall
+    lolg.info(
+        "Evicting {} cached files to free {} bytes for '{}'...",
+        len(evictions),
+        shortfall[1],
+        reservation.url_key,
+    )
+    _evicting = True
+    _condition.release()
+    try:
+        for url_key, nbytes in evictions:
+            _evict(url_key)
+            EVICTED_BYTES.inc(nbytes)
+    finally:
+        _condition.acquire()
+        _evicting = False
+        _condition.notify_all()
+    return _shortfall(reservation)
+
+
+@contextmanager
+def admit(url_key: str, cache_dir: Path):
+    """
+    Reserve space for a download of unknown size before it starts and release it when
+    its result is in the cache. Wait up to `maxwait` seconds for space that running
+    downloads free up or eviction makes. Raise DiskFull if there is none by then.
+    """
+    if not settings.diskspace.enabled:
+        yield None
+        return
+
+    reservation = Reservation(url_key, settings.diskspace.defaultestimate, cache_dir)
+    token = cancellation.get(url_key)
+    deadline = time.monotonic() + settings.diskspace.maxwait
+    with _condition:
+        try:
+            while (shortfall := _make_room(reservation)) is not None:
+                directory, missing = shortfall
+                if (remaining := deadline - time.monotonic()) <= 0:
+                    ADMISSIONS.labels(result="rejected").inc()
+                    raise DiskFull(directory, missing)
+                if url_key not in _waiting:
+                    ADMISSIONS.labels(result="deferred").inc()
+                    lolg.warning(
+                        "Deferring '{}' until {} more bytes are free in '{}'",
+                        url_key,
+                        missing,
+                        directory,
+                    )
+                    _waiting.add(url_key)
+                # wake up now and then to notice files deleted outside of hylde
+                _condition.wait(min(remaining, 1))
+                if token is not None:
+                    token.check()
+        finally:
+            _waiting.discard(url_key)
+        ADMISSIONS.labels(result="admitted").inc()
+        _reservations[url_key] = reservation
+    try:
+        yield reservation
+    finally:
+        with _condition:
+            _reservations.pop(url_key, None)
+            _condition.notify_all()
+
+
+def _resize(
+    url_key: str,
+    nbytes: int | None = None,
+    download_dir: Path | None = None,
+    ingest: int | None = None,
+):
+    """Change the reservation of a running download. Keep the old one and raise DiskFull if the new one does not fit."""
+    if (reservation := _reservations.get(url_key)) is None:
+        return
+    with _condition:
+        previous = (reservation.nbytes, reservation.estimated, reservation.ingest)
+        previous_dir = reservation.download_dir
+        previous_sizes = dict(reservation.sizes)
+        if nbytes:
+            reservation.sizes[cancellation.current()] = nbytes
+            reservation.nbytes = max(reservation.sizes.values())
+            reservation.estimated = False
+        if download_dir is not None:
+            reservation.set_download_dir(download_dir)
+        if ingest is not None:
+            reservation.ingest = ingest
+        if (shortfall := _make_room(reservation)) is not None:
+            reservation.nbytes, reservation.estimated, reservation.ingest = previous
+            reservation.set_download_dir(previous_dir)
+            reservation.sizes = previous_sizes
+            raise DiskFull(*shortfall)
+        # a smaller estimate leaves room for waiting downloads
+        _condition.notify_all()
+
+
+def reserve(url_key: str, nbytes: int | None, download_dir: Path | None = None):
+    """
+    Replace the estimate of a running download with the size its downloader learned from
+    Content-Length, extractor metadata or JDownloader, written to download_dir.
+    Raise DiskFull rather than starting to write into a full volume.
+    """
+    if nbytes:
+        _resize(url_key, nbytes=nbytes, download_dir=download_dir)
+
+
+def reserve_ingest(url_key: str, nbytes: int):
+    """Reserve space for copying nbytes into the cache directory, e.g. into a ZIP file."""
+    _resize(url_key, ingest=nbytes)
+
+
+def get(url_key: str) -> Reservation | None:
+    return _reservations.get(url_key)
+
+
+def reserved() -> int:
+    """Return the bytes all downloads have yet to write."""
+    return sum(r.remaining() for r in list(_reservations.values()))
+
+
+def get_status() -> dict:
+    """Return the free and reserved space of every volume in use and all reservations."""
+    with _condition:
+        reservations = list(_reservations.values())
+        waiting = sorted(_waiting)
+    volumes: dict[int, Path] = {}
+    for reservation in reservations:
+        for device, directory in reservation.volumes().items():
+            volumes.setdefault(device, directory)
+    return {
+        "volumes": [
+            {
+                "path": str(directory),
+                "free": _free(directory),
+                "reserved": sum(r.held(device) for r in reservations),
+            }
+            for device, directory in volumes.items()
+        ],
+        "reservations": [r.as_dict() for r in reservations],
+        "deferred": waiting,
+    }
+
+
+def reset():
+    global _evicting
+    with _condition:
+        _evicting = False
+        _reservations.clear()
+        _waiting.clear()
+        _condition.notify_all()
+
+
+metrics.Gauge(
+    "hylde_disk_reserved_bytes",
+    "Bytes reserved for running downloads that are not written yet.",
+    reserved,
+)
+metrics.Gauge(
+    "hylde_disk_deferred_downloads",
+    "Downloads waiting for free disk space.",
+    lambda: len(_waiting),
+)
@@ -0,0 +1,282 @@
+import mimetypes
+import os
+import re
+import shutil
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import unquote, urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from hylde import cancellation, diskspace, lolg, progress, ratelimit, settings, tracing
+
+# permanent errors, everything else is worth another try
+FAILED_STATUS_CODES = (400, 401, 403, 404, 405, 410, 451)
+
+_lock = threading.Lock()
+_session: requests.Session | None = None
+
+
+def _setting(name: str, default):
+    return settings.get(f"downloader.direct.{name}", default)
+
+
+def _staging_dir() -> Path:
+    """Stage downloads next to the cache so ingesting them is a rename."""
+    if staging_dir := _setting("stagingdir", ""):
+        return Path(staging_dir)
+    return Path(settings.cachedir) / ".staging" / "direct"
+
+
+def get_session() -> requests.Session:
+    """Return the shared keep-alive session."""
+    global _session
+    with _lock:
+        if _session is None:
+            poolsize = _setting("poolsize", 16)
+            adapter = HTTPAdapter(pool_connections=poolsize, pool_maxsize=poolsize)
+            _session = requests.Session()
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+            _session.headers["User-Agent"] = _setting(
+                "useragent", requests.utils.default_user_agent()
+            )
+        return _session
+
+
+class _RangeNotSatisfied(Exception):
+    """The server ignored or rejected a Range request."""
+
+
+class _Transfer:
+    """
+    Byte counter of a single download that reports to `hylde.progress`.
+    Raises Cancelled on the next chunk once the download is cancelled, also in segment threads.
+    """
+
+    def __init__(self, url_key: str, bytes_total: int | None):
+        self.url_key = url_key
+        self.bytes_total = bytes_total
+        self.bytes_done = 0
+        self.token = cancellation.current()
+        self._lock = threading.Lock()
+
+    def add(self, n_bytes: int):
+        if self.token is not None:
+            self.token.check()
+        with self._lock:
+            self.bytes_done += n_bytes
+            bytes_done = self.bytes_done
+        progress.update(self.url_key, bytes_done, self.bytes_total)
+
+
+def _file_name(url: str, response: requests.Response) -> str:
+    disposition = response.headers.get("Content-Disposition", "")
+    if match := re.search(
+        r"filename\*=(?:UTF-8'')?([^;]+)", disposition, re.IGNORECASE
+    ):
+        name = unquote(match.group(1).strip('"'))
+    elif match := re.search(r'filename="?([^";]+)"?', disposition, re.IGNORECASE):
+        name = match.group(1)
+    else:
+        name = unquote(urlsplit(url).path.rsplit("/", 1)[-1])
+
+    name = re.sub(r'[\\/:*?"<>|\x00-\x1f]', "_", name).strip(" .")
+    if not name:
+        content_type = response.headers.get("Content-Type", "").split(";")[0]
+        name = "file" + (mimetypes.guess_extension(content_type) or "")
+    return name[:200]
+
+
+def _retry_after(response: requests.Response) -> float | None:
+    try:
+        return float(response.headers["Retry-After"])
+    except (KeyError, ValueError):
+        return None
+
+
+def _content_length(response: requests.Response) -> int | None:
+    try:
+        return int(response.headers["Content-Length"])
+    except (KeyError, ValueError):
+        return None
+
+
+def _stream(response: requests.Response, f, transfer: _Transfer):
+    for chunk in response.iter_content(_setting("chunksize", 1 << 20)):
+        f.write(chunk)
+        transfer.add(len(chunk))
+
+
+def _write_range(
+    response: requests.Response, path: Path, start: int, end: int, transfer: _Transfer
+):
+    """Write the body of response to bytes start to end of a preallocated file."""
+    offset = start
+    with open(path, "r+b") as f:
+        for chunk in response.iter_content(_setting("chunksize", 1 << 20)):
+            os.pwrite(f.fileno(), chunk, offset)
+            offset += len(chunk)
+            transfer.add(len(chunk))
+    if offset != end + 1:
+        raise requests.exceptions.ChunkedEncodingError(
+            f"Segment {start}-{end} ended at {offset}"
+        )
+
+
+def _fetch_segment(url: str, path: Path, start: int, end: int, transfer: _Transfer):
+    headers = {"Range": f"bytes={start}-{end}"}
+    timeout = _setting("timeout", 30)
+    with get_session().get(url, headers=headers, stream=True, timeout=timeout) as r:
+        r.raise_for_status()
+        if r.status_code != 206 or not r.headers.get("Content-Range", "").startswith(
+            f"bytes {start}-"
+        ):
+            raise _RangeNotSatisfied(
+                f"{r.status_code} {r.headers.get('Content-Range')}"
+            )
+        _write_range(r, path, start, end, transfer)
+
+
+def _fetch_segments(
+    first: requests.Response, path: Path, first_end: int, size: int, transfer: _Transfer
+):
+    """
+    Download size bytes into a preallocated file: the first response supplies bytes 0
+    to first_end while parallel Range requests fetch the rest.
+    """
+    rest = size - first_end - 1
+    n_segments = min(
+        _setting("segments", 4) - 1,
+        max(rest // _setting("minsegmentsize", 4 << 20), 1),
+    )
+    bounds = [first_end + 1 + rest * i // n_segments for i in range(n_segments + 1)]
+    with open(path, "wb") as f:
+        f.truncate(size)
+    with ThreadPoolExecutor(n_segments + 1, thread_name_prefix="hylde-direct") as pool:
+        futures = [pool.submit(_write_range, first, path, 0, first_end, transfer)]
+        futures += [
+            pool.submit(
+                _fetch_segment, first.url, path, bounds[i], bounds[i + 1] - 1, transfer
+            )
+            for i in range(n_segments)
+        ]
+        for future in futures:
+            future.result()
+
+
+def _first_range(response: requests.Response) -> tuple[int, int] | None:
+    """Return the last byte and the size of a partial response that starts the file."""
+    match = re.fullmatch(
+        r"bytes 0-(\d+)/(\d+)", response.headers.get("Content-Range", "")
+    )
+    if response.status_code != 206 or match is None:
+        return None
+    return int(match[1]), int(match[2])
+
+
+def _open(url: str, timeout: float) -> requests.Response:
+    """
+    GET url. With segments, ask for the first `segmentthreshold` bytes only: smaller files
+    still arrive in one response and larger ones start with their first segment.
+    """
+    if _setting("segments", 4) <= 1:
+        return get_session().get(url, stream=True, timeout=timeout)
+    end = _setting("segmentthreshold", 16 << 20) - 1
+    headers = {"Range": f"bytes=0-{end}"}
+    r = get_session().get(url, headers=headers, stream=True, timeout=timeout)
+    if r.status_code == 416 or (
+        r.status_code == 206
+        and ("Content-Encoding" in r.headers or _first_range(r) is None)
+    ):
+        # empty files and ranges of encoded or unknown sizes: ask for everything
+        r.close()
+        return get_session().get(url, stream=True, timeout=timeout)
+    return r
+
+
+def download_url(url: str, url_key: str) -> list[Path] | None:
+    """Download file for url. Return full file paths. Return empty list on retryable problems. Return None if download failed."""
+    job_dir = _staging_dir() / url_key
+    target_dir = job_dir / f"{uuid.uuid4()}"
+    timeout = _setting("timeout", 30)
+    try:
+        with _open(url, timeout) as r:
+            if r.status_code in FAILED_STATUS_CODES:
+                lolg.error(
+                    "Direct download of '{}' failed with {}", url_key, r.status_code
+                )
+                return None
+            if r.status_code in (429, 503):
+                ratelimit.throttled(url, _retry_after(r))
+            r.raise_for_status()
+            if r.headers.get("Content-Type", "").startswith("text/html"):
+                lolg.error("Direct download of '{}' returned a web page", url_key)
+                return None
+
+            first = _first_range(r)
+            size = first[1] if first is not None else _content_length(r)
+            diskspace.reserve(url_key, size, _staging_dir())
+            path = target_dir / _file_name(r.url, r)
+            os.makedirs(target_dir, exist_ok=True)
+            transfer = _Transfer(url_key, size)
+            if first is None or first[0] + 1 >= size:
+                with (
+                    tracing.span("direct.transfer", url_key, size=size),
+                    open(path, "wb") as f,
+                ):
+                    _stream(r, f, transfer)
+            else:
+                try:
+                    with tracing.span("direct.segments", url_key, size=size):
+                        _fetch_segments(r, path, first[0], size, transfer)
+                except _RangeNotSatisfied as e:
+                    lolg.warning(
+                        "Range requests for '{}' failed ({}). Retrying as one stream...",
+                        url_key,
+                        e,
+                    )
+                    transfer = _Transfer(url_key, size)
+                    with (
+                        tracing.span("direct.transfer", url_key, size=size),
+                        get_session().get(r.url, stream=True, timeout=timeout) as retry,
+                        open(path, "wb") as f,
+                    ):
+                        retry.raise_for_status()
+                        _stream(retry, f, transfer)
+
+        if size is not None and path.stat().st_size != size:
+            lolg.warning(
+                "Direct download of '{}' is incomplete: {} of {} bytes",
+                url_key,
+                path.stat().st_size,
+                size,
+            )
+            shutil.rmtree(job_dir, ignore_errors=True)
+            return []
+    except (requests.RequestException, OSError) as e:
+        lolg.warning("Direct download of '{}' failed: {}", url_key, e)
+        shutil.rmtree(job_dir, ignore_errors=True)
+        return []
+    except cancellation.Cancelled:
+        lolg.info("Direct download of '{}' was cancelled", url_key)
+        shutil.rmtree(job_dir, ignore_errors=True)
+        raise
+    except diskspace.DiskFull as e:
+        lolg.warning("No room for direct download of '{}': {}", url_key, e)
+        shutil.rmtree(job_dir, ignore_errors=True)
+        raise
+
+    lolg.debug("Direct download of '{}' finished: {}", url_key, path)
+    return [path]
+
+
+def cleanup(url_key: str):
+    """Delete the staging directory of url_key after ingest or an interrupted download."""
+    job_dir = _staging_dir() / url_key
+    if job_dir.exists():
+        lolg.debug("Deleting staging directory '{}' of '{}'", job_dir, url_key)
+        shutil.rmtree(job_dir, ignore_errors=True)
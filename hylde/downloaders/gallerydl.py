@@ -1,11 +1,24 @@
+import os
+import re
+import shutil
 import tempfile
 import uuid
 from pathlib import Path
 
 import gallery_dl as gdl  # type:ignore
 import gallery_dl.path  # type:ignore
+from gallery_dl.extractor.message import Message  # type:ignore
 
-from hylde import lolg
+from hylde import (
+    cancellation,
+    diskspace,
+    lolg,
+    progress,
+    ratelimit,
+    settings,
+    tracing,
+)
+from hylde.util import TTLCache
 
 
 output_dir = Path(tempfile.gettempdir()) / "hylde" / "gallerydl"  # TODO expose setting
@@ -13,8 +26,24 @@ output_dir = Path(tempfile.gettempdir()) / "hylde" / "gallerydl"  # TODO expose
 gdl.config.set(("extractor",), "base-directory", output_dir.as_posix())
 gdl.config.set(("extractor",), "retries", 0)
 gdl.config.set(("downloader",), "retries", 0)
+gdl.config.set(("downloader",), "progress", 0.5)
 gdl.config.set(("output",), "mode", "null")
 
+# page url -> extractor messages (direct file urls + metadata)
+_resolved = TTLCache(
+    maxsize=settings.get("downloader.gallerydl.extractcachesize", 4096),
+    ttl=settings.get("downloader.gallerydl.extractcachettl", 3600),
+)
+# direct file url -> url_key of the download that fetched it
+_media_owners = TTLCache(
+    maxsize=settings.get("downloader.gallerydl.extractcachesize", 4096),
+    ttl=settings.get("downloader.gallerydl.extractcachettl", 3600),
+)
+
+
+class _RetryLater(Exception):
+    """The host throttled or cut off the transfer, extracting again would not help."""
+
 
 class FileCollector:
     url_key: str
@@ -25,25 +54,56 @@ class FileCollector:
         self.url_key = url_key
         self.files = []
         self.errors = []
-        lolg.debug(f"Created FileCollector for '{url_key}'")
+        lolg.debug("Created FileCollector for '{}'", url_key)
 
     def filepath_hook(self, pathfmt: gallery_dl.path.PathFormat):
-        lolg.debug(f"[{self.url_key}] gallerydl returned filepath: {pathfmt.path}")
+        lolg.debug("[{}] gallerydl returned filepath: {}", self.url_key, pathfmt.path)
         self.files.append(Path(pathfmt.path))
 
     def error_hook(self, pathfmt: gallery_dl.path.PathFormat):
-        lolg.debug(f"[{self.url_key}] gallerydl returned error for: {pathfmt.path}")
+        lolg.debug("[{}] gallerydl returned error for: {}", self.url_key, pathfmt.path)
         self.errors.append(Path(pathfmt.path))
 
 
+class ProgressOutput(gdl.output.NullOutput):
+    """
+    Forward gallery-dl download progress to `hylde.progress`.
+    Stops the running file download once the download is cancelled.
+    """
+
+    def __init__(self, url_key):
+        self.url_key = url_key
+        self.bytes_finished = 0
+        self.token = cancellation.current()
+
+    def progress(self, bytes_total, bytes_downloaded, bytes_per_second):
+        if self.token is not None:
+            self.token.check()
+        progress.update(
+            self.url_key,
+            self.bytes_finished + bytes_downloaded,
+            self.bytes_finished + bytes_total if bytes_total else None,
+        )
+
+    def success(self, path):
+        self.bytes_finished += os.path.getsize(path)
+        progress.update(self.url_key, self.bytes_finished)
+
+
+# gallery-dl reports HTTP errors as "'429 Too Many Requests' for '<url>'"
+_THROTTLED_RE = re.compile(r"'(?:429|503) [A-Z]")
+
+
 class _IncompleteReadAdapter(gdl.output.LoggerAdapter):
-    """Detect IncompleteRead messages in gallery-dl logs."""
+    """Detect IncompleteRead and upstream throttling messages in gallery-dl logs."""
 
     def __init__(self, logger, job):
         super().__init__(logger, job)
         self._job = job
 
     def _check(self, msg, args):
+        if any(_THROTTLED_RE.search(str(arg)) for arg in (msg, *args)):
+            self._job.was_throttled = True
         if "IncompleteRead" in str(msg):
             self._job.has_incomplete_read = True
             return
@@ -61,10 +121,25 @@ class _IncompleteReadAdapter(gdl.output.LoggerAdapter):
         super().error(msg, *args, **kwargs)
 
 
-class GoodJob(gdl.job.DownloadJob):
-    """`job.DownloadJob` with `file` hooks enabled."""
+class ResolveJob(gdl.job.Job):
+    """`job.Job` that only runs the extractor and keeps its messages."""
 
     def __init__(self, url, parent=None):
+        super().__init__(url, parent)
+        self.messages = []
+
+    def dispatch(self, messages):
+        msg = None
+        for msg in messages:
+            cancellation.check()
+            self.messages.append(msg)
+        return msg
+
+
+class GoodJob(gdl.job.DownloadJob):
+    """`job.DownloadJob` with `file` hooks enabled that can replay resolved messages."""
+
+    def __init__(self, url, parent=None, messages=None):
         gdl.job.Job.__init__(self, url, parent)
         self.hooks = {"file": [], "error": []}
         self.log = self.get_logger("download")
@@ -77,34 +152,162 @@ class GoodJob(gdl.job.DownloadJob):
         self._extractor_filter = None
         self._skipcnt = 0
         self.has_incomplete_read = False
+        self.was_throttled = False
+        self.messages = messages
 
     def _wrap_logger(self, logger):
         return _IncompleteReadAdapter(logger, self)
 
+    def handle_url(self, url, kwdict):
+        cancellation.check()
+        super().handle_url(url, kwdict)
 
-def download_url(url: str, url_key: str) -> list[Path] | None:
-    """Download file for url. Return full file paths. Return empty list on retryable problems. Return None if download failed."""
-    gdl.config.set(("extractor",), "directory", [f"{uuid.uuid4()}"])
+    def dispatch(self, messages):
+        if self.messages is not None:
+            # skip the extractor and download the already resolved files
+            messages = [(msg, url, dict(kwdict)) for msg, url, kwdict in self.messages]
+        return super().dispatch(messages)
+
+
+def _get_media_urls(messages: list) -> list[str]:
+    return [url for msg, url, _ in messages if msg == Message.Url]
+
+
+def _get_filesize(messages: list) -> int | None:
+    """Return the total size of the files if the extractor tells it for all of them."""
+    sizes = [
+        kwdict.get("filesize") for msg, _, kwdict in messages if msg == Message.Url
+    ]
+    if not sizes or not all(isinstance(size, int) for size in sizes):
+        return None
+    return sum(sizes)
+
+
+def _remember_media(url_key: str, messages: list):
+    media_urls = _get_media_urls(messages)
+    if len(media_urls) == 1:
+        _media_owners.set(media_urls[0], url_key)
+
+
+def _reuse_media(url_key: str, messages: list) -> list[Path] | None:
+    """Link the file of an earlier download of the same media url into a temp directory."""
+    media_urls = _get_media_urls(messages)
+    if len(media_urls) != 1:
+        return None
+    owner = _media_owners.get(media_urls[0])
+    if owner is None or owner == url_key:
+        return None
+
+    owner_dir = Path(settings.cachedir) / owner
+    source = next(owner_dir.iterdir(), None) if owner_dir.exists() else None
+    if source is None:
+        lolg.debug(
+            "[{}] Cached file of '{}' is gone. Downloading again...", url_key, owner
+        )
+        _media_owners.pop(media_urls[0])
+        return None
+
+    target = output_dir / url_key / f"{uuid.uuid4()}" / source.name
+    os.makedirs(target.parent, exist_ok=True)
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+    lolg.info("[{}] Reusing '{}' which resolved to the same media url", url_key, source)
+    return [target]
+
+
+def _download(
+    url: str, url_key: str, messages: list, session=None
+) -> list[Path] | None:
+    diskspace.reserve(url_key, _get_filesize(messages), output_dir)
+    job_id = f"{uuid.uuid4()}"
+    gdl.config.set(("extractor",), "directory", [url_key, job_id])
     fc = FileCollector(url_key=url_key)
-    job = GoodJob(url)
+    job = GoodJob(url, messages=messages)
+    job.out = ProgressOutput(url_key)
+    if session is not None:
+        # keep cookies acquired during extraction
+        job.extractor.session = session
     job.register_hooks(hooks={"file": fc.filepath_hook, "error": fc.error_hook})
-    job.run()
+    try:
+        with tracing.span("gallerydl.transfer", url_key, replay=session is None):
+            job.run()
+    except cancellation.Cancelled:
+        lolg.info("[{}] gallerydl download was cancelled", url_key)
+        shutil.rmtree(output_dir / url_key / job_id, ignore_errors=True)
+        raise
 
     if job.has_incomplete_read:
         lolg.warning(
-            f"gallerydl IncompleteRead for '{url_key}' — treating as retryable"
+            "gallerydl IncompleteRead for '{}' — treating as retryable", url_key
         )
         for f in fc.files:
             if f.exists():
                 f.unlink()
-                lolg.debug(f"Deleted partial temp file '{f}'")
-        return []
+                lolg.debug("Deleted partial temp file '{}'", f)
+        raise _RetryLater
+
+    if job.was_throttled:
+        lolg.warning(
+            "gallerydl was throttled for '{}' — treating as retryable", url_key
+        )
+        ratelimit.throttled(url)
+        for f in fc.files:
+            if f.exists():
+                f.unlink()
+        raise _RetryLater
 
     if fc.errors:
-        lolg.error(f"gallerydl returned {len(fc.errors)} errors for '{url_key}'")
+        lolg.error("gallerydl returned {} errors for '{}'", len(fc.errors), url_key)
         return None
 
     if not fc.files:
-        lolg.error(f"gallerydl returned no filepaths for '{url_key}'.")
+        lolg.error("gallerydl returned no filepaths for '{}'.", url_key)
 
     return fc.files
+
+
+def download_url(url: str, url_key: str) -> list[Path] | None:
+    """Download file for url. Return full file paths. Return empty list on retryable problems. Return None if download failed."""
+    try:
+        return _download_url(url, url_key)
+    except _RetryLater:
+        # leave the next attempt to the retry scheduler instead of hitting the host again
+        return []
+
+
+def _download_url(url: str, url_key: str) -> list[Path] | None:
+    if (messages := _resolved.get(url)) is not None:
+        lolg.debug("[{}] Using cached extractor results for '{}'", url_key, url)
+        # only errors or missing files mean the cached direct urls went stale
+        if files := _download(url, url_key, messages):
+            return files
+        lolg.debug("[{}] Cached extractor results failed. Extracting again...", url_key)
+        _resolved.pop(url)
+
+    resolver = ResolveJob(url)
+    with tracing.span("gallerydl.extract", url_key):
+        resolver.run()
+    if not resolver.messages:
+        lolg.error("gallerydl extractor returned no results for '{}'.", url_key)
+        return []
+
+    if files := _reuse_media(url_key, resolver.messages):
+        return files
+
+    files = _download(
+        url, url_key, resolver.messages, session=resolver.extractor.session
+    )
+    if files:
+        _resolved.set(url, resolver.messages)
+        _remember_media(url_key, resolver.messages)
+    return files
+
+
+def cleanup(url_key: str):
+    """Delete the temp directory of url_key after ingest or an interrupted download."""
+    job_dir = output_dir / url_key
+    if job_dir.exists():
+        lolg.debug("[{}] Deleting temp directory '{}'", url_key, job_dir)
+        shutil.rmtree(job_dir, ignore_errors=True)
@@ -1,6 +1,12 @@
+import json
+import threading
 import time
 from pathlib import Path
+from urllib.parse import quote
 
+import requests
+from pyjd.direct_connection_helper import DirectConnectionHelper  # type:ignore
+from pyjd.direct_connector import DirectConnector  # type:ignore
 from pyjd.myjd_connector import MyJDConnector, JDDevice  # type:ignore
 from pyjd.jd_types import (  # type:ignore
     AddLinksQuery,
@@ -13,34 +19,114 @@ from pyjd.jd_types import (  # type:ignore
     SelectionType,
 )
 
-from hylde import lolg, settings
+from hylde import cancellation, diskspace, lolg, metrics, progress, settings, tracing
 
 JDD: JDDevice
 
 ERROR_MESSAGES = ("An Error occurred!", "File not found")
 
+# transports: the MyJDownloader cloud relay or the local "Deprecated API" of the device
+MYJD = "myjd"
+LOCAL = "local"
 
-if (
-    settings.downloader.jdownloader.email == "TO BE SET"
-    or settings.downloader.jdownloader.password == "TO BE SET"
-):
-    raise ValueError("MyJDownloader API credentials not set.")
+API_CALLS = metrics.Counter(
+    "hylde_jdownloader_api_calls_total",
+    "JDownloader API call attempts by call and result.",
+    ("call", "result"),
+)
+API_CALL_DURATION = metrics.Histogram(
+    "hylde_jdownloader_api_call_duration_seconds",
+    "Latency of JDownloader API call attempts.",
+    ("call",),
+)
+
+_lock = threading.Lock()
+_session: requests.Session | None = None
+
+
+def _setting(name: str, default):
+    return settings.get(f"downloader.jdownloader.{name}", default)
+
+
+def _get_session() -> requests.Session:
+    """Return the keep-alive session of the local API."""
+    global _session
+    with _lock:
+        if _session is None:
+            _session = requests.Session()
+        return _session
+
+
+class _LocalConnectionHelper(DirectConnectionHelper):
+    """
+    Calls of the local API, which takes every parameter as a JSON query value.
+    Unlike pyjd's helper it keeps the connection alive, gives up after `localtimeout`
+    and escapes the parameters, so links with `&` in them stay one parameter.
+    """
+
+    def action(self, path, params=None, http_action="POST", binary=False):
+        url = f"{self.device.connector.base_url}{path}"
+        if params:
+            url += "?" + "&".join(quote(json.dumps(param), safe="") for param in params)
+        response = _get_session().get(
+            url,
+            headers=self.device.connector.headers,
+            timeout=_setting("localtimeout", 10),
+        )
+        response.raise_for_status()
+        if binary:
+            return response.content
+        result = response.json()
+        if isinstance(result, dict) and "data" in result:
+            return result["data"]
+        return result
 
 
 def _call_pyjd(func, retries=3, delay=1, *args, **kwargs):
     """Wrap pyjd calls in retries because this is so nice to work with."""
+    call = getattr(func, "__name__", "unknown")
     for attempt in range(retries):
+        outcome = "exception"
+        start = time.perf_counter()
         try:
-            return func(*args, **kwargs)
+            result = func(*args, **kwargs)
+            outcome = "ok"
+            return result
         except TypeError as e:
-            lolg.trace(f"Attempt {attempt + 1} failed: {e}")
-            if attempt < retries - 1:  # Don't wait after the last attempt
-                time.sleep(delay)
-    lolg.error(f"pyjd call failed after {retries} attempts")
+            outcome = "error"
+            lolg.trace("Attempt {} failed: {}", attempt + 1, e)
+        finally:
+            API_CALLS.labels(call=call, result=outcome).inc()
+            API_CALL_DURATION.labels(call=call).observe(time.perf_counter() - start)
+        if attempt < retries - 1:  # Don't wait after the last attempt
+            cancellation.sleep(delay)
+    lolg.error("pyjd call failed after {} attempts", retries)
     raise RuntimeError("pyjd call failed")
 
 
+def _connect_local() -> JDDevice:
+    """Use the local API of the device. This needs no network round trip."""
+    global JDD
+    base_url = _setting("localurl", "http://localhost:3128").rstrip("/")
+    JDD = JDDevice(
+        DirectConnector(base_url),
+        _LocalConnectionHelper,
+        {"id": LOCAL, "name": base_url, "type": "jd"},
+    )
+    lolg.debug("Using local JDownloader API at '{}'", base_url)
+    return JDD
+
+
 def connect() -> JDDevice | None:
+    if _setting("transport", MYJD) == LOCAL:
+        return _connect_local()
+
+    if (
+        settings.downloader.jdownloader.email == "TO BE SET"
+        or settings.downloader.jdownloader.password == "TO BE SET"
+    ):
+        raise ValueError("MyJDownloader API credentials not set.")
+
     conn = MyJDConnector()
 
     lolg.debug("Trying to connect to MyJDownloader API...")
@@ -66,10 +152,16 @@ def connect() -> JDDevice | None:
 
     global JDD
     JDD = conn.get_device(device_name=device_name, refresh_direct_connections=True)
-    lolg.debug(f"Connected to MyJDownloader device '{JDD.name}'")
+    lolg.debug("Connected to MyJDownloader device '{}'", JDD.name)
     return JDD
 
 
+def probe():
+    """Check whether the JDownloader API and the device answer again."""
+    connect()
+    _call_pyjd(JDD.downloads.query_packages, query_params=PackageQuery(maxResults=1))
+
+
 def _get_downloader_packages(package_name: str) -> dict[int, FilePackage] | None:
     packages = _call_pyjd(
         JDD.downloads.query_packages,
@@ -78,6 +170,8 @@ def _get_downloader_packages(package_name: str) -> dict[int, FilePackage] | None
             finished=True,
             enabled=True,
             saveTo=True,
+            bytesLoaded=True,
+            bytesTotal=True,
             maxResults=100,
         ),
     )
@@ -87,7 +181,7 @@ def _get_downloader_packages(package_name: str) -> dict[int, FilePackage] | None
     }
 
     if packages:
-        lolg.trace(f"Found {len(packages)} packages with name '{package_name}'")
+        lolg.trace("Found {} packages with name '{}'", len(packages), package_name)
 
     return packages
 
@@ -106,28 +200,31 @@ def _get_downloader_link(link_name: str, package_id: int) -> DownloadLink | None
     )
     link = next((link for link in links if link.name == link_name), None)
     if link:
-        lolg.trace(f"Found link '{link_name}' in '{package_id}': {link}")
+        lolg.trace("Found link '{}' in '{}': {}", link_name, package_id, link)
     return link
 
 
 def _wait_for_package_start(
     package_name: str, interval=5, max_retries=24
 ) -> dict[int, FilePackage] | None:
-    lolg.debug(f"Waiting for package '{package_name}' to start downloading...")
+    lolg.debug("Waiting for package '{}' to start downloading...", package_name)
     tries = 0
     while tries < max_retries:
         packages = _get_downloader_packages(package_name)
         if packages:
-            lolg.debug(f"Found package '{package_name}' in download list.")
+            lolg.debug("Found package '{}' in download list.", package_name)
             return packages
         else:
-            lolg.trace(f"Package '{package_name}' not in download list (yet).")
+            lolg.trace("Package '{}' not in download list (yet).", package_name)
 
         lolg.trace(
-            f"Looking for '{package_name}' again in {interval}s... ({max_retries - tries} tries left)"
+            "Looking for '{}' again in {}s... ({} tries left)",
+            package_name,
+            interval,
+            max_retries - tries,
         )
         tries += 1
-        time.sleep(interval)
+        cancellation.sleep(interval)
 
     return None
 
@@ -135,33 +232,50 @@ def _wait_for_package_start(
 def _wait_for_package_finish(
     package_name: str, poll_interval=5, max_retries=120
 ) -> dict[int, FilePackage] | None:
-    lolg.debug(f"Waiting for package '{package_name}' to finish downloading...")
+    lolg.debug("Waiting for package '{}' to finish downloading...", package_name)
     tries = 0
     while tries < max_retries:
         packages = _get_downloader_packages(package_name)
 
         if not packages:
-            lolg.error(f"Package '{package_name}' not in download list anymore.")
+            lolg.error("Package '{}' not in download list anymore.", package_name)
             return None
 
+        bytes_total = sum(package.bytesTotal or 0 for package in packages.values())
+        progress.update(
+            package_name,
+            sum(package.bytesLoaded or 0 for package in packages.values()),
+            bytes_total,
+        )
+        diskspace.reserve(
+            package_name,
+            bytes_total,
+            Path(settings.downloader.jdownloader.externaloutputdir),
+        )
+
         all_finished = True
         for package_id, package in packages.items():
             if not package.finished:
                 lolg.trace(
-                    f"Package '{package_name}' not finished yet. Status: {package.status}"
+                    "Package '{}' not finished yet. Status: {}",
+                    package_name,
+                    package.status,
                 )
                 all_finished = False
                 break
 
         if all_finished:
-            lolg.debug(f"Packages '{package_name}' have finished downloading.'")
+            lolg.debug("Packages '{}' have finished downloading.'", package_name)
             return packages
 
         lolg.trace(
-            f"Checking status of '{package_name}' again in {poll_interval}s... ({max_retries - tries} tries left)"
+            "Checking status of '{}' again in {}s... ({} tries left)",
+            package_name,
+            poll_interval,
+            max_retries - tries,
         )
         tries += 1
-        time.sleep(poll_interval)
+        cancellation.sleep(poll_interval)
 
     return None
 
@@ -178,13 +292,13 @@ def _get_filenames_from_package(package_id: int):
             maxResults=1000,
         ),
     )
-    lolg.debug(f"Found {len(links)} links in package '{package_id}'")
+    lolg.debug("Found {} links in package '{}'", len(links), package_id)
     filenames = [link.name for link in links]
     return filenames
 
 
 def _remove_package_from_downloader(package_id: int):
-    lolg.debug(f"Removing package id '{package_id}' from downloader...")
+    lolg.debug("Removing package id '{}' from downloader...", package_id)
     _call_pyjd(
         JDD.downloads.cleanup,
         delete_action=DeleteAction.DELETE_ALL,
@@ -198,58 +312,84 @@ def _get_full_file_path(file_name: str, package: FilePackage) -> Path | None:
     package_subpath = Path(package.saveTo).relative_to(
         settings.downloader.jdownloader.outputdir
     )
-    lolg.trace(f"Calculated package subpath: {package_subpath}")
+    lolg.trace("Calculated package subpath: {}", package_subpath)
     full_path = (
         Path(settings.downloader.jdownloader.externaloutputdir)
         / package_subpath
         / file_name
     )
     if not full_path.exists():
-        lolg.debug(f"File '{full_path}' not found.")
+        lolg.debug("File '{}' not found.", full_path)
         return None
-    lolg.trace(f"File exists at '{full_path}'")
+    lolg.trace("File exists at '{}'", full_path)
     return full_path
 
 
+def _remove_packages(package_name: str):
+    """Remove the packages of a cancelled download so they stop downloading."""
+    packages = _get_downloader_packages(package_name)
+    lolg.info(
+        "Removing {} packages of '{}' from downloader...", len(packages), package_name
+    )
+    for package_id in packages:
+        _remove_package_from_downloader(package_id)
+
+
 def download_url(url: str, url_key: str) -> list[Path] | None:
     """Download file for url. Return full file paths. Return empty list on retryable problems. Return None if download failed."""
-    connect()
+    with tracing.span("jdownloader.connect", url_key):
+        connect()
 
     package_name = url_key
+    try:
+        return _download(url, url_key, package_name)
+    except (cancellation.Cancelled, diskspace.DiskFull):
+        try:
+            # retries of the cleanup must not stop at the cancelled token
+            with cancellation.use(None):
+                _remove_packages(package_name)
+        except Exception as e:  # noqa: BLE001 - raise the original error below
+            lolg.error("Could not remove packages of stopped '{}': {}", url_key, e)
+        raise
+
 
+def _download(url: str, url_key: str, package_name: str) -> list[Path] | None:
     # don't add package again if already/still in download list
     if not _get_downloader_packages(package_name):
         # add link to linkgrabber
-        _call_pyjd(
-            JDD.linkgrabber.add_links,
-            add_links_query=AddLinksQuery(
-                autostart=True,
-                autoExtract=False,
-                links=url,
-                packageName=package_name,
-                overwritePackagizerRules=True,  # need fixed package name
-            ),
-        )
-        lolg.debug(f"Added link '{url}' to package '{package_name}'")
-
-        packages = _wait_for_package_start(package_name=package_name)
+        with tracing.span("jdownloader.add", url_key):
+            _call_pyjd(
+                JDD.linkgrabber.add_links,
+                add_links_query=AddLinksQuery(
+                    autostart=True,
+                    autoExtract=False,
+                    links=url,
+                    packageName=package_name,
+                    overwritePackagizerRules=True,  # need fixed package name
+                ),
+            )
+        lolg.debug("Added link '{}' to package '{}'", url, package_name)
+
+        with tracing.span("jdownloader.start", url_key):
+            packages = _wait_for_package_start(package_name=package_name)
         if not packages:
             lolg.debug(packages)
-            lolg.error(f"Could not add '{url_key}' to downloader.")
+            lolg.error("Could not add '{}' to downloader.", url_key)
             return None
     else:
-        lolg.debug(f"Package '{package_name}' already in download list.")
+        lolg.debug("Package '{}' already in download list.", package_name)
 
-    packages = _wait_for_package_finish(package_name)
+    with tracing.span("jdownloader.finish", url_key):
+        packages = _wait_for_package_finish(package_name)
     if not packages:
         lolg.debug(packages)
-        lolg.warning(f"Timeout while waiting for '{url_key}' to finish.")
+        lolg.warning("Timeout while waiting for '{}' to finish.", url_key)
         return []
 
     full_file_paths: list[Path] = []
     for package_id, package in packages.items():
         if any(error in package.status for error in ERROR_MESSAGES):
-            lolg.error(f"Error in package '{package_id}': {package.status}")
+            lolg.error("Error in package '{}': {}", package_id, package.status)
             break
 
         filenames = _get_filenames_from_package(package_id)
@@ -257,18 +397,18 @@ def download_url(url: str, url_key: str) -> list[Path] | None:
         for fn in filenames:
             f = _get_full_file_path(fn, package=package)
             if f:
-                lolg.trace(f"Found full file path '{f}'")
+                lolg.trace("Found full file path '{}'", f)
                 full_file_paths.append(f)
             else:
-                lolg.warning(f"File '{fn}' not found.")
+                lolg.warning("File '{}' not found.", fn)
 
     if full_file_paths:
         lolg.success(
-            f"Found {len(full_file_paths)} downloaded files for url '{url_key}'"
+            "Found {} downloaded files for url '{}'", len(full_file_paths), url_key
         )
 
     # clean up packages
-    lolg.info(f"Removing package '{package_name}' from downloader...")
+    lolg.info("Removing package '{}' from downloader...", package_name)
     for package_id in packages:
         _remove_package_from_downloader(package_id)
 
@@ -0,0 +1,38 @@
+import queue
+import threading
+
+# download results pushed to subscribers
+SUCCESS = "success"
+RETRYABLE = "retryable"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+# subscriber queues by url_key
+_subscribers: dict[str, set[queue.Queue]] = {}
+_lock = threading.Lock()
+
+
+def subscribe(url_keys: list[str]) -> queue.Queue:
+    """Return a queue that receives `(url_key, result)` for each of url_keys."""
+    q: queue.Queue = queue.Queue()
+    with _lock:
+        for url_key in url_keys:
+            _subscribers.setdefault(url_key, set()).add(q)
+    return q
+
+
+def unsubscribe(q: queue.Queue, url_keys: list[str]):
+    with _lock:
+        for url_key in url_keys:
+            if subscribers := _subscribers.get(url_key):
+                subscribers.discard(q)
+                if not subscribers:
+                    del _subscribers[url_key]
+
+
+def publish(url_key: str, result: str):
+    """Push the result of a download to everyone subscribed to its url_key."""
+    with _lock:
+        subscribers = list(_subscribers.get(url_key, ()))
+    for q in subscribers:
+        q.put((url_key, result))
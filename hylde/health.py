@@ -0,0 +1,247 @@
+import threading
+import time
+from collections.abc import Callable
+from types import ModuleType
+
+from hylde import lolg, metrics, settings
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+TRANSITIONS = metrics.Counter(
+    "hylde_breaker_transitions_total",
+    "Circuit breaker state changes by backend and new state.",
+    ("backend", "state"),
+)
+REJECTED = metrics.Counter(
+    "hylde_breaker_rejected_total",
+    "Downloads not started because their backend is down.",
+    ("backend",),
+)
+
+
+class BackendUnavailable(Exception):
+    """The circuit breaker of a backend is open."""
+
+    def __init__(self, backend: str, retry_after: float):
+        super().__init__(f"'{backend}' is down, retry in {retry_after:.0f}s")
+        self.backend = backend
+        self.retry_after = retry_after
+
+
+class Breaker:
+    """
+    Circuit breaker of a single downloader backend.
+    - closed: downloads run. `failures` errors in a row open the breaker.
+    - open: downloads fail fast for `cooldown` seconds, doubling up to `maxcooldown`
+      every time the backend is still down.
+    - half-open: after the cooldown a probe checks whether the backend is back. Backends
+      without a `probe()` hook let a single download through as the probe.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        threshold: int,
+        cooldown: float,
+        max_cooldown: float,
+        probe: Callable[[], object] | None = None,
+    ):
+        self.name = name
+        self.threshold = threshold
+        self.base_cooldown = self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.probe = probe
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.last_error: str | None = None
+        self._trial = False
+        self._prober: threading.Thread | None = None
+        self._lock = threading.Lock()
+
+    def _set_state(self, state: str):
+        if state == self.state:
+            return
+        lolg.log(
+            "WARNING" if state == OPEN else "INFO",
+            "Circuit breaker of '{}' is {} now",
+            self.name,
+            state,
+        )
+        self.state = state
+        TRANSITIONS.labels(backend=self.name, state=state).inc()
+
+    def _open(self):
+        self._set_state(OPEN)
+        self.opened_at = time.monotonic()
+        self._trial = False
+        if self.probe is not None and self._prober is None:
+            self._prober = threading.Thread(
+                target=self._probe_until_closed,
+                name=f"hylde-probe-{self.name}",
+                daemon=True,
+            )
+            self._prober.start()
+
+    def _cooled_down(self) -> bool:
+        return time.monotonic() >= self.opened_at + self.cooldown
+
+    def retry_after(self) -> float:
+        """Return the seconds until the backend may take downloads again, 0 if it does now."""
+        with self._lock:
+            if self.state == CLOSED:
+                return 0
+            if self.probe is None and not self._trial and self._cooled_down():
+                # the next download is the probe
+                return 0
+            # a running probe decides soon after the cooldown
+            return max(self.opened_at + self.cooldown - time.monotonic(), 1)
+
+    def allow(self) -> bool:
+        """Return whether a download may use the backend. Half-open breakers let one through."""
+        with self._lock:
+            if self.state == OPEN and self.probe is None and self._cooled_down():
+                self._set_state(HALF_OPEN)
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN and self.probe is None and not self._trial:
+                self._trial = True
+                return True
+            REJECTED.labels(backend=self.name).inc()
+            return False
+
+    def succeeded(self):
+        with self._lock:
+            self.failures = 0
+            self.cooldown = self.base_cooldown
+            self._trial = False
+            self._set_state(CLOSED)
+
+    def abandoned(self):
+        """Forget a half-open probe download that ended without telling anything."""
+        with self._lock:
+            self._trial = False
+
+    def failed(self, error: object):
+        with self._lock:
+            self.failures += 1
+            self.last_error = str(error)
+            if self.state == HALF_OPEN:
+                # still down: wait longer before the next probe
+                self.cooldown = min(self.cooldown * 2, self.max_cooldown)
+                self._open()
+            elif self.state == CLOSED and self.failures >= self.threshold:
+                self._open()
+
+    def _probe_until_closed(self):
+        while True:
+            with self._lock:
+                delay = self.opened_at + self.cooldown - time.monotonic()
+            time.sleep(max(delay, 0))
+            with self._lock:
+                if self.state == CLOSED:
+                    # a download that was already running succeeded meanwhile
+                    self._prober = None
+                    return
+                self._set_state(HALF_OPEN)
+            try:
+                self.probe()
+            except Exception as e:  # noqa: BLE001 - any error means still down
+                lolg.info("Probe of '{}' failed: {}", self.name, e)
+                self.failed(e)
+                continue
+            lolg.info("Probe of '{}' succeeded", self.name)
+            with self._lock:
+                self._prober = None
+            self.succeeded()
+            return
+
+    def as_dict(self) -> dict:
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "retry_after": round(self.retry_after(), 1),
+            "last_error": self.last_error,
+        }
+
+
+_breakers: dict[str, Breaker] = {}
+_lock = threading.Lock()
+
+
+def _get_name(downloader: ModuleType) -> str:
+    return downloader.__name__.rsplit(".", 1)[-1]
+
+
+def get_breaker(downloader: ModuleType) -> Breaker:
+    """Return the breaker of a downloader. Downloaders may expose a `probe()` hook."""
+    name = _get_name(downloader)
+    with _lock:
+        if (breaker := _breakers.get(name)) is None:
+            config = settings.health
+            breaker = _breakers[name] = Breaker(
+                name,
+                config.failures,
+                config.cooldown,
+                config.maxcooldown,
+                getattr(downloader, "probe", None),
+            )
+    return breaker
+
+
+def check(downloader: ModuleType):
+    """Raise BackendUnavailable if the breaker of downloader is open."""
+    if not settings.health.enabled:
+        return
+    breaker = get_breaker(downloader)
+    if not breaker.allow():
+        raise BackendUnavailable(breaker.name, breaker.retry_after())
+
+
+def record(downloader: ModuleType, error: BaseException | None):
+    """
+    Record the outcome of a download. Only errors count against the backend, cancelled
+    downloads don't count at all.
+    """
+    if not settings.health.enabled:
+        return
+    breaker = get_breaker(downloader)
+    if error is None:
+        breaker.succeeded()
+    elif isinstance(error, Exception):
+        breaker.failed(error)
+    else:
+        breaker.abandoned()
+
+
+def abandon(downloader: ModuleType):
+    """Record a download that ended without telling anything about the backend."""
+    if settings.health.enabled:
+        get_breaker(downloader).abandoned()
+
+
+def is_degraded() -> bool:
+    """Return whether any backend is not closed."""
+    return any(breaker.state != CLOSED for breaker in list(_breakers.values()))
+
+
+def get_retry_after(downloaders: list[ModuleType]) -> float | None:
+    """Return the seconds until one of downloaders is back, or None if one is up."""
+    if not settings.health.enabled or not downloaders:
+        return None
+    retry_after = min(get_breaker(d).retry_after() for d in downloaders)
+    return retry_after or None
+
+
+def get_status() -> dict[str, dict]:
+    """Return the breaker state of every backend that was used."""
+    with _lock:
+        breakers = list(_breakers.values())
+    return {breaker.name: breaker.as_dict() for breaker in breakers}
+
+
+def reset():
+    with _lock:
+        _breakers.clear()
@@ -0,0 +1,157 @@
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+from hylde import lolg
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+
+
+class Journal:
+    """
+    Append-only log of queued and running downloads that survives restarts.
+    Every record is a JSON line `{"url_key", "state", "url", "time"}`. The last record
+    of a url key wins.
+
+    Appending only queues the record. A writer thread writes, flushes and syncs the
+    records queued meanwhile as one batch, and rewrites the journal to the pending jobs
+    after every `compactevery` done records so it does not grow without bounds.
+    """
+
+    def __init__(self, path: Path | str | None, compactevery: int = 1000):
+        self.path = Path(path) if path else None
+        self.compactevery = compactevery
+        self._file = None
+        self._lock = threading.Lock()
+        self._broken = False
+        # queued lines and the writer thread
+        self._condition = threading.Condition()
+        self._queue: list[str] = []
+        self._appended = 0
+        self._written = 0
+        self._done = 0
+        self._writer: threading.Thread | None = None
+
+    def queued(self, url: str, url_key: str):
+        self._append({"url_key": url_key, "state": QUEUED, "url": url})
+
+    def running(self, url: str, url_key: str):
+        self._append({"url_key": url_key, "state": RUNNING, "url": url})
+
+    def done(self, url_key: str):
+        self._append({"url_key": url_key, "state": DONE})
+
+    def _append(self, record: dict):
+        if self.path is None or self._broken:
+            return
+        record["time"] = time.time()
+        line = json.dumps(record, separators=(",", ":")) + "\n"
+        with self._condition:
+            self._queue.append(line)
+            self._appended += 1
+            if record["state"] == DONE:
+                self._done += 1
+            if self._writer is None:
+                self._writer = threading.Thread(
+                    target=self._write_batches, name="hylde-journal", daemon=True
+                )
+                self._writer.start()
+            self._condition.notify_all()
+
+    def _write_batches(self):
+        while True:
+            with self._condition:
+                # stop after a second without records, the next one starts a new writer
+                if not self._condition.wait_for(lambda: self._queue, timeout=1):
+                    self._writer = None
+                    return
+                lines, self._queue = self._queue, []
+                compact = 0 < self.compactevery <= self._done
+                if compact:
+                    self._done = 0
+            self._write(lines)
+            with self._condition:
+                self._written += len(lines)
+                self._condition.notify_all()
+            if compact and not self._broken:
+                try:
+                    self._compact()
+                except OSError as e:
+                    lolg.error("Could not compact job journal '{}': {}", self.path, e)
+
+    def _write(self, lines: list[str]):
+        with self._lock:
+            try:
+                if self._file is None:
+                    os.makedirs(self.path.parent, exist_ok=True)
+                    # kept open between writes until _compact replaces the file
+                    self._file = open(self.path, "a", encoding="utf-8")  # noqa: SIM115
+                self._file.writelines(lines)
+                self._file.flush()
+                os.fsync(self._file.fileno())
+            except OSError as e:
+                # never fail a download because its journal entry could not be written
+                lolg.error("Disabling job journal '{}': {}", self.path, e)
+                self._broken = True
+
+    def flush(self, timeout: float | None = None):
+        """Wait until the records appended so far are synced to disk."""
+        with self._condition:
+            appended = self._appended
+            self._condition.wait_for(lambda: self._written >= appended, timeout)
+
+    def pending(self) -> dict[str, dict]:
+        """Return the last record of every url key that was queued or running."""
+        self.flush()
+        with self._lock:
+            return self._read()
+
+    def _read(self) -> dict[str, dict]:
+        jobs: dict[str, dict] = {}
+        if self.path is None or not self.path.exists():
+            return jobs
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    url_key = record["url_key"]
+                except (ValueError, KeyError, TypeError):
+                    # torn write of a crash
+                    lolg.warning("Skipping broken job journal line: {!r}", line)
+                    continue
+                if record.get("state") == DONE:
+                    jobs.pop(url_key, None)
+                else:
+                    jobs[url_key] = record
+        return jobs
+
+    def compact(self, jobs: dict[str, dict] | None = None):
+        """Rewrite the journal to hold only the given or the pending jobs."""
+        if self.path is None:
+            return
+        self.flush()
+        self._compact(jobs)
+
+    def _compact(self, jobs: dict[str, dict] | None = None):
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with self._lock:
+            if jobs is None:
+                # read under the same lock so no record is written in between
+                jobs = self._read()
+            os.makedirs(self.path.parent, exist_ok=True)
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.writelines(
+                    json.dumps(record, separators=(",", ":")) + "\n"
+                    for record in jobs.values()
+                )
+                f.flush()
+                os.fsync(f.fileno())
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            os.replace(tmp_path, self.path)
+        lolg.debug("Compacted job journal '{}' to {} jobs", self.path, len(jobs))
@@ -0,0 +1,178 @@
+import bisect
+import threading
+import time
+from collections.abc import Callable
+from contextlib import contextmanager
+
+# default latency buckets in seconds
+DURATION_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1, 2.5, 5, 10, 30, 60, 120, 300, 600,
+)  # fmt: skip
+# default size buckets in bytes
+BYTE_BUCKETS = tuple(1024 * 4**i for i in range(12))
+
+_metrics: list["_Metric"] = []
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: tuple[tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+
+class _Metric:
+    """Base class for metrics with optional labels."""
+
+    type: str = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._children: dict[tuple, object] = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _samples(self):
+        for key, child in list(self._children.items()):
+            yield tuple(zip(self.labelnames, key)), child
+
+    def render(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+        for labels, child in self._samples():
+            lines.extend(child.render(self.name, labels))
+        return lines
+
+
+class _CounterChild:
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self.value += amount
+
+    def render(self, name, labels):
+        return [f"{name}{_format_labels(labels)} {_format_value(self.value)}"]
+
+
+class _HistogramChild:
+    def __init__(self, buckets: tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def render(self, name, labels):
+        lines = []
+        cumulative = 0
+        for bound, count in zip((*self.buckets, float("inf")), self.counts):
+            cumulative += count
+            le = (*labels, ("le", _format_value(bound)))
+            lines.append(f"{name}_bucket{_format_labels(le)} {cumulative}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(self.sum)}")
+        lines.append(f"{name}_count{_format_labels(labels)} {cumulative}")
+        return lines
+
+
+class _GaugeChild:
+    def __init__(self, function: Callable[[], float]):
+        self.function = function
+
+    def render(self, name, labels):
+        return [f"{name}{_format_labels(labels)} {_format_value(self.function())}"]
+
+
+class Counter(_Metric):
+    """Monotonically increasing counter."""
+
+    type = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+
+class Histogram(_Metric):
+    """Distribution of observed values in cumulative buckets."""
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DURATION_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def time(self):
+        return self.labels().time()
+
+
+class Gauge(_Metric):
+    """Value read from a callback when metrics are collected."""
+
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, function: Callable[[], float]):
+        super().__init__(name, documentation)
+        self._children[()] = _GaugeChild(function)
+
+
+def render() -> str:
+    """Return all metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,70 @@
+import threading
+import time
+
+
+class Progress:
+    """Transfer progress of a single in-flight download."""
+
+    url_key: str
+    started: float
+    updated: float
+    bytes_done: int
+    bytes_total: int | None
+
+    def __init__(self, url_key: str):
+        self.url_key = url_key
+        self.started = self.updated = time.monotonic()
+        self.bytes_done = 0
+        self.bytes_total = None
+
+    def rate(self) -> float:
+        """Average transfer rate in bytes per second."""
+        elapsed = self.updated - self.started
+        if elapsed <= 0:
+            return 0.0
+        return self.bytes_done / elapsed
+
+    def eta(self) -> float | None:
+        """Estimated seconds until the download is finished, if known."""
+        rate = self.rate()
+        if not self.bytes_total or not rate:
+            return None
+        remaining = max(self.bytes_total - self.bytes_done, 0)
+        return remaining / rate
+
+    def as_dict(self) -> dict:
+        return {
+            "bytes_done": self.bytes_done,
+            "bytes_total": self.bytes_total,
+            "eta": self.eta(),
+        }
+
+
+# in-flight downloads by url_key
+_progress: dict[str, Progress] = {}
+_lock = threading.Lock()
+
+
+def start(url_key: str) -> Progress:
+    with _lock:
+        progress = _progress[url_key] = Progress(url_key)
+    return progress
+
+
+def update(url_key: str, bytes_done: int, bytes_total: int | None = None):
+    """Report transferred bytes for a download. Unknown url keys are ignored."""
+    if (progress := _progress.get(url_key)) is None:
+        return
+    progress.bytes_done = bytes_done
+    if bytes_total:
+        progress.bytes_total = bytes_total
+    progress.updated = time.monotonic()
+
+
+def get(url_key: str) -> Progress | None:
+    return _progress.get(url_key)
+
+
+def finish(url_key: str):
+    with _lock:
+        _progress.pop(url_key, None)
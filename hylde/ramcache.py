@@ -0,0 +1,92 @@
+import mimetypes
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from werkzeug.http import http_date
+
+from hylde import lolg, metrics
+
+RAM_CACHE_LOOKUPS = metrics.Counter(
+    "hylde_ram_cache_lookups_total",
+    "RAM tier lookups by result (hit, miss).",
+    ("result",),
+)
+
+
+class CachedFile:
+    """File contents and response headers of a cached file."""
+
+    __slots__ = ("data", "file_name", "headers")
+
+    def __init__(self, file_name: str, data: bytes, headers: dict[str, str]):
+        self.file_name = file_name
+        self.data = data
+        self.headers = headers
+
+
+class RamCache:
+    """
+    Small cached files kept in memory by url key.
+    Entries are evicted least recently used first once their total size exceeds budget bytes.
+    """
+
+    def __init__(self, budget: int, max_file_size: int):
+        self.budget = budget
+        self.max_file_size = max_file_size
+        self.nbytes = 0
+        self._entries: OrderedDict[str, CachedFile] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, url_key: str) -> CachedFile | None:
+        with self._lock:
+            entry = self._entries.get(url_key)
+            if entry is not None:
+                self._entries.move_to_end(url_key)
+        RAM_CACHE_LOOKUPS.labels(result="miss" if entry is None else "hit").inc()
+        return entry
+
+    def put(self, url_key: str, file_name: str, path: Path) -> CachedFile | None:
+        """Read a cached file into memory if it is small enough."""
+        if self.budget <= 0:
+            # disabled
+            return None
+        try:
+            stat = path.stat()
+        except OSError:
+            return None
+        if stat.st_size > min(self.max_file_size, self.budget):
+            return None
+
+        data = path.read_bytes()
+        headers = {
+            "Content-Type": mimetypes.guess_type(path.name)[0]
+            or "application/octet-stream",
+            "Content-Length": str(len(data)),
+            "Last-Modified": http_date(stat.st_mtime),
+            "Cache-Control": "no-cache",
+        }
+        entry = CachedFile(file_name, data, headers)
+        with self._lock:
+            if (previous := self._entries.pop(url_key, None)) is not None:
+                self.nbytes -= len(previous.data)
+            self._entries[url_key] = entry
+            self.nbytes += len(data)
+            while self.nbytes > self.budget:
+                _, evicted = self._entries.popitem(last=False)
+                self.nbytes -= len(evicted.data)
+        lolg.debug("Keeping '{}' in memory ({} bytes)", file_name, len(data))
+        return entry
+
+    def pop(self, url_key: str):
+        with self._lock:
+            if (entry := self._entries.pop(url_key, None)) is not None:
+                self.nbytes -= len(entry.data)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
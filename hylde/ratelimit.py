@@ -0,0 +1,174 @@
+import re
+import threading
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+from hylde import lolg, metrics, settings, tracing
+
+RATE_LIMIT_WAIT = metrics.Histogram(
+    "hylde_rate_limit_wait_seconds",
+    "Time downloads waited for their host's rate and concurrency limits.",
+)
+RATE_LIMIT_THROTTLES = metrics.Counter(
+    "hylde_rate_limit_throttles_total",
+    "Upstream 429 and 503 responses that slowed down a host.",
+)
+
+
+class HostLimit:
+    """
+    Token bucket and concurrency cap of a single host.
+    The rate halves on every upstream throttle and recovers additively with every
+    successful download (AIMD) until it is back at the configured rate.
+    A rate or concurrency of 0 is unlimited.
+    """
+
+    def __init__(self, name: str, rate: float, burst: float, concurrency: int):
+        self.name = name
+        self.max_rate = self.rate = rate
+        self.burst = max(burst, 1)
+        self.concurrency = concurrency
+        self.tokens = self.burst
+        self.active = 0
+        self.blocked_until = 0.0
+        self._updated = time.monotonic()
+        self._cond = threading.Condition()
+
+    def _refill(self, now: float):
+        if self.rate > 0:
+            self.tokens = min(
+                self.tokens + (now - self._updated) * self.rate, self.burst
+            )
+        self._updated = now
+
+    def _get_wait(self, now: float) -> float | None:
+        """Return 0 if a download may start now, else the seconds to wait or None until a release."""
+        if self.concurrency and self.active >= self.concurrency:
+            return None
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.rate > 0 and self.tokens < 1:
+            return (1 - self.tokens) / self.rate
+        return 0
+
+    def acquire(self) -> float:
+        """Wait for a free slot and token. Return the seconds waited."""
+        start = time.monotonic()
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self._get_wait(now)
+                if wait == 0:
+                    break
+                self._cond.wait(wait)
+            if self.rate > 0:
+                self.tokens -= 1
+            self.active += 1
+        return time.monotonic() - start
+
+    def release(self):
+        with self._cond:
+            self.active -= 1
+            self._cond.notify()
+
+    def throttled(self, delay: float | None = None):
+        """Slow down after an upstream 429 or 503, pausing for delay seconds if given."""
+        config = settings.ratelimit
+        with self._cond:
+            if self.max_rate > 0:
+                self.rate = max(self.rate * config.decrease, config.minrate)
+            self.tokens = min(self.tokens, 0)
+            if delay:
+                self.blocked_until = max(self.blocked_until, time.monotonic() + delay)
+        RATE_LIMIT_THROTTLES.inc()
+        lolg.warning(
+            "Host '{}' is throttling. Slowing down to {:.2f} downloads per second",
+            self.name,
+            self.rate,
+        )
+
+    def succeeded(self):
+        with self._cond:
+            if self.rate < self.max_rate:
+                self.rate = min(
+                    self.rate + self.max_rate * settings.ratelimit.increase,
+                    self.max_rate,
+                )
+
+
+_limits: dict[str, HostLimit] = {}
+_lock = threading.Lock()
+
+
+def _host(url: str) -> str:
+    return urlsplit(url).hostname or ""
+
+
+def get_limit(url: str) -> HostLimit:
+    """
+    Return the limit of the host of url.
+    Hosts matching a pattern of `ratelimit.hosts` share the limit of that pattern,
+    e.g. all mirror domains of a site.
+    """
+    host = _host(url)
+    config = settings.ratelimit
+    name, rate, burst, concurrency = host, config.rate, config.burst, config.concurrency
+    for pattern, *limits in config.get("hosts", []):
+        if re.search(pattern, host):
+            name = pattern
+            rate, burst, concurrency = limits
+            break
+
+    if limit := _limits.get(name):
+        return limit
+    with _lock:
+        if name not in _limits:
+            lolg.debug(
+                "Limiting '{}' to {} downloads per second and {} at once",
+                name,
+                rate,
+                concurrency,
+            )
+            _limits[name] = HostLimit(name, rate, burst, concurrency)
+        return _limits[name]
+
+
+@contextmanager
+def acquire(url: str, url_key: str) -> Iterator[None]:
+    """Hold a download slot of the host of url."""
+    if not settings.ratelimit.enabled:
+        yield
+        return
+    limit = get_limit(url)
+    with tracing.span("ratelimit.wait", url_key, host=limit.name):
+        waited = limit.acquire()
+    RATE_LIMIT_WAIT.observe(waited)
+    if waited >= 1:
+        lolg.info(
+            "Waited {:.1f}s for a slot of '{}' for '{}'", waited, limit.name, url_key
+        )
+    try:
+        yield
+    finally:
+        limit.release()
+
+
+def throttled(url: str, delay: float | None = None):
+    """Report an upstream 429 or 503 response for url."""
+    if settings.ratelimit.enabled:
+        get_limit(url).throttled(delay)
+
+
+def succeeded(url: str):
+    """Report a successful download of url."""
+    if settings.ratelimit.enabled:
+        get_limit(url).succeeded()
+
+
+def reset():
+    """Forget all host limits, e.g. after changing the settings."""
+    with _lock:
+        _limits.clear()
@@ -1,22 +1,194 @@
+import functools
+import importlib
 import re
+import threading
+import time
+from importlib.metadata import entry_points
+from types import ModuleType
+from urllib.parse import urlsplit
 
 from hylde import lolg, settings
 
-from hylde.downloaders import jdownloader, gallerydl  # noqa: F401
+ENTRY_POINT_GROUP = "hylde.downloaders"
 
 
-DOWNLOADER_PATTERNS = [
-    (pattern, globals()[module_name])
+Downloader = ModuleType | str
+
+# downloaders are referenced by name and only imported on their first match
+# a list of downloaders is an ordered fallback chain
+DOWNLOADER_PATTERNS: list[tuple[str, Downloader | list[Downloader]]] = [
+    (pattern, module_name if isinstance(module_name, str) else list(module_name))
     for pattern, module_name in settings.registry.downloader_patterns
 ]
 
+_loaded: dict[str, ModuleType] = {}
+_load_lock = threading.Lock()
+
+
+@functools.cache
+def _compile(pattern: str) -> re.Pattern:
+    return re.compile(pattern)
+
+
+def _import_downloader(name: str) -> ModuleType:
+    """
+    Import a downloader by name:
+    - an entry point in the `hylde.downloaders` group, e.g. from a plugin package
+    - a built-in module in `hylde.downloaders`
+    - a dotted module path
+    """
+    for entry_point in entry_points(group=ENTRY_POINT_GROUP, name=name):
+        lolg.debug(
+            "Loading downloader '{}' from entry point '{}'", name, entry_point.value
+        )
+        return entry_point.load()
+    if "." not in name:
+        return importlib.import_module(f"hylde.downloaders.{name}")
+    return importlib.import_module(name)
+
+
+def load_downloader(module: ModuleType | str) -> ModuleType:
+    """Return the downloader module for a registry entry, importing it on first use."""
+    if not isinstance(module, str):
+        return module
+    if loaded := _loaded.get(module):
+        return loaded
+    with _load_lock:
+        if module not in _loaded:
+            start = time.perf_counter()
+            _loaded[module] = _import_downloader(module)
+            lolg.info(
+                "Loaded downloader '{}' in {:.2f}s", module, time.perf_counter() - start
+            )
+    return _loaded[module]
+
+
+def register_downloader(
+    pattern: str, module: Downloader | list[Downloader], index: int | None = None
+):
+    """
+    Add a downloader for urls matching pattern. Append unless index is given.
+    Module may be a module object, a name that is imported on first match or a list of
+    both to try in order.
+    """
+    if index is None:
+        DOWNLOADER_PATTERNS.append((pattern, module))
+    else:
+        DOWNLOADER_PATTERNS.insert(index, (pattern, module))
+    lolg.debug(
+        "Registered downloader '{}' for '{}'",
+        getattr(module, "__name__", module),
+        pattern,
+    )
+
+
+class BackendStats:
+    """
+    Results and latency of one downloader for one host. Results count once the
+    downloader has `minattempts` of them, so a single bad url does not reorder a chain.
+    """
+
+    # weight of the latest download in the latency average
+    alpha = 0.3
+
+    def __init__(self):
+        self.attempts = 0
+        self.successes = 0
+        self.latency: float | None = None
+
+    def record(self, succeeded: bool, seconds: float):
+        self.attempts += 1
+        if succeeded:
+            self.successes += 1
+            if self.latency is None:
+                self.latency = seconds
+            else:
+                self.latency += self.alpha * (seconds - self.latency)
+
+    def success_rate(self) -> float:
+        """Smoothed towards 0.5 for downloaders with few results."""
+        return (self.successes + 1) / (self.attempts + 2)
+
+    def sort_key(self) -> tuple[float, float]:
+        if self.attempts < settings.get("registry.minattempts", 5):
+            # like a downloader without results, which keeps the configured order
+            return -0.5, 0
+        # similar success rates are ordered by latency
+        return -round(self.success_rate(), 1), self.latency or 0
 
-def get_downloader_for_url(url: str):
-    for pattern, module in DOWNLOADER_PATTERNS:
-        regex = re.compile(pattern)
-        if regex.search(url):
+
+_stats: dict[tuple[str, str], BackendStats] = {}
+_stats_lock = threading.Lock()
+
+
+def _host(url: str) -> str:
+    return urlsplit(url).hostname or ""
+
+
+def record_result(url: str, downloader: ModuleType, succeeded: bool, seconds: float):
+    """
+    Record the result of a download to order the fallback chains of its host.
+    Failures should be errors of the downloader itself, not of a single url.
+    """
+    key = (_host(url), downloader.__name__)
+    with _stats_lock:
+        _stats.setdefault(key, BackendStats()).record(succeeded, seconds)
+
+
+def get_stats(url: str, downloader: ModuleType) -> BackendStats:
+    return _stats.get((_host(url), downloader.__name__)) or BackendStats()
+
+
+def _order_by_stats(url: str, downloaders: list[ModuleType]) -> list[ModuleType]:
+    """Move downloaders that succeed more often or faster on the host of url to the front."""
+    ordered = sorted(downloaders, key=lambda d: get_stats(url, d).sort_key())
+    if ordered != downloaders:
+        lolg.debug(
+            "Reordered downloaders for '{}': {}",
+            _host(url),
+            [d.__name__ for d in ordered],
+        )
+    return ordered
+
+
+def get_downloaders_for_url(url: str) -> list[ModuleType]:
+    """Return the fallback chain of downloaders for url, best first."""
+    for pattern, modules in DOWNLOADER_PATTERNS:
+        if _compile(pattern).search(url):
+            if not isinstance(modules, list):
+                modules = [modules]
+            downloaders = [load_downloader(module) for module in modules]
+            if len(downloaders) > 1 and settings.get("registry.reorder", True):
+                downloaders = _order_by_stats(url, downloaders)
             lolg.debug(
-                f"Downloader '{module.__name__}' matched '{pattern}' for '{url}'"
+                "Downloaders {} matched '{}' for '{}'",
+                [d.__name__ for d in downloaders],
+                pattern,
+                url,
             )
-            return module
+            return downloaders
     raise ValueError(f"No downloader matched for URL: {url}")
+
+
+def get_downloader_for_url(url: str) -> ModuleType:
+    return get_downloaders_for_url(url)[0]
+
+
+def warm_up():
+    """Import every registered downloader and compile all patterns."""
+    for pattern, modules in list(DOWNLOADER_PATTERNS):
+        _compile(pattern)
+        for module in modules if isinstance(modules, list) else [modules]:
+            try:
+                load_downloader(module)
+            except Exception as e:  # noqa: BLE001 - load the others regardless
+                lolg.error("Could not load downloader '{}': {}", module, e)
+
+
+def warm_up_in_background(delay: float = 0) -> threading.Thread:
+    """Run `warm_up` in a daemon thread after delay seconds."""
+    thread = threading.Timer(delay, warm_up)
+    thread.daemon = True
+    thread.name = "hylde-registry-warmup"
+    thread.start()
+    return thread
@@ -0,0 +1,137 @@
+import heapq
+import threading
+import time
+from collections import deque
+from collections.abc import Callable
+from urllib.parse import urlsplit
+
+from hylde import lolg, metrics, settings
+
+RETRIES = metrics.Counter(
+    "hylde_retries_total",
+    "Background retries of retryable downloads by outcome (scheduled, started, deferred, dropped).",
+    ("result",),
+)
+
+
+def _host(url: str) -> str:
+    return urlsplit(url).hostname or ""
+
+
+class RetryScheduler:
+    """
+    Re-run retryable downloads in the background.
+    Retries back off exponentially up to `retry.maxdelay` and stop after `retry.maxattempts`.
+    At most `retry.hostbudget` retries start per host within `retry.hostwindow` seconds.
+    """
+
+    def __init__(self, callback: Callable[[str, str], None]):
+        self.callback = callback
+        self.attempts: dict[str, int] = {}
+        self._heap: list[tuple[float, str, str]] = []
+        self._due: dict[str, float] = {}
+        self._host_starts: dict[str, deque[float]] = {}
+        self._cond = threading.Condition()
+        self._thread: threading.Thread | None = None
+
+    def __len__(self) -> int:
+        return len(self._due)
+
+    def get_delay(self, attempt: int) -> float:
+        return min(settings.retry.delay * 2 ** (attempt - 1), settings.retry.maxdelay)
+
+    def schedule(self, url: str, url_key: str) -> float | None:
+        """
+        Schedule the next retry of url_key. Return its due time or None when the
+        retries are used up.
+        """
+        with self._cond:
+            attempt = self.attempts.get(url_key, 0) + 1
+            if attempt > settings.retry.maxattempts:
+                lolg.info(
+                    "Giving up background retries of '{}' after {} attempts",
+                    url_key,
+                    attempt - 1,
+                )
+                self.attempts.pop(url_key, None)
+                RETRIES.labels(result="dropped").inc()
+                return None
+            self.attempts[url_key] = attempt
+            due = time.monotonic() + self.get_delay(attempt)
+            self._push(due, url, url_key)
+            self._start()
+        RETRIES.labels(result="scheduled").inc()
+        lolg.debug(
+            "Scheduled retry {} of '{}' in {:.1f}s",
+            attempt,
+            url_key,
+            due - time.monotonic(),
+        )
+        return due
+
+    def forget(self, url_key: str):
+        """Stop retrying url_key, e.g. after it succeeded or failed permanently."""
+        with self._cond:
+            self.attempts.pop(url_key, None)
+            self._due.pop(url_key, None)
+
+    def pending(self, url_key: str) -> float | None:
+        """Return the seconds until the next retry of url_key, if one is scheduled."""
+        with self._cond:
+            due = self._due.get(url_key)
+        return None if due is None else max(due - time.monotonic(), 0)
+
+    def _push(self, due: float, url: str, url_key: str):
+        self._due[url_key] = due
+        heapq.heappush(self._heap, (due, url_key, url))
+        self._cond.notify()
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name="hylde-retry", daemon=True
+            )
+            self._thread.start()
+
+    def _take_host_budget(self, host: str, now: float) -> float:
+        """Use one retry of the host budget. Return 0 or the seconds until budget frees up."""
+        starts = self._host_starts.setdefault(host, deque())
+        while starts and starts[0] <= now - settings.retry.hostwindow:
+            starts.popleft()
+        if len(starts) >= settings.retry.hostbudget:
+            return starts[0] + settings.retry.hostwindow - now
+        starts.append(now)
+        return 0
+
+    def _next_due(self) -> tuple[str, str]:
+        """Wait for the next due retry that fits the host budget."""
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                due, url_key, url = self._heap[0]
+                if self._due.get(url_key) != due:
+                    # forgotten or rescheduled
+                    heapq.heappop(self._heap)
+                    continue
+                if due > now:
+                    self._cond.wait(due - now)
+                    continue
+                heapq.heappop(self._heap)
+                if wait := self._take_host_budget(_host(url), now):
+                    RETRIES.labels(result="deferred").inc()
+                    self._push(now + wait, url, url_key)
+                    continue
+                del self._due[url_key]
+                return url, url_key
+
+    def _run(self):
+        while True:
+            url, url_key = self._next_due()
+            RETRIES.labels(result="started").inc()
+            try:
+                self.callback(url, url_key)
+            except Exception as e:  # noqa: BLE001 - the worker must keep running
+                lolg.error("Unhandled error while retrying '{}': {}", url_key, e)
@@ -1,10 +1,40 @@
+import functools
+import hmac
+import json
+import math
+import mimetypes
 import os
+import queue
+import random
 import shelve
+import shutil
 import threading
+import time
+import zipfile
+from contextlib import contextmanager
 from pathlib import Path
-from flask import Flask, request, send_file
+from urllib.parse import quote
+from flask import Flask, Response, g, jsonify, request, send_file
+from werkzeug.wsgi import wrap_file
 
-from hylde import lolg, settings
+from hylde import (
+    archive,
+    cancellation,
+    coordination,
+    diskspace,
+    events,
+    health,
+    journal,
+    lolg,
+    metrics,
+    profiling,
+    progress,
+    ramcache,
+    registry,
+    retry,
+    settings,
+    tracing,
+)
 from hylde.util import md5
 import hylde.wrapper as hydl
 
@@ -12,6 +42,7 @@ import hylde.wrapper as hydl
 # initialize flask app
 app = Flask(__name__)
 
+
 def _cache_dir() -> Path:
     return Path(settings.cachedir).resolve()
 
@@ -23,66 +54,247 @@ def _cache_file() -> Path:
 # initialize cache directory
 _cache_dir_init = _cache_dir()
 if _cache_dir_init.exists():
-    lolg.debug(f"Found temporary cache directory at '{_cache_dir_init}'")
+    lolg.debug("Found temporary cache directory at '{}'", _cache_dir_init)
 else:
-    lolg.info(f"Creating temporary cache directory at '{_cache_dir_init}'...")
+    lolg.info("Creating temporary cache directory at '{}'...", _cache_dir_init)
     os.makedirs(_cache_dir_init, exist_ok=True)
 
 # active threads registry
 active_threads: dict[str, threading.Thread] = {}
+_active_threads_lock = threading.Lock()
+
+# prefetched urls waiting for a free worker
+prefetch_queue: queue.Queue[tuple[str, str]] = queue.Queue()
+queued_urls: dict[str, str] = {}
+_prefetch_workers: list[threading.Thread] = []
+
+# claims on downloads shared with other instances
+coordinator = coordination.get_coordinator()
+
+# queued and running downloads that are resumed after a restart
+job_journal = journal.Journal(settings.journalfile, settings.journalcompact)
+
+# metrics
+FILE_REQUEST_DURATION = metrics.Histogram(
+    "hylde_file_request_duration_seconds",
+    "Time to answer /file requests by HTTP status code.",
+    ("status",),
+)
+CACHE_LOOKUPS = metrics.Counter(
+    "hylde_cache_lookups_total",
+    "Cache index lookups by result (hit, miss, negative).",
+    ("result",),
+)
+CACHE_LOOKUP_DURATION = metrics.Histogram(
+    "hylde_cache_lookup_duration_seconds",
+    "Time to look up a url key in the cache index.",
+)
+metrics.Gauge(
+    "hylde_active_downloads",
+    "Downloads currently running in active threads.",
+    lambda: len(active_threads),
+)
+metrics.Gauge(
+    "hylde_prefetch_queue_depth",
+    "Prefetched urls waiting for a free worker.",
+    lambda: len(queued_urls),
+)
+
+
+# small hot files served from memory. Each instance holds its own copy, so instances
+# sharing the cache index would keep serving files the others evicted or replaced.
+if settings.ramcache.enabled and coordinator.shared:
+    lolg.warning("The RAM cache does not work with shared coordination, disabling it")
+ram_cache = ramcache.RamCache(
+    budget=settings.ramcache.budget
+    if settings.ramcache.enabled and not coordinator.shared
+    else 0,
+    max_file_size=settings.ramcache.maxfilesize,
+)
+metrics.Gauge(
+    "hylde_ram_cache_bytes",
+    "Bytes of cached files held in memory.",
+    lambda: ram_cache.nbytes,
+)
+
+
+def _serves_from_memory() -> bool:
+    """Whether files may be answered from the RAM cache rather than by the reverse proxy."""
+    return settings.servemode == "python"
 
 
 def _get_file(file_name: str) -> Path:
     return (_cache_dir() / file_name).resolve()
 
 
+@contextmanager
+def _open_index():
+    """Open the cache index while holding the lock of the coordination backend."""
+    with coordinator.index_lock(_cache_file()), shelve.open(_cache_file()) as db:
+        yield db
+
+
 def get_cached_file(url_key: str) -> str | None:
     """
     Retrieve the cached file name for a URL key from the shelve database.
     """
-    lolg.debug(f"Looking for cache entry for url '{url_key}'...")
-    with shelve.open(_cache_file()) as db:
+    lolg.debug("Looking for cache entry for url '{}'...", url_key)
+    with (
+        tracing.span("cache.lookup", url_key),
+        CACHE_LOOKUP_DURATION.time(),
+        _open_index() as db,
+    ):
         file_name = db.get(url_key)
 
-        if file_name is None:
-            lolg.debug(f"No cache entry for url '{url_key}'")
-        elif file_name == "...":
-            raise DeprecationWarning("In-progress markers are obsolete.")
-            lolg.debug(f"Found in-progress marker for url '{url_key}'")
-        elif file_name:
-            lolg.debug(f"Found cache entry '{url_key}' -> '{file_name}'")
-        else:
-            lolg.info(f"No file path for url '{url_key}'")
-        return file_name
+    if file_name is None:
+        CACHE_LOOKUPS.labels(result="miss").inc()
+        lolg.debug("No cache entry for url '{}'", url_key)
+    elif file_name == "...":
+        raise DeprecationWarning("In-progress markers are obsolete.")
+        lolg.debug("Found in-progress marker for url '{}'", url_key)
+    elif file_name and file_name != "FAILED":
+        CACHE_LOOKUPS.labels(result="hit").inc()
+        lolg.debug("Found cache entry '{}' -> '{}'", url_key, file_name)
+    else:
+        CACHE_LOOKUPS.labels(result="negative").inc()
+        lolg.info("No file path for url '{}'", url_key)
+    return file_name
+
+
+def get_cached_files(url_keys: list[str]) -> dict[str, str | None]:
+    """
+    Retrieve the cached file names for many URL keys with a single database access.
+    """
+    with _open_index() as db:
+        return {url_key: db.get(url_key) for url_key in url_keys}
 
 
 def set_cached_file(url_key: str, file: str | None):
     """
     Update or create a cache entry in the shelve database.
     """
-    lolg.debug(f"Adding cache entry '{url_key}' -> '{file}'...")
-    with shelve.open(_cache_file()) as db:
+    lolg.debug("Adding cache entry '{}' -> '{}'...", url_key, file)
+    ram_cache.pop(url_key)
+    with _open_index() as db:
         db[url_key] = file
 
 
 def remove_cached_file(url_key: str):
     """Delete a cache entry and its file in cache directory."""
-    lolg.debug(f"Removing cache entry '{url_key}'...")
-    with shelve.open(_cache_file()) as db:
+    lolg.debug("Removing cache entry '{}'...", url_key)
+    ram_cache.pop(url_key)
+    with _open_index() as db:
         if url_key in db:
             if db[url_key] != "" and db[url_key] != "...":
                 f = _get_file(db[url_key])
                 if f.exists():
                     f.unlink()
-                    lolg.debug(f"Deleted file '{f}' for '{url_key}'")
+                    lolg.debug("Deleted file '{}' for '{}'", f, url_key)
                     # TODO delete job directory if empty
             del db[url_key]
-            lolg.debug(f"Deleted cache entry '{url_key}'")
+            lolg.debug("Deleted cache entry '{}'", url_key)
+
+
+def select_evictions(n_bytes: int) -> list[tuple[str, int]]:
+    """
+    Return the url keys and sizes of the least recently used cached files that free n_bytes.
+    Files of running downloads stay. Access times are only as fresh as the mount options
+    of cachedir allow, so the modification time counts as well.
+    """
+    candidates = []
+    for url_dir in _cache_dir().iterdir():
+        if (
+            url_dir.name.startswith(".")
+            or url_dir.name in active_threads
+            or not url_dir.is_dir()
+        ):
+            continue
+        stats = [f.stat() for f in url_dir.iterdir() if f.is_file()]
+        if stats:
+            used = max(max(stat.st_atime, stat.st_mtime) for stat in stats)
+            candidates.append((used, url_dir.name, sum(stat.st_size for stat in stats)))
+
+    evictions = []
+    freed = 0
+    for _, url_key, size in sorted(candidates):
+        if freed >= n_bytes:
+            break
+        evictions.append((url_key, size))
+        freed += size
+    return evictions
+
+
+def evict_cached_file(url_key: str):
+    """Delete the cache entry and the cached files of url_key to make room for downloads."""
+    if url_key in active_threads:
+        return
+    lolg.info("Evicting '{}' to make room...", url_key)
+    ram_cache.pop(url_key)
+    with _open_index() as db:
+        db.pop(url_key, None)
+    shutil.rmtree(_cache_dir() / url_key, ignore_errors=True)
+
+
+def _failure_key(url_key: str) -> str:
+    return f"{url_key}:failure"
+
+
+def get_failure(url_key: str) -> dict | None:
+    """Return the failure record of a url key: failure class, count and backoff end."""
+    with _open_index() as db:
+        return db.get(_failure_key(url_key))
+
+
+def get_backoff_ttl(failure_class: str, count: int) -> float:
+    """Return a jittered backoff that doubles with every consecutive failure."""
+    config = settings.negativecache
+    ttl = min(
+        config.get(failure_class, config.retryable) * 2 ** (count - 1), config.maxttl
+    )
+    return ttl * random.uniform(1 - config.jitter, 1 + config.jitter)
+
+
+def record_failure(url_key: str, failure_class: str) -> dict | None:
+    """Count a failed download and start its backoff window."""
+    if not settings.negativecache.enabled:
+        return None
+    with _open_index() as db:
+        previous = db.get(_failure_key(url_key)) or {}
+        count = previous.get("count", 0) + 1
+        failure = {
+            "class": failure_class,
+            "count": count,
+            "until": time.time() + get_backoff_ttl(failure_class, count),
+        }
+        db[_failure_key(url_key)] = failure
+    lolg.info(
+        "Backing off '{}' for {:.0f}s after {} {} failures",
+        url_key,
+        failure["until"] - time.time(),
+        count,
+        failure_class,
+    )
+    return failure
+
+
+def clear_failure(url_key: str):
+    with _open_index() as db:
+        db.pop(_failure_key(url_key), None)
+
+
+def get_backoff(url_key: str) -> float | None:
+    """
+    Return the seconds left in the backoff window of a failed url key.
+    Return 0 once the window is over and None for failures without a record.
+    """
+    if (failure := get_failure(url_key)) is None:
+        return None
+    return max(failure["until"] - time.time(), 0)
 
 
 def normalize_url(url: str) -> str:
     normalized = url
-    lolg.debug(f"Normalized url '{url}' -> '{normalized}'")
+    lolg.debug("Normalized url '{}' -> '{}'", url, normalized)
     return normalized
 
 
@@ -103,31 +315,558 @@ def look_in_cache_directory(url_key: str) -> str | None:
 
 
 def download_file(url, url_key):
-    if file_name := look_in_cache_directory(url_key):
-        set_cached_file(url_key, file_name)
-        lolg.success(f"Recovered file '{file_name}' for url_key '{url_key}'")
+    # tag every record of this download so DEBUG output can be sampled per url key
+    with lolg.contextualize(url_key=url_key):
+        with tracing.span("download", url_key, url=url) as span:
+            with tracing.span("cache.recover", url_key):
+                file_name = look_in_cache_directory(url_key)
+            failure_class = None
+            if file_name:
+                set_cached_file(url_key, file_name)
+                lolg.success("Recovered file '{}' for url_key '{}'", file_name, url_key)
+            else:
+                try:
+                    file_name = hydl.download_file(url=url, url_key=url_key)
+                    if file_name is None:
+                        lolg.info("Download failed for '{}'", url_key)
+                        file_name = "FAILED"
+                        failure_class = "failed"
+                    elif file_name == "":
+                        failure_class = "retryable"
+                    set_cached_file(url_key, file_name)
+                except (health.BackendUnavailable, diskspace.DiskFull) as e:
+                    lolg.warning("Not downloading '{}': {}", url_key, e)
+                    file_name = ""
+                    failure_class = "retryable"
+                    set_cached_file(url_key, file_name)
+                except cancellation.Cancelled as e:
+                    # nothing is cached, so the next request starts over
+                    lolg.info("Download of '{}' was cancelled ({})", url_key, e)
+                    file_name = None
+                    failure_class = "cancelled"
+                except Exception as e:  # noqa: E722
+                    lolg.error(
+                        "Unhandled error while downloading '{}': {}'", url_key, e
+                    )
+                    file_name = ""
+                    failure_class = "error"
+                    set_cached_file(url_key, file_name)
+
+            if failure_class == "cancelled":
+                state = "cancelled"
+            elif failure_class:
+                record_failure(url_key, failure_class)
+                state = _get_cached_state(file_name)
+            else:
+                clear_failure(url_key)
+                if _serves_from_memory():
+                    ram_cache.put(url_key, file_name, _get_file(file_name))
+                state = _get_cached_state(file_name)
+            if failure_class in ("retryable", "error") and settings.retry.enabled:
+                retry_scheduler.schedule(url, url_key)
+            else:
+                retry_scheduler.forget(url_key)
+            span.set("result", state)
+
+        progress.finish(url_key)
+        cancellation.finish(url_key)
+        job_journal.done(url_key)
+        coordinator.release(url_key)
+        lolg.debug("Removing active thread '{}'", url_key)
+        with _active_threads_lock:
+            active_threads.pop(url_key, None)
+
+        # publish after the thread is gone so subscribers never miss the result
+        events.publish(url_key, STATE_EVENTS[state])
+
+
+def _join_download(url: str, url_key: str):
+    """
+    Wait for the download of url_key by another instance.
+    Take it over if that instance's claim expires without a result.
+    Cancelling only stops waiting, the other instance keeps downloading.
+    """
+    with lolg.contextualize(url_key=url_key):
+        lolg.info("'{}' is downloaded by another instance. Waiting for it...", url_key)
+        try:
+            with cancellation.use(cancellation.get(url_key)):
+                while True:
+                    cancellation.sleep(settings.coordination.pollinterval)
+                    if coordinator.holder(url_key) is not None:
+                        continue
+                    if (file_name := get_cached_file(url_key)) is not None:
+                        break
+                    if coordinator.claim(url_key):
+                        lolg.info("Taking over download of '{}'...", url_key)
+                        job_journal.running(url, url_key)
+                        download_file(url, url_key)
+                        return
+            lolg.info("Another instance finished '{}'", url_key)
+            state = _get_cached_state(file_name)
+        except cancellation.Cancelled:
+            lolg.info("Stopped waiting for '{}' on another instance", url_key)
+            state = "cancelled"
+
+        # this instance no longer owes the job, whoever finished it
+        job_journal.done(url_key)
+        progress.finish(url_key)
+        cancellation.finish(url_key)
+        with _active_threads_lock:
+            active_threads.pop(url_key, None)
+        events.publish(url_key, STATE_EVENTS[state])
+
+
+def _run_download(url: str, url_key: str):
+    """Download url_key. Join the download instead if another instance claimed it."""
+    if coordinator.claim(url_key):
+        job_journal.running(url, url_key)
+        download_file(url, url_key)
     else:
+        _join_download(url, url_key)
+
+
+def start_download(url: str, url_key: str) -> threading.Thread:
+    """
+    Return the active download thread for url_key. Start one if there is none.
+    The thread claims url_key itself, so the round trip to the coordination backend
+    does not hold up other requests.
+    """
+    with _active_threads_lock:
+        if thread := active_threads.get(url_key):
+            return thread
+        thread = threading.Thread(
+            target=_run_download, args=(url, url_key), name=f"hylde-dl-{url_key}"
+        )
+        active_threads[url_key] = thread
+        progress.start(url_key)
+        cancellation.start(url_key, settings.cancelidle)
+        thread.start()
+    queued_urls.pop(url_key, None)
+    return thread
+
+
+def _prefetch_worker():
+    while True:
+        url, url_key = prefetch_queue.get()
         try:
-            file_name = hydl.download_file(url=url, url_key=url_key)
-            if file_name is None:
-                lolg.info(f"Download failed for '{url_key}'")
-                set_cached_file(url_key, "FAILED")
-            else:
-                set_cached_file(url_key, file_name)
-        except Exception as e:  # noqa: E722
-            lolg.error(f"Unhandled error while downloading '{url_key}': {e}'")
-            set_cached_file(url_key, "")
+            # skip urls that a /file request has already started
+            if queued_urls.pop(url_key, None) is not None:
+                start_download(url, url_key).join()
+        except Exception as e:  # noqa: BLE001 - the worker must keep running
+            lolg.error("Unhandled error while prefetching '{}': {}", url_key, e)
+        finally:
+            prefetch_queue.task_done()
+
+
+def _start_prefetch_workers():
+    with _active_threads_lock:
+        while len(_prefetch_workers) < settings.prefetchworkers:
+            worker = threading.Thread(
+                target=_prefetch_worker, name="hylde-prefetch", daemon=True
+            )
+            worker.start()
+            _prefetch_workers.append(worker)
+
+
+def queue_download(url: str, url_key: str):
+    """Queue a download for the prefetch workers without waiting for it."""
+    if url_key not in queued_urls:
+        queued_urls[url_key] = url
+        job_journal.queued(url, url_key)
+        prefetch_queue.put((url, url_key))
+    _start_prefetch_workers()
+
+
+def _retry_download(url: str, url_key: str):
+    """Queue a background retry unless the download has been answered otherwise meanwhile."""
+    if url_key in active_threads or url_key in queued_urls:
+        return
+    if get_cached_file(url_key=url_key) != "":
+        lolg.debug("Skipping retry of '{}' which is no longer retryable", url_key)
+        return
+    lolg.info("Retrying '{}' in the background...", url_key)
+    remove_cached_file(url_key=url_key)
+    queue_download(url, url_key)
+
+
+def cancel_download(url_key: str) -> str | None:
+    """
+    Cancel the download of url_key so its worker slot and bandwidth go to other downloads.
+    Return the state it was cancelled in or None if there was nothing to cancel.
+    """
+    if url_key in active_threads:
+        # the download stops at its next check and publishes the cancellation
+        cancellation.cancel(url_key)
+        return "in-progress" if cancellation.get(url_key) else None
+    if queued_urls.pop(url_key, None) is not None:
+        # the prefetch worker skips url keys that are no longer queued
+        state = "queued"
+    elif retry_scheduler.pending(url_key) is not None:
+        state = "retryable"
+    else:
+        return None
+    retry_scheduler.forget(url_key)
+    job_journal.done(url_key)
+    cancellation.CANCELLATIONS.labels(reason=cancellation.REQUEST).inc()
+    lolg.info("Cancelled {} download of '{}'", state, url_key)
+    events.publish(url_key, events.CANCELLED)
+    return state
+
+
+retry_scheduler = retry.RetryScheduler(_retry_download)
+diskspace.set_evictor(select_evictions, evict_cached_file)
+metrics.Gauge(
+    "hylde_retry_queue_depth",
+    "Retryable downloads waiting for a background retry.",
+    lambda: len(retry_scheduler),
+)
+
+
+def get_failure_retry_after(url_key: str, backoff: float) -> int:
+    """Return the seconds until a failed url key is worth asking for again."""
+    if (pending := retry_scheduler.pending(url_key)) is not None:
+        backoff = min(backoff, pending + 1)
+    return max(math.ceil(backoff), 1)
+
+
+def recover_jobs() -> int:
+    """
+    Resume downloads that were queued or running when hylde stopped.
+    Downloaders pick up their interrupted work where they can, e.g. JDownloader packages by name.
+    Downloaders may clean up leftovers of the interrupted download with a `cleanup(url_key)` hook
+    before it is queued again. Return the number of queued downloads.
+    """
+    jobs = job_journal.pending()
+    if not jobs:
+        return 0
+    cached_filenames = get_cached_files(list(jobs))
+    resumed = {}
+    for url_key, job in jobs.items():
+        if cached_filenames[url_key] is not None:
+            lolg.debug("Interrupted download '{}' has a result already", url_key)
+            continue
+        if time.time() - job["time"] > settings.journalmaxage:
+            lolg.info("Dropping interrupted download '{}' which is too old", url_key)
+            continue
+        try:
+            for downloader in registry.get_downloaders_for_url(job["url"]):
+                if cleanup := getattr(downloader, "cleanup", None):
+                    cleanup(url_key)
+        except Exception as e:  # noqa: BLE001 - resume the others regardless
+            lolg.error("Could not prepare resuming '{}': {}", url_key, e)
+        resumed[url_key] = job
+
+    # forget finished and dropped jobs before queueing the others again
+    job_journal.compact(resumed)
+    for url_key, job in resumed.items():
+        queue_download(job["url"], url_key)
+    lolg.info("Resumed {} of {} interrupted downloads", len(resumed), len(jobs))
+    return len(resumed)
+
+
+def _get_cached_state(cached_filename: str | None) -> str:
+    if cached_filename is None:
+        return "unknown"
+    elif cached_filename == "FAILED":
+        return "failed"
+    elif cached_filename == "":
+        return "retryable"
+    return "cached"
+
+
+def get_download_state(url_key: str) -> tuple[str, str | None]:
+    """
+    Return the state of a url key and its cached file name without waiting.
+    In-flight downloads are answered from memory before the cache index is read.
+    """
+    if url_key in active_threads:
+        return "in-progress", None
+    if url_key in queued_urls:
+        return "queued", None
+    cached_filename = get_cached_file(url_key=url_key)
+    return _get_cached_state(cached_filename), cached_filename
+
+
+def get_retry_after(url_key: str) -> int:
+    """Return the seconds a client should wait before asking for url_key again."""
+    p = progress.get(url_key)
+    eta = p.eta() if p else None
+    if eta is None:
+        return settings.retryafter
+    return min(max(math.ceil(eta), 1), settings.maxretryafter)
+
+
+STATE_STATUS_CODES = {
+    "cached": 200,
+    "in-progress": 429,
+    "queued": 429,
+    "unknown": 404,
+    "retryable": 503,
+    "failed": 500,
+}
+
+
+STATE_EVENTS = {
+    "cached": events.SUCCESS,
+    "retryable": events.RETRYABLE,
+    "failed": events.FAILED,
+    "cancelled": events.CANCELLED,
+}
+
 
-    lolg.debug(f"Removing active thread '{url_key}'")
-    del active_threads[url_key]
+def get_unavailable_retry_after(url: str) -> int | None:
+    """Return the seconds until a downloader of url is back if all of them are down."""
+    if not health.is_degraded():
+        return None
+    retry_after = health.get_retry_after(registry.get_downloaders_for_url(url))
+    return math.ceil(retry_after) if retry_after else None
 
 
-@app.route("/file", methods=["GET"])
+def get_status(url_key: str) -> tuple[dict, int, dict]:
+    """Return status information, the matching HTTP status code and headers."""
+    state, cached_filename = get_download_state(url_key)
+    status = {"url_key": url_key, "state": state}
+    headers = {"X-Hylde-State": state}
+
+    if p := progress.get(url_key):
+        status.update(p.as_dict())
+        headers["X-Hylde-Bytes-Done"] = str(p.bytes_done)
+        if p.bytes_total:
+            headers["X-Hylde-Bytes-Total"] = str(p.bytes_total)
+
+    if state in ("in-progress", "queued"):
+        status["retry_after"] = get_retry_after(url_key)
+        headers["Retry-After"] = str(status["retry_after"])
+    elif state in ("failed", "retryable") and (backoff := get_backoff(url_key)):
+        status["retry_after"] = get_failure_retry_after(url_key, backoff)
+        headers["Retry-After"] = str(status["retry_after"])
+    elif state == "cached" and cached_filename:
+        cached_file = _get_file(cached_filename)
+        if cached_file.exists():
+            status["bytes_total"] = cached_file.stat().st_size
+            headers["Content-Length"] = str(status["bytes_total"])
+        else:
+            status["state"] = headers["X-Hylde-State"] = "missing"
+            return status, 503, headers
+
+    return status, STATE_STATUS_CODES[state], headers
+
+
+@app.route("/status", methods=["GET"])
+def handle_status():
+    """
+    Returns the state and progress of a download without waiting or starting it.
+    Accepts either a `url` or an already computed `key` query parameter.
+    """
+    if url := request.args.get("url"):
+        url_key = get_url_key(normalize_url(url))
+    elif not (url_key := request.args.get("key", "")):
+        return "Missing 'url' or 'key' query parameter", 400
+
+    cancellation.touch(url_key)
+    status, _, _ = get_status(url_key)
+    return jsonify(status)
+
+
+@app.before_request
+def _start_request_timer():
+    g.request_start = time.perf_counter()
+
+
+@app.after_request
+def _observe_request(response: Response) -> Response:
+    if request.endpoint == "handle_request":
+        FILE_REQUEST_DURATION.labels(status=response.status_code).observe(
+            time.perf_counter() - g.request_start
+        )
+    return response
+
+
+@app.route("/health", methods=["GET"])
+def handle_health():
+    """
+    Returns the circuit breaker state of every downloader backend that was used and the
+    disk space reserved for running downloads.
+    The status is "degraded" while a backend is not closed or downloads wait for disk
+    space, the HTTP status stays 200 because hylde itself still answers.
+    """
+    backends = health.get_status()
+    disk = diskspace.get_status()
+    degraded = (
+        any(b["state"] != health.CLOSED for b in backends.values()) or disk["deferred"]
+    )
+    return jsonify(
+        status="degraded" if degraded else "ok",
+        backends=backends,
+        disk=disk,
+        downloads={"active": len(active_threads), "queued": len(queued_urls)},
+    )
+
+
+@app.route("/metrics", methods=["GET"])
+def handle_metrics():
+    """Returns metrics in the Prometheus text format."""
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+def admin_required(view):
+    """Answer only requests with the admin token. Hide the endpoint without a configured token."""
+
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        token = settings.admin.token
+        if not token:
+            return "Not Found", 404
+        given = request.headers.get("Authorization", "").removeprefix("Bearer ")
+        if not hmac.compare_digest(given.encode(), token.encode()):
+            lolg.warning("Rejected admin request to '{}'", request.path)
+            return "Invalid admin token", 403
+        return view(*args, **kwargs)
+
+    return wrapper
+
+
+def _get_thread_url_keys() -> dict[int, str]:
+    return {thread.ident: url_key for url_key, thread in list(active_threads.items())}
+
+
+@app.route("/admin/profile", methods=["GET"])
+@admin_required
+def handle_profile():
+    """
+    Records a CPU profile of all threads for `seconds` (default 10) by sampling their stacks
+    every `interval` seconds (default 0.005). Returns collapsed stacks for flame graph tools
+    or a pstats file with `format=pstats`. `threads=1` adds the thread names as root frames.
+    """
+    try:
+        seconds = min(
+            float(request.args.get("seconds", 10)), settings.admin.maxprofileseconds
+        )
+        interval = max(float(request.args.get("interval", 0.005)), 0.001)
+    except ValueError:
+        return "Invalid 'seconds' or 'interval' query parameter", 400
+
+    try:
+        profile = profiling.record_profile(seconds, interval, _get_thread_url_keys())
+    except profiling.ProfilerBusy:
+        return "Another profile is being recorded", 409
+
+    if request.args.get("format") == "pstats":
+        return Response(
+            profile.pstats(),
+            mimetype="application/octet-stream",
+            headers={"Content-Disposition": "attachment; filename=hylde.pstats"},
+        )
+    return Response(
+        profile.collapsed(by_thread=request.args.get("threads") == "1"),
+        mimetype="text/plain",
+    )
+
+
+@app.route("/admin/tracemalloc", methods=["GET", "DELETE"])
+@admin_required
+def handle_tracemalloc():
+    """
+    Takes a tracemalloc snapshot, tracing allocations from the first request on.
+    - Returns the top `limit` allocations grouped by `key` (lineno, filename, traceback).
+    - `diff=1` returns the growth since the previous snapshot instead.
+    - `format=collapsed` returns allocated bytes as collapsed stacks.
+    - DELETE stops tracing.
+    """
+    if request.method == "DELETE":
+        profiling.stop_tracing()
+        return "", 204
+
+    key_type = request.args.get("key", "lineno")
+    if key_type not in ("lineno", "filename", "traceback"):
+        return "Invalid 'key' query parameter", 400
+    try:
+        limit = int(request.args.get("limit", 25))
+    except ValueError:
+        return "Invalid 'limit' query parameter", 400
+
+    snapshot, previous = profiling.take_snapshot(settings.admin.tracemallocframes)
+    if request.args.get("format") == "collapsed":
+        body = profiling.collapse_snapshot(snapshot)
+    else:
+        if request.args.get("diff") != "1":
+            previous = None
+        body = profiling.format_snapshot(snapshot, previous, key_type, limit)
+    return Response(body, mimetype="text/plain")
+
+
+@app.route("/admin/threads", methods=["GET"])
+@admin_required
+def handle_threads():
+    """Returns the stacks of all threads, labelled with the url key of download threads."""
+    return Response(
+        profiling.dump_threads(_get_thread_url_keys()), mimetype="text/plain"
+    )
+
+
+def _format_event(url_key: str, result: str) -> str:
+    data = json.dumps({"url_key": url_key, "result": result})
+    return f"event: {result}\ndata: {data}\n\n"
+
+
+def _stream_events(subscription: queue.Queue, url_keys: list[str]):
+    pending = set(url_keys)
+    try:
+        # answer downloads that already have a result
+        for url_key in url_keys:
+            state, _ = get_download_state(url_key)
+            if result := STATE_EVENTS.get(state):
+                pending.discard(url_key)
+                yield _format_event(url_key, result)
+
+        while pending:
+            try:
+                url_key, result = subscription.get(timeout=settings.eventkeepalive)
+            except queue.Empty:
+                # an open stream counts as waiting for its downloads
+                for url_key in pending:
+                    cancellation.touch(url_key)
+                yield ": keepalive\n\n"
+                continue
+            if url_key in pending:
+                pending.discard(url_key)
+                yield _format_event(url_key, result)
+    finally:
+        events.unsubscribe(subscription, url_keys)
+
+
+@app.route("/events", methods=["GET"])
+def handle_events():
+    """
+    Streams download results as Server-Sent Events:
+    - Subscribes to url keys given as `key` and/or `url` query parameters.
+    - Sends one event (success, retryable, failed) per url key once its download has a result.
+    - Closes the stream after every url key has been answered.
+    """
+    url_keys = request.args.getlist("key") + [
+        get_url_key(normalize_url(url)) for url in request.args.getlist("url")
+    ]
+    url_keys = list(dict.fromkeys(url_key for url_key in url_keys if url_key))
+    if not url_keys:
+        return "Missing 'url' or 'key' query parameter", 400
+
+    lolg.info("Streaming results for {} url keys", len(url_keys))
+    subscription = events.subscribe(url_keys)
+    return Response(
+        _stream_events(subscription, url_keys),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.route("/file", methods=["GET", "HEAD"])
 def handle_request():
     """
     Handles file requests:
     - If the file is not downloaded yet, returns 429.
     - If the file is downloaded, serves the file.
+    - With a `member` name or index, serves only that file of a multi-file result.
+    - HEAD requests only report the state and never wait or start a download.
     """
     url = request.args.get("url")
     if not url:
@@ -136,71 +875,300 @@ def handle_request():
 
     url = normalize_url(url)
     url_key = get_url_key(url)
-    lolg.info(f"Received request for url '{url_key}' ({url})")
+    with lolg.contextualize(url_key=url_key):
+        return _handle_file_request(url, url_key)
+
+
+def _handle_file_request(url: str, url_key: str):
+    lolg.info("Received request for url '{}' ({})", url_key, url)
+    cancellation.touch(url_key)
+
+    if request.method == "HEAD":
+        _, status_code, headers = get_status(url_key)
+        return Response(status=status_code, headers=headers)
+
+    member = request.args.get("member")
+
+    # small hot files are answered from memory without touching the index or disk
+    if (
+        "Range" not in request.headers
+        and member is None
+        and _serves_from_memory()
+        and (entry := ram_cache.get(url_key))
+    ):
+        lolg.success("Serving '{}' from memory for '{}'...", entry.file_name, url)
+        return Response(entry.data, headers=entry.headers)
 
     # check if there is an active downloader
     if thread := active_threads.get(url_key):
         lolg.debug(
-            f"Found active thread for url '{url_key}'. Waiting for up to {settings.maxtimeout} seconds..."
+            "Found active thread for url '{}'. Waiting for up to {} seconds...",
+            url_key,
+            settings.maxtimeout,
         )
         # wait for the thread to finish during this request
         thread.join(timeout=settings.maxtimeout)
         if thread.is_alive():
             lolg.debug(
-                f"Download '{url_key}' still not finished after {settings.maxtimeout} seconds."
+                "Download '{}' still not finished after {} seconds.",
+                url_key,
+                settings.maxtimeout,
+            )
+            return (
+                "File is being downloaded. Please retry later.",
+                429,
+                {"Retry-After": str(get_retry_after(url_key))},
             )
-            return "File is being downloaded. Please retry later.", 429
-        lolg.debug(f"Download '{url_key}' seems to have finished now.")
+        lolg.debug("Download '{}' seems to have finished now.", url_key)
     else:
-        lolg.debug(f"Found no active thread for '{url_key}'")
+        lolg.debug("Found no active thread for '{}'", url_key)
 
     # check if url is already cached
     cached_filename = get_cached_file(url_key=url_key)
 
+    # previous failure whose backoff window is over: download again right away
+    if cached_filename in ("", "FAILED") and get_backoff(url_key) == 0:
+        lolg.info("Backoff for '{}' is over. Downloading again...", url_key)
+        remove_cached_file(url_key=url_key)
+        cached_filename = None
+
+    # fail fast instead of starting a download that waits for a dead backend
+    if cached_filename is None and (retry_after := get_unavailable_retry_after(url)):
+        lolg.warning("Downloaders of '{}' are down. Not downloading.", url_key)
+        return (
+            "Downloader unavailable. Please retry later.",
+            503,
+            {"Retry-After": str(retry_after)},
+        )
+
     # url not seen before
     if cached_filename is None:
-        lolg.info(f"Sending '{url_key}' to downloader...")
-        thread = threading.Thread(target=download_file, args=(url, url_key))
-        thread.start()
-        active_threads[url_key] = thread
+        lolg.info("Sending '{}' to downloader...", url_key)
+        thread = start_download(url, url_key)
         lolg.debug(
-            f"Started thread for '{url_key}'. Waiting for up to {settings.maxtimeout} seconds for finish..."
+            "Started thread for '{}'. Waiting for up to {} seconds for finish...",
+            url_key,
+            settings.maxtimeout,
         )
         # wait for the thread to finish during this request
         thread.join(timeout=settings.maxtimeout)
         if thread.is_alive():
             lolg.debug(
-                f"Download '{url_key}' not finished after {settings.maxtimeout} seconds."
+                "Download '{}' not finished after {} seconds.",
+                url_key,
+                settings.maxtimeout,
+            )
+            return (
+                "Download started. Come back later.",
+                429,
+                {"Retry-After": str(get_retry_after(url_key))},
             )
-            return "Download started. Come back later.", 429
         else:
             lolg.debug(
-                f"Download '{url_key}' finished within the initial {settings.maxtimeout} seconds."
+                "Download '{}' finished within the initial {} seconds.",
+                url_key,
+                settings.maxtimeout,
             )
             cached_filename = get_cached_file(url_key=url_key)
 
+    # another request has consumed the result of the download we waited for
+    if cached_filename is None:
+        lolg.warning("Result of '{}' is gone after waiting for it.", url_key)
+        return "Download finished without a result. Please try again.", 503
+
+    # answer failures from cache without any work until their backoff is over
+    if cached_filename in ("", "FAILED") and (backoff := get_backoff(url_key)):
+        lolg.info("Download '{}' failed recently. Backing off.", url_key)
+        return (
+            "Download failed recently. Please retry later.",
+            503 if cached_filename == "" else 500,
+            {"Retry-After": str(get_failure_retry_after(url_key, backoff))},
+        )
+
     # download has previously failed but can be retried
     if cached_filename == "":
-        lolg.warning(f"Download '{url_key}' was previously marked as retryable.")
+        lolg.warning("Download '{}' was previously marked as retryable.", url_key)
         remove_cached_file(url_key=url_key)
         return "Download previously failed. You may try again.", 503
 
     # download has previously failed
     elif cached_filename == "FAILED":
-        lolg.error(f"Previous download failed for '{url_key}'")
+        lolg.error("Previous download failed for '{}'", url_key)
         remove_cached_file(url_key=url_key)
         return "Failed to download the file.", 500
 
     # found cache entry
     cached_file = _get_file(cached_filename)
     if not cached_file.exists():
-        lolg.error(f"Cached file missing on disk: {cached_file}")
+        lolg.error("Cached file missing on disk: {}", cached_file)
         remove_cached_file(url_key)
         return "Cached file missing on server. Please try again.", 503
 
+    if member is not None:
+        with tracing.span("send_member", url_key):
+            return _send_member(cached_file, member)
+
     # serve the file
-    lolg.success(f"Serving file '{cached_file}' for '{url}'...")
-    return send_file(cached_file)
+    lolg.success("Serving file '{}' for '{}'...", cached_file, url)
+    if (
+        "Range" not in request.headers
+        and _serves_from_memory()
+        and (entry := ram_cache.put(url_key, cached_filename, cached_file))
+    ):
+        return Response(entry.data, headers=entry.headers)
+    with tracing.span("send_file", url_key, mode=settings.servemode):
+        return _send_cached_file(cached_filename, cached_file)
+
+
+def _send_cached_file(cached_filename: str, cached_file: Path) -> Response:
+    """Send a cached file or let the reverse proxy send it, depending on `servemode`."""
+    if settings.servemode == "python":
+        return send_file(cached_file)
+
+    headers = {
+        "Content-Type": mimetypes.guess_type(cached_file.name)[0]
+        or "application/octet-stream",
+        "Cache-Control": "no-cache",
+    }
+    if settings.servemode == "accel":
+        headers["X-Accel-Redirect"] = (
+            settings.accelprefix.rstrip("/") + "/" + quote(cached_filename)
+        )
+    elif settings.servemode == "sendfile":
+        headers["X-Sendfile"] = str(cached_file)
+    else:
+        raise ValueError(f"Unknown serve mode: {settings.servemode}")
+    return Response(headers=headers)
+
+
+@app.route("/file", methods=["DELETE"])
+def handle_cancel():
+    """
+    Cancels the download of a url that nobody wants anymore:
+    - Accepts either a `url` or an already computed `key` query parameter.
+    - Running downloads stop at their next check and return 202.
+    - Queued downloads and scheduled retries are dropped right away and return 200.
+    - Returns 404 if there is nothing to cancel.
+    """
+    if url := request.args.get("url"):
+        url_key = get_url_key(normalize_url(url))
+    elif not (url_key := request.args.get("key", "")):
+        return "Missing 'url' or 'key' query parameter", 400
+
+    with lolg.contextualize(url_key=url_key):
+        state = cancel_download(url_key)
+    if state is None:
+        state, _ = get_download_state(url_key)
+        return jsonify(url_key=url_key, state=state, cancelled=False), 404
+    if state == "in-progress":
+        return jsonify(url_key=url_key, state="cancelling", cancelled=True), 202
+    return jsonify(url_key=url_key, state="cancelled", cancelled=True), 200
+
+
+def _get_members(cached_file: Path) -> list[archive.Member] | None:
+    """Return the members of a cached archive or None if it is no archive."""
+    if cached_file.suffix.lower() != ".zip":
+        return None
+    try:
+        return archive.get_members(cached_file)
+    except zipfile.BadZipFile as e:
+        lolg.error("Cannot read archive '{}': {}", cached_file, e)
+        return None
+
+
+def _send_member(cached_file: Path, selector: str) -> Response:
+    """
+    Send a single member of a cached archive.
+    Stored members are sent as a byte range of the archive, without copying on WSGI
+    servers with sendfile support. Reverse proxies cannot send parts of a file, so this
+    ignores `servemode`.
+    """
+    if (members := _get_members(cached_file)) is None:
+        return Response("Cached file is not an archive.", 400)
+    if (member := archive.find_member(members, selector)) is None:
+        return Response(f"No member '{selector}' in archive.", 404)
+
+    lolg.success("Serving member '{}' of '{}'...", member.name, cached_file)
+    return Response(
+        wrap_file(request.environ, archive.open_member(cached_file, member)),
+        headers={
+            "Content-Length": str(member.size),
+            "Content-Type": mimetypes.guess_type(member.name)[0]
+            or "application/octet-stream",
+            "Cache-Control": "no-cache",
+        },
+        direct_passthrough=True,
+    )
+
+
+@app.route("/members", methods=["GET"])
+def handle_members():
+    """
+    Lists the files of a cached multi-file result without sending it:
+    - Accepts either a `url` or an already computed `key` query parameter.
+    - Never waits or starts a download. Returns 404 unless the result is cached.
+    - Returns 400 for results that are a single file.
+    """
+    if url := request.args.get("url"):
+        url_key = get_url_key(normalize_url(url))
+    elif not (url_key := request.args.get("key", "")):
+        return "Missing 'url' or 'key' query parameter", 400
+
+    state, cached_filename = get_download_state(url_key)
+    if state != "cached" or not (cached_file := _get_file(cached_filename)).exists():
+        return jsonify(url_key=url_key, state=state), 404
+    if (members := _get_members(cached_file)) is None:
+        return jsonify(url_key=url_key, state=state, error="not an archive"), 400
+    return jsonify(
+        url_key=url_key,
+        state=state,
+        members=[member.as_dict() for member in members],
+    )
+
+
+@app.route("/prefetch", methods=["POST"])
+def handle_prefetch():
+    """
+    Handles bulk prefetch requests:
+    - Expects a JSON body `{"urls": [...]}`.
+    - Queues downloads for urls that are not cached yet without waiting for them.
+    - Returns the state of each url: cached, in-progress, queued or failed.
+    """
+    data = request.get_json(silent=True)
+    urls = data.get("urls") if isinstance(data, dict) else None
+    if not isinstance(urls, list) or not all(isinstance(u, str) and u for u in urls):
+        lolg.error("Invalid prefetch request body.")
+        return "Expected JSON body with a list of 'urls'", 400
+    if len(urls) > settings.maxprefetch:
+        return f"Too many urls. Send at most {settings.maxprefetch} at once.", 413
+
+    keyed = [(url, normalize_url(url)) for url in urls]
+    keyed = [(url, normalized, get_url_key(normalized)) for url, normalized in keyed]
+    cached_filenames = get_cached_files([url_key for _, _, url_key in keyed])
+    lolg.info("Received prefetch request for {} urls", len(keyed))
+
+    results = []
+    for url, normalized, url_key in keyed:
+        state = _get_cached_state(cached_filenames[url_key])
+        result = {"url": url, "url_key": url_key}
+        if url_key in active_threads:
+            cancellation.touch(url_key)
+            state = "in-progress"
+        elif state in ("failed", "retryable"):
+            backoff = get_backoff(url_key)
+            if backoff:
+                result["retry_after"] = get_failure_retry_after(url_key, backoff)
+            elif backoff == 0 or state == "retryable":
+                remove_cached_file(url_key=url_key)
+                queue_download(normalized, url_key)
+                state = "queued"
+        elif state == "unknown":
+            queue_download(normalized, url_key)
+            state = "queued"
+        result["state"] = state
+        results.append(result)
+
+    return jsonify(results=results), 202
 
 
 @app.route("/shim")
@@ -210,5 +1178,10 @@ def blank_page():
 
 
 if __name__ == "__main__":
+    # before serving requests, so cleanup hooks never touch a new download
+    recover_jobs()
+    # import downloaders once the server is up instead of on the first request
+    if settings.get("registry.warmup", True):
+        registry.warm_up_in_background(settings.get("registry.warmupdelay", 2))
     # start server
     app.run(host="0.0.0.0", port=settings.port)
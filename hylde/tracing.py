@@ -0,0 +1,187 @@
+import contextvars
+import json
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import requests
+
+from hylde import lolg, settings
+from hylde.util import is_key_sampled, md5
+
+
+class Span:
+    """A timed phase of handling a url key."""
+
+    name: str
+    url_key: str
+    span_id: str
+    parent_id: str | None
+    start_ns: int
+    end_ns: int | None
+    attributes: dict
+    error: str | None
+
+    def __init__(
+        self, name: str, url_key: str, parent_id: str | None, attributes: dict
+    ):
+        self.name = name
+        self.url_key = url_key
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = attributes
+        self.error = None
+
+    def set(self, key: str, value):
+        self.attributes[key] = value
+
+    @property
+    def trace_id(self) -> str:
+        # url keys are md5 hex digests which have the size of a trace id
+        return self.url_key if len(self.url_key) == 32 else md5(self.url_key)
+
+    def as_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent_id,
+            "name": self.name,
+            "url_key": self.url_key,
+            "start": self.start_ns / 1e9,
+            "end": (self.end_ns or 0) / 1e9,
+            "duration_ms": ((self.end_ns or self.start_ns) - self.start_ns) / 1e6,
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+    def as_otlp(self) -> dict:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 1,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns or self.start_ns),
+            "attributes": [
+                _otlp_attribute(key, value)
+                for key, value in {"url_key": self.url_key, **self.attributes}.items()
+            ],
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 1},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+class _NoopSpan:
+    """Stand-in for spans that are not sampled."""
+
+    def set(self, key: str, value):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+_current_span: contextvars.ContextVar[Span | None] = contextvars.ContextVar(
+    "hylde_span", default=None
+)
+_export_queue: queue.Queue[Span] = queue.Queue()
+_exporter: threading.Thread | None = None
+_exporter_lock = threading.Lock()
+
+
+def _otlp_attribute(key: str, value) -> dict:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+def _otlp_payload(spans: list[Span]) -> dict:
+    return {
+        "resourceSpans": [
+            {
+                "resource": {"attributes": [_otlp_attribute("service.name", "hylde")]},
+                "scopeSpans": [
+                    {
+                        "scope": {"name": "hylde"},
+                        "spans": [span.as_otlp() for span in spans],
+                    }
+                ],
+            }
+        ]
+    }
+
+
+def is_sampled(url_key: str) -> bool:
+    """Sample by url key so that all spans of a download are kept or dropped together."""
+    return is_key_sampled(url_key, settings.tracing.samplerate)
+
+
+def export(spans: list[Span]):
+    """Write finished spans to the configured file and/or collector."""
+    if settings.tracing.file:
+        path = Path(settings.tracing.file)
+        if settings.tracing.format == "otlp":
+            lines = [json.dumps(_otlp_payload(spans))]
+        else:
+            lines = [json.dumps(span.as_dict(), default=str) for span in spans]
+        with open(path, "a", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+    if settings.tracing.endpoint:
+        requests.post(
+            settings.tracing.endpoint.rstrip("/") + "/v1/traces",
+            json=_otlp_payload(spans),
+            timeout=5,
+        )
+
+
+def _export_worker():
+    while True:
+        spans = [_export_queue.get()]
+        while not _export_queue.empty() and len(spans) < 512:
+            spans.append(_export_queue.get_nowait())
+        try:
+            export(spans)
+        except Exception as e:  # noqa: BLE001 - the worker must keep running
+            lolg.warning("Could not export {} spans: {}", len(spans), e)
+
+
+def _submit(span: Span):
+    global _exporter
+    if _exporter is None:
+        with _exporter_lock:
+            if _exporter is None:
+                _exporter = threading.Thread(target=_export_worker, daemon=True)
+                _exporter.start()
+    _export_queue.put(span)
+
+
+@contextmanager
+def span(name: str, url_key: str, **attributes):
+    """Time a phase of handling url_key and export it as a span if tracing is enabled."""
+    if not settings.tracing.enabled or not is_sampled(url_key):
+        yield NOOP_SPAN
+        return
+
+    parent = _current_span.get()
+    parent_id = parent.span_id if parent and parent.url_key == url_key else None
+    s = Span(name, url_key, parent_id, attributes)
+    token = _current_span.set(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.error = f"{e.__class__.__name__}: {e}"
+        raise
+    finally:
+        s.end_ns = time.time_ns()
+        _current_span.reset(token)
+        _submit(s)
@@ -1,7 +1,68 @@
 import hashlib
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any
 
 
 def md5(s: str) -> str:
     md5_hash = hashlib.md5()
     md5_hash.update(s.encode("utf-8"))
     return md5_hash.hexdigest()
+
+
+def is_key_sampled(key: str, rate: float) -> bool:
+    """Deterministically keep a share of keys, so every record of a key is kept or dropped together."""
+    if rate >= 1:
+        return True
+    return zlib.crc32(key.encode("utf-8")) / 0xFFFFFFFF < rate
+
+
+class TTLCache:
+    """Thread-safe mapping with per-entry expiry and LRU eviction."""
+
+    maxsize: int
+    ttl: float
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[Any, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            expires, value = entry
+            if expires <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl: float | None = None):
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key) -> bool:
+        sentinel = object()
+        return self.get(key, sentinel) is not sentinel
+
+    def __len__(self) -> int:
+        return len(self._data)
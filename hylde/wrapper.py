@@ -1,10 +1,48 @@
 import os
+import queue
 import shutil
+import threading
+import time
 import zipfile
+from contextlib import nullcontext
 from pathlib import Path
+from types import ModuleType
 
-from hylde import lolg, settings
-from hylde.registry import get_downloader_for_url
+from hylde import (
+    archive,
+    cancellation,
+    diskspace,
+    health,
+    lolg,
+    metrics,
+    progress,
+    ratelimit,
+    settings,
+    tracing,
+)
+from hylde.registry import get_downloaders_for_url, record_result
+
+DOWNLOAD_DURATION = metrics.Histogram(
+    "hylde_download_duration_seconds",
+    "Time spent in downloader modules by downloader and result.",
+    ("downloader", "result"),
+)
+DOWNLOAD_BYTES = metrics.Histogram(
+    "hylde_download_bytes",
+    "Bytes returned by downloader modules per download.",
+    ("downloader",),
+    buckets=metrics.BYTE_BUCKETS,
+)
+DOWNLOAD_HANDOVERS = metrics.Counter(
+    "hylde_download_handovers_total",
+    "Downloads handed to the next downloader of a chain by reason (fallback, hedge).",
+    ("reason",),
+)
+INGEST_DURATION = metrics.Histogram(
+    "hylde_ingest_duration_seconds",
+    "Time to move or zip downloaded files into the cache directory.",
+    ("method",),
+)
 
 
 def _cache_dir() -> Path:
@@ -19,13 +57,13 @@ def _zip_files_to_cache(
 
     file_name = f"{folder_name}/{folder_name}.zip"
     output_path = target_directory / file_name
-    lolg.debug(f"Creating cache folder: {output_path.parent}")
+    lolg.debug("Creating cache folder: {}", output_path.parent)
     os.makedirs(output_path.parent, exist_ok=True)
-    lolg.debug(f"Zipping {len(file_paths)} files to '{output_path}'...")
+    lolg.debug("Zipping {} files to '{}'...", len(file_paths), output_path)
 
     # find the common directory
     common_dir = Path(os.path.commonpath([str(path) for path in file_paths]))
-    lolg.debug(f"The common directory is: {common_dir}")
+    lolg.debug("The common directory is: {}", common_dir)
 
     with zipfile.ZipFile(output_path, "w", zipfile.ZIP_STORED) as zipf:
         for file_path in file_paths:
@@ -33,10 +71,13 @@ def _zip_files_to_cache(
             arcname = file_path.relative_to(common_dir.parent)
             zipf.write(file_path, arcname)
 
+    # index the members while the central directory is still in the page cache
+    archive.get_members(output_path)
+
     # delete original files
     lolg.debug("Deleting original files...")
     for file_path in file_paths:
-        lolg.trace(f"Deleting '{file_path}'...")
+        lolg.trace("Deleting '{}'...", file_path)
         file_path.unlink()
     return file_name
 
@@ -46,34 +87,294 @@ def _move_file_to_cache(
 ) -> str:
     dst_file_name = f"{folder_name}/{file_path.name}"
     output_path = target_directory / dst_file_name
-    lolg.debug(f"Creating cache folder: {output_path.parent}")
+    lolg.debug("Creating cache folder: {}", output_path.parent)
     os.makedirs(output_path.parent, exist_ok=True)
-    lolg.debug(f"Moving '{file_path}' -> '{output_path}'")
+    lolg.debug("Moving '{}' -> '{}'", file_path, output_path)
     shutil.move(file_path, output_path)
     return dst_file_name
 
 
-def download_file(url: str, url_key: str) -> str | None:
+def _get_name(downloader: ModuleType) -> str:
+    return downloader.__name__.rsplit(".", 1)[-1]
+
+
+def _attempt(
+    downloader: ModuleType, url: str, url_key: str, hold_slot: bool = True
+) -> list[Path] | None:
     """
-    Return single file path relative to cache directory.
-    Return `""` on retryable failure.
-    Return `None` on error.
+    Run a single downloader within the host limits and record how it did.
+    Without hold_slot the caller holds the slot of the host for it.
+    Raise BackendUnavailable without running it while its circuit breaker is open.
+    Raise DiskFull if the size it reports does not fit on disk.
+    """
+    downloader_name = _get_name(downloader)
+    result = "error"
+    error = None
+    # hold a slot of the host for the whole download, but only time the download itself
+    with ratelimit.acquire(url, url_key) if hold_slot else nullcontext():
+        # the download may have been cancelled while waiting for the host
+        cancellation.check()
+        health.check(downloader)
+        start = time.perf_counter()
+        try:
+            with tracing.span(f"{downloader_name}.download", url_key):
+                file_paths = downloader.download_url(url, url_key)
+            if file_paths is None:
+                result = "failed"
+            else:
+                result = "success" if file_paths else "retryable"
+        except cancellation.Cancelled as e:
+            result = "cancelled"
+            error = e
+            raise
+        except diskspace.DiskFull:
+            result = "diskfull"
+            raise
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            DOWNLOAD_DURATION.labels(downloader=downloader_name, result=result).observe(
+                elapsed
+            )
+            if result == "diskfull":
+                health.abandon(downloader)
+            else:
+                health.record(downloader, error)
+            # only errors say something about the downloader, failed and retryable
+            # results are about the url, cancellations and a full disk about neither
+            if result in ("success", "error"):
+                record_result(url, downloader, result == "success", elapsed)
+    return file_paths
+
+
+def _combine_results(results: list[str], error: Exception | None) -> list | None:
+    """
+    Return the result of a chain in which no downloader succeeded:
+    retryable if any downloader may succeed later, failed if all failed.
+    """
+    if error is not None and all(result == "error" for result in results):
+        raise error
+    if all(result == "failed" for result in results):
+        return None
+    return []
+
+
+def _download_with_fallback(
+    url: str, url_key: str, downloaders: list[ModuleType]
+) -> tuple[list[Path] | None, ModuleType]:
+    """Try downloaders in order until one succeeds."""
+    results = []
+    error = None
+    for downloader in downloaders:
+        if results:
+            DOWNLOAD_HANDOVERS.labels(reason="fallback").inc()
+            lolg.info("Falling back to '{}' for '{}'", _get_name(downloader), url_key)
+        try:
+            file_paths = _attempt(downloader, url, url_key)
+        except diskspace.DiskFull:
+            # the next downloader needs the same space
+            raise
+        except Exception as e:
+            if len(downloaders) == 1:
+                raise
+            lolg.warning("'{}' failed for '{}': {}", _get_name(downloader), url_key, e)
+            results.append("error")
+            error = e
+            continue
+        if file_paths:
+            return file_paths, downloader
+        results.append("failed" if file_paths is None else "retryable")
+    return _combine_results(results, error), downloaders[-1]
+
+
+def _discard(downloader: ModuleType, url_key: str, file_paths: list[Path] | None):
+    """Delete the files of a downloader that lost a hedged race."""
+    for f in file_paths or []:
+        if f.exists():
+            f.unlink()
+    lolg.debug("Discarded result of '{}' for '{}'", _get_name(downloader), url_key)
+
+
+def _has_first_byte(url_key: str) -> bool:
+    p = progress.get(url_key)
+    return p is not None and p.bytes_done > 0
+
+
+def _download_hedged(
+    url: str, url_key: str, downloaders: list[ModuleType], delay: float
+) -> tuple[list[Path] | None, ModuleType]:
+    """
+    Start the next downloader of the chain when the running ones failed or have not
+    transferred a single byte within delay seconds. The first success wins and the
+    others are cancelled. Results that finish anyway are discarded.
+    All attempts share one slot of the host, so a hedge never waits for its primary.
     """
+    with ratelimit.acquire(url, url_key):
+        # the download may have been cancelled while waiting for the host
+        cancellation.check()
+        return _race(url, url_key, downloaders, delay)
+
+
+def _race(
+    url: str, url_key: str, downloaders: list[ModuleType], delay: float
+) -> tuple[list[Path] | None, ModuleType]:
+    token = cancellation.current() or cancellation.CancelToken(url_key)
+    results: queue.Queue = queue.Queue()
+    pending = list(downloaders)
+    running: set[ModuleType] = set()
+    attempt_tokens: dict[ModuleType, cancellation.CancelToken] = {}
+    done = threading.Event()
+    done_lock = threading.Lock()
+
+    def run(downloader: ModuleType):
+        try:
+            with cancellation.use(attempt_tokens[downloader]):
+                file_paths = _attempt(downloader, url, url_key, hold_slot=False)
+                error = None
+        except (Exception, cancellation.Cancelled) as e:  # noqa: BLE001
+            # reported to the race below, which decides whether to raise it
+            file_paths, error = [], e
+        with done_lock:
+            if not done.is_set():
+                results.put((downloader, file_paths, error))
+                return
+        _discard(downloader, url_key, file_paths)
+
+    def start(reason: str | None = None):
+        downloader = pending.pop(0)
+        if reason:
+            DOWNLOAD_HANDOVERS.labels(reason=reason).inc()
+            lolg.info(
+                "Starting '{}' for '{}' ({})", _get_name(downloader), url_key, reason
+            )
+        running.add(downloader)
+        attempt_tokens[downloader] = token.child()
+        threading.Thread(
+            target=run,
+            args=(downloader,),
+            name=f"hylde-{_get_name(downloader)}-{url_key}",
+            daemon=True,
+        ).start()
+        return time.monotonic() + delay
 
-    downloader = get_downloader_for_url(url)
-    lolg.debug(f"Using downloader: {downloader.__name__}")
-    file_paths = downloader.download_url(url, url_key)
+    outcomes = []
+    last_error = None
+    hedge_at: float | None = start()
+    try:
+        while running:
+            timeout = None
+            if pending and hedge_at is not None:
+                timeout = max(hedge_at - time.monotonic(), 0)
+            try:
+                downloader, file_paths, error = results.get(timeout=timeout)
+            except queue.Empty:
+                # the running downloaders made progress: keep waiting for them
+                hedge_at = None if _has_first_byte(url_key) else start("hedge")
+                continue
+
+            running.discard(downloader)
+            if file_paths:
+                with done_lock:
+                    done.set()
+                # results that arrived while this one was handled
+                while not results.empty():
+                    other, other_paths, _ = results.get()
+                    running.discard(other)
+                    _discard(other, url_key, other_paths)
+                return file_paths, downloader
+            # the whole download was cancelled: the attempts stop on their own
+            token.check()
+            if isinstance(error, diskspace.DiskFull):
+                raise error
+            if error is not None:
+                lolg.warning(
+                    "'{}' failed for '{}': {}", _get_name(downloader), url_key, error
+                )
+                last_error = error
+                outcomes.append("error")
+            else:
+                outcomes.append("failed" if file_paths is None else "retryable")
+            if not running and pending:
+                hedge_at = start("fallback")
+    finally:
+        with done_lock:
+            done.set()
+        for downloader in running:
+            if attempt_tokens[downloader].cancel(cancellation.HEDGE):
+                cancellation.CANCELLATIONS.labels(reason=cancellation.HEDGE).inc()
+                lolg.debug(
+                    "Cancelling '{}' for '{}' which lost the race",
+                    _get_name(downloader),
+                    url_key,
+                )
+
+    return _combine_results(outcomes, last_error), downloaders[-1]
+
+
+def _download_to_cache(
+    url: str, url_key: str, downloaders: list[ModuleType]
+) -> str | None:
+    # raises Cancelled once the download is cancelled through `hylde.cancellation`
+    hedge_delay = settings.get("registry.hedgedelay", 0)
+    with cancellation.use(cancellation.get(url_key)):
+        if hedge_delay > 0 and len(downloaders) > 1:
+            file_paths, downloader = _download_hedged(
+                url, url_key, downloaders, hedge_delay
+            )
+        else:
+            file_paths, downloader = _download_with_fallback(url, url_key, downloaders)
 
     # file_paths = hyjdl.download_url(url, url_key)
 
     if file_paths is None:
-        lolg.error(f"Error while downloading '{url}'")
+        lolg.error("Error while downloading '{}'", url)
         return None
     elif len(file_paths) == 0:
         return ""
-    elif len(file_paths) == 1:
-        file_name = _move_file_to_cache(_cache_dir(), file_paths[0], url_key)
+    ratelimit.succeeded(url)
+
+    downloader_name = _get_name(downloader)
+    n_bytes = sum(f.stat().st_size for f in file_paths if f.exists())
+    DOWNLOAD_BYTES.labels(downloader=downloader_name).observe(n_bytes)
+    if len(file_paths) == 1:
+        with (
+            tracing.span("ingest.move", url_key),
+            INGEST_DURATION.labels(method="move").time(),
+        ):
+            file_name = _move_file_to_cache(_cache_dir(), file_paths[0], url_key)
     else:
-        file_name = _zip_files_to_cache(_cache_dir(), file_paths, url_key)
-    lolg.info(f"Moved file to cache: {file_name}")
+        # the files are deleted only after the ZIP file is complete
+        try:
+            diskspace.reserve_ingest(url_key, n_bytes)
+        except diskspace.DiskFull:
+            _discard(downloader, url_key, file_paths)
+            raise
+        with (
+            tracing.span("ingest.zip", url_key, files=len(file_paths)),
+            INGEST_DURATION.labels(method="zip").time(),
+        ):
+            file_name = _zip_files_to_cache(_cache_dir(), file_paths, url_key)
+    lolg.info("Moved file to cache: {}", file_name)
+    # the files are in the cache, drop the emptied job directories of the downloader
+    if cleanup := getattr(downloader, "cleanup", None):
+        cleanup(url_key)
     return file_name
+
+
+def download_file(url: str, url_key: str) -> str | None:
+    """
+    Return single file path relative to cache directory.
+    Return `""` on retryable failure.
+    Return `None` on error.
+    Raise DiskFull if there is no room for the download.
+    """
+
+    with tracing.span("registry.match", url_key):
+        downloaders = get_downloaders_for_url(url)
+    lolg.debug("Using downloaders: {}", [d.__name__ for d in downloaders])
+
+    # the reservation lasts until the files are in the cache
+    with diskspace.admit(url_key, _cache_dir()):
+        return _download_to_cache(url, url_key, downloaders)
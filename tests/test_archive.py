@@ -0,0 +1,88 @@
+"""Tests for hylde.archive module."""
+
+import zipfile
+
+import pytest
+
+from hylde import archive
+
+
+@pytest.fixture(autouse=True)
+def clear_index():
+    archive._index.clear()
+    yield
+    archive._index.clear()
+
+
+@pytest.fixture
+def zip_path(tmp_path):
+    path = tmp_path / "a.zip"
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_STORED) as zf:
+        zf.writestr("dir/", b"")
+        zf.writestr("01.jpg", b"first")
+        zf.writestr("02.jpg", b"second" * 100, compress_type=zipfile.ZIP_DEFLATED)
+    return path
+
+
+class TestReadMembers:
+    def test_skips_directories_and_finds_data(self, zip_path):
+        members = archive.read_members(zip_path)
+
+        assert [m.name for m in members] == ["01.jpg", "02.jpg"]
+        assert [m.index for m in members] == [0, 1]
+        first = members[0]
+        assert first.stored and not members[1].stored
+        with open(zip_path, "rb") as f:
+            f.seek(first.offset)
+            assert f.read(first.size) == b"first"
+
+    def test_not_an_archive(self, tmp_path):
+        path = tmp_path / "a.zip"
+        path.write_bytes(b"jpeg")
+
+        with pytest.raises(zipfile.BadZipFile):
+            archive.read_members(path)
+
+
+class TestGetMembers:
+    def test_index_is_reused_until_archive_changes(self, zip_path):
+        members = archive.get_members(zip_path)
+        assert archive.get_members(zip_path) is members
+
+        with zipfile.ZipFile(zip_path, "a") as zf:
+            zf.writestr("03.jpg", b"third")
+
+        assert len(archive.get_members(zip_path)) == 3
+
+
+class TestFindMember:
+    def test_by_name_then_index(self, zip_path):
+        members = archive.get_members(zip_path)
+
+        assert archive.find_member(members, "02.jpg").index == 1
+        assert archive.find_member(members, "0").name == "01.jpg"
+        assert archive.find_member(members, "2") is None
+        assert archive.find_member(members, "03.jpg") is None
+
+
+class TestOpenMember:
+    def test_stored_member_reads_only_its_bytes(self, zip_path):
+        member = archive.get_members(zip_path)[0]
+
+        reader = archive.open_member(zip_path, member)
+        try:
+            assert isinstance(reader, archive.StoredMemberReader)
+            assert reader.read(3) == b"fir"
+            assert reader.read() == b"st"
+            assert reader.read() == b""
+            with open(reader.fileno(), "rb", closefd=False) as f:
+                # sendfile starts at the current position of the descriptor
+                assert f.tell() == member.offset
+        finally:
+            reader.close()
+
+    def test_compressed_member_is_decompressed(self, zip_path):
+        member = archive.get_members(zip_path)[1]
+
+        with archive.open_member(zip_path, member) as f:
+            assert f.read() == b"second" * 100
@@ -0,0 +1,92 @@
+"""Tests for hylde.cancellation module."""
+
+import threading
+import time
+
+import pytest
+
+from hylde import cancellation
+
+
+@pytest.fixture(autouse=True)
+def clear_tokens():
+    yield
+    cancellation._tokens.clear()
+
+
+class TestCancelToken:
+    def test_check_raises_once_cancelled(self):
+        token = cancellation.CancelToken("key")
+        token.check()
+
+        assert token.cancel()
+        assert not token.cancel(cancellation.IDLE)
+
+        with pytest.raises(cancellation.Cancelled, match="request"):
+            token.check()
+
+    def test_children_are_cancelled_with_parent_but_not_the_other_way(self):
+        parent = cancellation.CancelToken("key")
+        a, b = parent.child(), parent.child()
+
+        a.cancel(cancellation.HEDGE)
+        assert not parent.cancelled and not b.cancelled
+
+        parent.cancel()
+        assert b.cancelled and b.reason == "request"
+        assert parent.child().cancelled
+
+    def test_idle_timeout_cancels_untouched_token(self):
+        token = cancellation.CancelToken("key", idle_timeout=0.05)
+        child = token.child()
+
+        time.sleep(0.03)
+        token.touch()
+        time.sleep(0.03)
+        assert not child.cancelled
+
+        time.sleep(0.05)
+        assert child.cancelled
+        assert token.reason == "idle"
+
+    def test_sleep_wakes_up_on_cancel(self):
+        token = cancellation.CancelToken("key")
+        threading.Timer(0.02, token.cancel).start()
+        start = time.monotonic()
+
+        with pytest.raises(cancellation.Cancelled):
+            token.sleep(5)
+
+        assert time.monotonic() - start < 1
+
+
+class TestRegistry:
+    def test_cancel_by_url_key(self):
+        token = cancellation.start("key")
+
+        assert cancellation.cancel("key")
+        assert not cancellation.cancel("key")
+        assert not cancellation.cancel("other")
+        assert token.cancelled
+
+    def test_touch_and_finish(self):
+        token = cancellation.start("key", idle_timeout=60)
+        token.touched -= 30
+
+        cancellation.touch("key")
+        cancellation.touch("other")
+        cancellation.finish("key")
+
+        assert time.monotonic() - token.touched < 1
+        assert cancellation.get("key") is None
+
+    def test_check_uses_token_of_current_thread(self):
+        token = cancellation.CancelToken("key")
+        token.cancel()
+
+        cancellation.check()
+        with cancellation.use(token):
+            assert cancellation.current() is token
+            with pytest.raises(cancellation.Cancelled):
+                cancellation.check()
+        assert cancellation.current() is None
@@ -0,0 +1,265 @@
+"""Tests for hylde.coordination module."""
+
+import os
+import socketserver
+import threading
+import time
+
+import pytest
+
+from hylde import coordination
+
+
+class _RespHandler(socketserver.StreamRequestHandler):
+    """Redis stand-in that knows the commands used for leases."""
+
+    def _read_command(self) -> list[str] | None:
+        line = self.rfile.readline()
+        if not line:
+            return None
+        args = []
+        for _ in range(int(line[1:])):
+            length = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(length + 2)[:-2].decode())
+        return args
+
+    def _reply(self, value):
+        if value is None:
+            self.wfile.write(b"$-1\r\n")
+        elif isinstance(value, int):
+            self.wfile.write(b":%d\r\n" % value)
+        elif value == "OK":
+            self.wfile.write(b"+OK\r\n")
+        else:
+            data = value.encode()
+            self.wfile.write(b"$%d\r\n%s\r\n" % (len(data), data))
+
+    def _get(self, key):
+        value, expires = self.server.data.get(key, (None, 0))
+        if value is not None and expires < time.monotonic():
+            del self.server.data[key]
+            return None
+        return value
+
+    def _eval(self, script, key, owner, *args):
+        # runs the lease scripts the way Redis would, without other commands in between
+        if self._get(key) != owner:
+            return 0
+        if script == coordination.RedisCoordinator.RENEW_SCRIPT:
+            self.server.data[key] = (owner, time.monotonic() + int(args[0]) / 1000)
+            return 1
+        if script == coordination.RedisCoordinator.RELEASE_SCRIPT:
+            del self.server.data[key]
+            return 1
+        raise ValueError("unknown script")
+
+    def handle(self):
+        data = self.server.data
+        while (args := self._read_command()) is not None:
+            self.server.commands.append(args[0].upper())
+            command, key = args[0].upper(), args[1] if len(args) > 1 else None
+            if command == "SET":
+                if "NX" in args and self._get(key) is not None:
+                    self._reply(None)
+                    continue
+                ttl = int(args[args.index("PX") + 1]) / 1000
+                data[key] = (args[2], time.monotonic() + ttl)
+                self._reply("OK")
+            elif command == "GET":
+                self._reply(self._get(key))
+            elif command == "PEXPIRE":
+                if (value := self._get(key)) is None:
+                    self._reply(0)
+                else:
+                    data[key] = (value, time.monotonic() + int(args[2]) / 1000)
+                    self._reply(1)
+            elif command == "DEL":
+                self._reply(int(data.pop(key, None) is not None))
+            elif command == "EVAL":
+                self._reply(self._eval(args[1], *args[3:]))
+            else:
+                self.wfile.write(b"-ERR unknown command\r\n")
+
+
+@pytest.fixture
+def redis_server():
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), _RespHandler)
+    server.daemon_threads = True
+    server.data = {}
+    server.commands = []
+    thread = threading.Thread(
+        target=server.serve_forever, kwargs={"poll_interval": 0.01}, daemon=True
+    )
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def redis_url(redis_server):
+    return f"redis://127.0.0.1:{redis_server.server_address[1]}/0"
+
+
+@pytest.fixture(params=["file", "redis"])
+def make_node(request, tmp_path):
+    def make(node_id, ttl=60):
+        if request.param == "file":
+            return coordination.FileCoordinator(node_id, ttl, tmp_path)
+        return coordination.RedisCoordinator(
+            node_id, ttl, request.getfixturevalue("redis_url")
+        )
+
+    return make
+
+
+class TestCoordinator:
+    def test_claim_or_join(self, make_node):
+        a, b = make_node("a"), make_node("b")
+
+        assert a.claim("key")
+        assert not b.claim("key")
+        assert b.holder("key") == "a"
+
+    def test_claims_are_reentrant(self, make_node):
+        a = make_node("a")
+
+        assert a.claim("key")
+        assert a.claim("key")
+
+    def test_release_frees_claim(self, make_node):
+        a, b = make_node("a"), make_node("b")
+        a.claim("key")
+
+        a.release("key")
+
+        assert a.holder("key") is None
+        assert b.claim("key")
+
+    def test_release_keeps_foreign_claim(self, make_node):
+        a, b = make_node("a"), make_node("b")
+        a.claim("key")
+        b._held.add("key")
+
+        b.release("key")
+
+        assert b.holder("key") == "a"
+
+    def test_renew_extends_lease(self, make_node):
+        a = make_node("a", ttl=0.2)
+        a.claim("key")
+
+        time.sleep(0.1)
+        assert a._renew("key")
+        time.sleep(0.15)
+
+        assert a.holder("key") == "a"
+
+    def test_stale_lease_is_taken_over(self, make_node):
+        a, b = make_node("a", ttl=0.05), make_node("b", ttl=0.05)
+        a.claim("key")
+        a._held.clear()  # crashed, no more renewals
+
+        time.sleep(0.1)
+
+        assert b.holder("key") is None
+        assert b.claim("key")
+        assert b.holder("key") == "b"
+        assert not a._renew("key")
+
+    def test_backends_must_implement_leases(self):
+        class Incomplete(coordination.Coordinator):
+            def holder(self, url_key):
+                return None
+
+        with pytest.raises(TypeError):
+            Incomplete("a", 60)
+
+    def test_lost_backend_does_not_block_downloads(self):
+        node = coordination.RedisCoordinator("a", 60, "redis://127.0.0.1:1/0")
+
+        assert node.claim("key")
+        assert node.holder("key") is None
+
+
+class TestFileCoordinator:
+    def test_fresh_lease_is_not_taken_over(self, tmp_path):
+        a = coordination.FileCoordinator("a", 60, tmp_path)
+        b = coordination.FileCoordinator("b", 60, tmp_path)
+        a.claim("key")
+        lease = tmp_path / "key.lease"
+        os.utime(lease, (time.time() - 30, time.time() - 30))
+
+        assert not b.claim("key")
+        assert a.holder("key") == "a"
+        assert sorted(p.name for p in tmp_path.iterdir()) == ["key.lease"]
+
+    def test_half_written_stale_lease_is_taken_over(self, tmp_path):
+        lease = tmp_path / "key.lease"
+        lease.write_text('{"no')
+        os.utime(lease, (time.time() - 120, time.time() - 120))
+
+        assert coordination.FileCoordinator("b", 60, tmp_path).claim("key")
+
+
+class TestRedisCoordinator:
+    def test_renew_and_release_check_owner_atomically(self, redis_server, redis_url):
+        a = coordination.RedisCoordinator("a", 60, redis_url)
+        a.claim("key")
+        # a's lease expired and b took it over
+        redis_server.data["hylde:lease:key"] = ("b", time.monotonic() + 60)
+        redis_server.commands.clear()
+
+        assert not a._renew("key")
+        a.release("key")
+
+        assert redis_server.commands == ["EVAL", "EVAL"]
+        assert a.holder("key") == "b"
+
+    def test_release_deletes_own_lease(self, redis_server, redis_url):
+        a = coordination.RedisCoordinator("a", 60, redis_url)
+        a.claim("key")
+
+        a.release("key")
+
+        assert "hylde:lease:key" not in redis_server.data
+
+
+class TestIndexLock:
+    def test_shared_index_takes_turns(self, tmp_path):
+        node = coordination.FileCoordinator("a", 60, tmp_path / "leases")
+        index = tmp_path / "cache.db"
+        entered = threading.Event()
+
+        def other():
+            with node.index_lock(index):
+                entered.set()
+
+        with node.index_lock(index):
+            threading.Thread(target=other, daemon=True).start()
+            assert not entered.wait(0.1)
+
+        assert entered.wait(1)
+        assert (tmp_path / "cache.db.lock").exists()
+
+    def test_local_index_needs_no_lock_file(self, tmp_path):
+        with coordination.LocalCoordinator("a", 60).index_lock(tmp_path / "cache.db"):
+            pass
+
+        assert list(tmp_path.iterdir()) == []
+
+
+class TestRespClient:
+    def test_selects_database_and_reads_replies(self, redis_url):
+        client = coordination.RespClient(redis_url)
+
+        assert client.execute("SET", "k", "v", "PX", 1000) == "OK"
+        assert client.execute("GET", "k") == "v"
+        assert client.execute("DEL", "k") == 1
+        assert client.execute("GET", "k") is None
+
+    def test_error_replies_raise(self, redis_url):
+        client = coordination.RespClient(redis_url)
+
+        with pytest.raises(coordination.RespError):
+            client.execute("FLUSHALL")
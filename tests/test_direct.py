@@ -0,0 +1,224 @@
+"""Tests for the direct HTTP downloader."""
+
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import ClassVar
+from unittest.mock import patch
+
+import pytest
+
+from hylde import cancellation, diskspace
+from hylde.downloaders import direct
+
+BODY = bytes(range(256)) * 4096  # 1 MiB
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    ranges = True
+    status = 200
+    content_type = "video/mp4"
+    requests: ClassVar[list] = []
+
+    def do_GET(self):
+        type(self).requests.append(self.headers.get("Range"))
+        if self.status != 200:
+            self.send_response(self.status)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        start, end, status = 0, len(BODY) - 1, 200
+        if self.ranges and (
+            match := re.match(r"bytes=(\d+)-(\d+)", self.headers.get("Range", ""))
+        ):
+            start, end, status = int(match[1]), min(int(match[2]), len(BODY) - 1), 206
+        self.send_response(status)
+        self.send_header("Content-Type", self.content_type)
+        self.send_header("Content-Length", str(end - start + 1))
+        if self.ranges:
+            self.send_header("Accept-Ranges", "bytes")
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(BODY)}")
+        self.end_headers()
+        self.wfile.write(BODY[start : end + 1])
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def origin():
+    handler = type("Handler", (_Handler,), {"requests": []})
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(
+        target=httpd.serve_forever, kwargs={"poll_interval": 0.01}, daemon=True
+    )
+    thread.start()
+    yield handler, f"http://127.0.0.1:{httpd.server_port}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture(autouse=True)
+def direct_settings(tmp_path):
+    values = {
+        "stagingdir": str(tmp_path),
+        "segments": 4,
+        "segmentthreshold": 1 << 19,
+        "minsegmentsize": 1 << 16,
+        "chunksize": 1 << 16,
+    }
+    with patch.object(
+        direct, "_setting", side_effect=lambda name, default: values.get(name, default)
+    ):
+        yield values
+
+
+class TestDownloadUrl:
+    def test_single_stream_below_threshold(self, origin, direct_settings):
+        handler, base_url = origin
+        direct_settings["segmentthreshold"] = len(BODY) + 1
+
+        files = direct.download_url(f"{base_url}/media/clip.mp4", "key")
+
+        assert len(files) == 1
+        assert files[0].name == "clip.mp4"
+        assert files[0].read_bytes() == BODY
+        assert handler.requests == [f"bytes=0-{len(BODY)}"]
+
+    def test_segments_large_files(self, origin):
+        handler, base_url = origin
+
+        files = direct.download_url(f"{base_url}/clip.mp4", "key")
+
+        assert files[0].read_bytes() == BODY
+        # the first response is the first segment, nothing asks for the whole file
+        assert handler.requests[0] == f"bytes=0-{(1 << 19) - 1}"
+        assert len(handler.requests) == 4
+        assert None not in handler.requests
+
+    def test_single_stream_without_segments(self, origin, direct_settings):
+        handler, base_url = origin
+        direct_settings["segments"] = 1
+
+        files = direct.download_url(f"{base_url}/clip.mp4", "key")
+
+        assert files[0].read_bytes() == BODY
+        assert handler.requests == [None]
+
+    def test_falls_back_without_range_support(self, origin):
+        handler, base_url = origin
+        handler.ranges = False
+
+        files = direct.download_url(f"{base_url}/clip.mp4", "key")
+
+        assert files[0].read_bytes() == BODY
+        # the server ignored the range and sent everything in the first response
+        assert handler.requests == [f"bytes=0-{(1 << 19) - 1}"]
+
+    def test_reports_progress(self, origin):
+        _, base_url = origin
+        with patch.object(direct.progress, "update") as update:
+            direct.download_url(f"{base_url}/clip.mp4", "key")
+
+        assert update.call_args_list[-1].args == ("key", len(BODY), len(BODY))
+
+    def test_not_found_is_failed(self, origin):
+        handler, base_url = origin
+        handler.status = 404
+
+        assert direct.download_url(f"{base_url}/clip.mp4", "key") is None
+
+    def test_server_error_is_retryable(self, origin, tmp_path):
+        handler, base_url = origin
+        handler.status = 503
+
+        assert direct.download_url(f"{base_url}/clip.mp4", "key") == []
+        assert list(tmp_path.iterdir()) == []
+
+    def test_throttling_slows_down_host(self, origin):
+        handler, base_url = origin
+        handler.status = 429
+
+        with patch.object(direct.ratelimit, "throttled") as throttled:
+            assert direct.download_url(f"{base_url}/clip.mp4", "key") == []
+
+        throttled.assert_called_once_with(f"{base_url}/clip.mp4", None)
+
+    def test_web_page_is_failed(self, origin):
+        handler, base_url = origin
+        handler.content_type = "text/html; charset=utf-8"
+
+        assert direct.download_url(f"{base_url}/clip.mp4", "key") is None
+
+    def test_connection_error_is_retryable(self):
+        assert direct.download_url("http://127.0.0.1:1/clip.mp4", "key") == []
+
+    @pytest.mark.parametrize("segments", [1, 4])
+    def test_cancel_stops_transfer_and_deletes_files(
+        self, origin, direct_settings, tmp_path, segments
+    ):
+        _, base_url = origin
+        direct_settings["segments"] = segments
+        token = cancellation.CancelToken("key")
+        with (
+            patch.object(
+                direct.progress, "update", side_effect=lambda *_: token.cancel()
+            ),
+            cancellation.use(token),
+            pytest.raises(cancellation.Cancelled),
+        ):
+            direct.download_url(f"{base_url}/clip.mp4", "key")
+
+        assert list(tmp_path.iterdir()) == []
+
+    def test_reserves_content_length(self, origin, tmp_path):
+        _, base_url = origin
+        with (
+            patch.object(
+                direct.diskspace,
+                "reserve",
+                side_effect=diskspace.DiskFull(tmp_path, 1024),
+            ) as reserve,
+            pytest.raises(diskspace.DiskFull),
+        ):
+            direct.download_url(f"{base_url}/clip.mp4", "key")
+
+        reserve.assert_called_once_with("key", len(BODY), tmp_path)
+        assert list(tmp_path.iterdir()) == []
+
+
+class TestFileName:
+    def _response(self, headers):
+        response = direct.requests.Response()
+        response.headers.update(headers)
+        return response
+
+    def test_content_disposition(self):
+        response = self._response(
+            {"Content-Disposition": 'attachment; filename="a b.jpg"'}
+        )
+        assert direct._file_name("https://x.com/dl", response) == "a b.jpg"
+
+    def test_url_path_is_unquoted_and_sanitized(self):
+        response = self._response({})
+        assert (
+            direct._file_name("https://x.com/a/%3Cx%3E.png?y=1", response) == "_x_.png"
+        )
+
+    def test_content_type_when_nameless(self):
+        response = self._response({"Content-Type": "image/png"})
+        assert direct._file_name("https://x.com/", response) == "file.png"
+
+
+class TestCleanup:
+    def test_deletes_partial_files_of_url_key(self, tmp_path):
+        (tmp_path / "key" / "job").mkdir(parents=True)
+        (tmp_path / "key" / "job" / "clip.mp4").write_bytes(b"partial")
+        (tmp_path / "other").mkdir()
+
+        direct.cleanup("key")
+
+        assert [p.name for p in tmp_path.iterdir()] == ["other"]
@@ -0,0 +1,186 @@
+"""Tests for hylde.diskspace module."""
+
+import threading
+import time
+from pathlib import Path
+from unittest.mock import MagicMock
+
+import pytest
+from dynaconf import DataDict
+
+from hylde import cancellation, diskspace, progress
+
+CACHE = Path("/cache")
+DOWNLOADS = Path("/downloads/jd")
+
+
+@pytest.fixture(autouse=True)
+def disk(monkeypatch):
+    """Two volumes named after the first part of their paths."""
+    free = {"cache": 1000, "downloads": 1000}
+    fake_settings = MagicMock()
+    fake_settings.diskspace = DataDict(
+        enabled=True, minfree=100, defaultestimate=200, maxwait=0, evict=False
+    )
+    monkeypatch.setattr(diskspace, "_device", lambda path: path.parts[1])
+    monkeypatch.setattr(diskspace, "_free", lambda path: free[path.parts[1]])
+    monkeypatch.setattr(diskspace, "settings", fake_settings)
+    diskspace.reset()
+    yield free
+    diskspace.reset()
+    diskspace.set_evictor(None, None)
+    progress.finish("key")
+
+
+class TestAdmit:
+    def test_reserves_estimate_until_done(self):
+        with diskspace.admit("key", CACHE) as reservation:
+            status = diskspace.get_status()
+            assert reservation.estimated
+            assert status["reservations"][0]["bytes"] == 200
+            assert status["volumes"] == [
+                {"path": "/cache", "free": 1000, "reserved": 200}
+            ]
+
+        assert diskspace.get("key") is None
+        assert diskspace.reserved() == 0
+
+    def test_full_disk_raises_after_maxwait(self, disk):
+        disk["cache"] = 250
+
+        with pytest.raises(diskspace.DiskFull) as e, diskspace.admit("key", CACHE):
+            pass
+
+        assert e.value.missing == 50
+        assert diskspace.get("key") is None
+
+    def test_waits_for_other_downloads(self):
+        diskspace.settings.diskspace.maxwait = 5
+        first = diskspace.admit("first", CACHE)
+        first.__enter__()
+        diskspace.reserve("first", 800)
+        admitted = threading.Event()
+
+        def second():
+            with diskspace.admit("second", CACHE):
+                admitted.set()
+
+        threading.Thread(target=second, daemon=True).start()
+        for _ in range(100):
+            if diskspace.get_status()["deferred"]:
+                break
+            time.sleep(0.01)
+        assert diskspace.get_status()["deferred"] == ["second"]
+        assert not admitted.is_set()
+
+        first.__exit__(None, None, None)
+
+        assert admitted.wait(1)
+
+    def test_cancelling_stops_waiting(self, disk):
+        diskspace.settings.diskspace.maxwait = 5
+        disk["cache"] = 0
+        token = cancellation.start("key")
+        threading.Timer(0.05, token.cancel).start()
+
+        try:
+            with pytest.raises(cancellation.Cancelled), diskspace.admit("key", CACHE):
+                pass
+        finally:
+            cancellation.finish("key")
+
+        assert diskspace.get_status()["deferred"] == []
+
+    def test_evicts_to_make_room(self, disk):
+        diskspace.settings.diskspace.evict = True
+        select = MagicMock(return_value=[("old", 40), ("older", 20)])
+        evicted = []
+
+        def evict(url_key):
+            # other downloads are not blocked while files are deleted
+            status = threading.Thread(target=diskspace.get_status)
+            status.start()
+            status.join(1)
+            assert not status.is_alive()
+            evicted.append(url_key)
+            disk["cache"] += dict(select.return_value)[url_key]
+
+        diskspace.set_evictor(select, evict)
+        disk["cache"] = 250
+
+        with diskspace.admit("key", CACHE):
+            pass
+
+        select.assert_called_once_with(50)
+        assert evicted == ["old", "older"]
+
+    def test_disabled(self, disk):
+        diskspace.settings.diskspace.enabled = False
+        disk["cache"] = 0
+
+        with diskspace.admit("key", CACHE) as reservation:
+            assert reservation is None
+
+
+class TestReserve:
+    def test_known_size_replaces_estimate(self):
+        progress.start("key")
+        with diskspace.admit("key", CACHE) as reservation:
+            diskspace.reserve("key", 600)
+            progress.update("key", 250)
+
+            assert not reservation.estimated
+            assert reservation.remaining() == 350
+            assert reservation.held("cache") == 350
+
+    def test_too_large_keeps_estimate(self):
+        with diskspace.admit("key", CACHE) as reservation:
+            with pytest.raises(diskspace.DiskFull):
+                diskspace.reserve("key", 901)
+
+            assert reservation.nbytes == 200
+            assert reservation.estimated
+
+    def test_other_volume_holds_size_on_both(self, disk):
+        with diskspace.admit("key", CACHE) as reservation:
+            diskspace.reserve("key", 500, DOWNLOADS)
+
+            # moving from another volume copies the files into the cache
+            assert reservation.held("downloads") == 500
+            assert reservation.held("cache") == 500
+
+            disk["downloads"] = 550
+            with pytest.raises(diskspace.DiskFull) as e:
+                diskspace.reserve("key", 600, DOWNLOADS)
+            assert e.value.directory == DOWNLOADS
+
+    def test_ingest_counts_on_cache_volume(self):
+        with diskspace.admit("key", CACHE) as reservation:
+            diskspace.reserve_ingest("key", 300)
+
+            assert reservation.held("cache") == 500
+            with pytest.raises(diskspace.DiskFull):
+                diskspace.reserve_ingest("key", 701)
+            assert reservation.ingest == 300
+
+    def test_hedged_attempts_share_largest_size(self):
+        token = cancellation.CancelToken("key")
+        with diskspace.admit("key", CACHE) as reservation:
+            with cancellation.use(token.child()):
+                diskspace.reserve("key", 500)
+            with cancellation.use(token.child()):
+                diskspace.reserve("key", 300)
+
+            assert reservation.nbytes == 500
+
+            # a single attempt learning a smaller size replaces its own
+            diskspace.reserve("key", 400)
+            diskspace.reserve("key", 100)
+            assert reservation.nbytes == 500
+
+    def test_unknown_size_or_download_is_ignored(self):
+        diskspace.reserve("other", 10**9)
+
+        with diskspace.admit("key", CACHE) as reservation:
+            diskspace.reserve("key", None)
+            assert reservation.nbytes == 200
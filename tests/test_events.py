@@ -0,0 +1,34 @@
+"""Tests for hylde.events module."""
+
+from hylde import events
+
+
+class TestEvents:
+    """Tests for subscribe/publish."""
+
+    def test_publish_reaches_subscribers(self):
+        q = events.subscribe(["a", "b"])
+        events.publish("a", events.SUCCESS)
+        events.publish("c", events.FAILED)
+
+        assert q.get_nowait() == ("a", events.SUCCESS)
+        assert q.empty()
+        events.unsubscribe(q, ["a", "b"])
+
+    def test_unsubscribe_stops_delivery(self):
+        q = events.subscribe(["a"])
+        events.unsubscribe(q, ["a"])
+        events.publish("a", events.SUCCESS)
+
+        assert q.empty()
+        assert "a" not in events._subscribers
+
+    def test_multiple_subscribers(self):
+        q1 = events.subscribe(["a"])
+        q2 = events.subscribe(["a"])
+        events.publish("a", events.RETRYABLE)
+
+        assert q1.get_nowait() == ("a", events.RETRYABLE)
+        assert q2.get_nowait() == ("a", events.RETRYABLE)
+        events.unsubscribe(q1, ["a"])
+        events.unsubscribe(q2, ["a"])
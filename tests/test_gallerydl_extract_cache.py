@@ -0,0 +1,268 @@
+"""Tests for caching of resolved gallery-dl extractor results."""
+
+from unittest.mock import MagicMock, patch
+
+import gallery_dl as gdl
+import pytest
+from gallery_dl.extractor.message import Message
+
+from hylde import cancellation
+from hylde.downloaders import gallerydl
+
+MEDIA_URL = "https://cdn.example.com/file.mp4"
+
+
+class TestExtractCache:
+    """Tests for download_url extractor result caching and media reuse."""
+
+    @pytest.fixture(autouse=True)
+    def patch_gdl(self, tmp_path):
+        """Isolate gallery-dl config, temp output and extractor caches."""
+        gallerydl._resolved.clear()
+        gallerydl._media_owners.clear()
+        with (
+            patch.object(gdl.config, "set"),
+            patch("hylde.downloaders.gallerydl.output_dir", tmp_path / "temp"),
+        ):
+            yield
+
+    @pytest.fixture
+    def resolver(self):
+        r = MagicMock()
+        r.messages = [
+            (Message.Directory, None, {"id": 1}),
+            (Message.Url, MEDIA_URL, {"id": 1}),
+        ]
+        return r
+
+    @pytest.fixture
+    def downloaded(self, tmp_path):
+        f = tmp_path / "dl" / "file.mp4"
+        f.parent.mkdir(parents=True)
+        f.write_text("data")
+        return f
+
+    def _fake_job(self):
+        job = MagicMock()
+        job.has_incomplete_read = False
+        job.was_throttled = False
+        return job
+
+    def _fake_collector(self, files):
+        fc = MagicMock()
+        fc.files = files
+        fc.errors = []
+        return fc
+
+    def test_caches_messages_after_success(self, resolver, downloaded):
+        with (
+            patch("hylde.downloaders.gallerydl.ResolveJob", return_value=resolver),
+            patch("hylde.downloaders.gallerydl.GoodJob", return_value=self._fake_job()),
+            patch(
+                "hylde.downloaders.gallerydl.FileCollector",
+                return_value=self._fake_collector([downloaded]),
+            ),
+        ):
+            gallerydl.download_url("https://page.example.com/a", "key_a")
+
+        assert (
+            gallerydl._resolved.get("https://page.example.com/a") is resolver.messages
+        )
+        assert gallerydl._media_owners.get(MEDIA_URL) == "key_a"
+
+    def test_cached_messages_skip_extractor(self, resolver, downloaded):
+        gallerydl._resolved.set("https://page.example.com/a", resolver.messages)
+
+        with (
+            patch("hylde.downloaders.gallerydl.ResolveJob") as resolve_job,
+            patch(
+                "hylde.downloaders.gallerydl.GoodJob", return_value=self._fake_job()
+            ) as good_job,
+            patch(
+                "hylde.downloaders.gallerydl.FileCollector",
+                return_value=self._fake_collector([downloaded]),
+            ),
+        ):
+            result = gallerydl.download_url("https://page.example.com/a", "key_a")
+
+        assert result == [downloaded]
+        resolve_job.assert_not_called()
+        good_job.assert_called_once_with(
+            "https://page.example.com/a", messages=resolver.messages
+        )
+
+    def test_failed_cached_messages_extract_again(self, resolver, downloaded):
+        gallerydl._resolved.set("https://page.example.com/a", [])
+        collectors = [self._fake_collector([]), self._fake_collector([downloaded])]
+
+        with (
+            patch(
+                "hylde.downloaders.gallerydl.ResolveJob", return_value=resolver
+            ) as resolve_job,
+            patch("hylde.downloaders.gallerydl.GoodJob", return_value=self._fake_job()),
+            patch("hylde.downloaders.gallerydl.FileCollector", side_effect=collectors),
+        ):
+            result = gallerydl.download_url("https://page.example.com/a", "key_a")
+
+        assert result == [downloaded]
+        resolve_job.assert_called_once()
+        assert (
+            gallerydl._resolved.get("https://page.example.com/a") is resolver.messages
+        )
+
+    @pytest.mark.parametrize("flag", ["was_throttled", "has_incomplete_read"])
+    def test_throttled_cached_messages_do_not_extract_again(self, resolver, flag):
+        gallerydl._resolved.set("https://page.example.com/a", resolver.messages)
+        job = self._fake_job()
+        setattr(job, flag, True)
+
+        with (
+            patch("hylde.downloaders.gallerydl.ResolveJob") as resolve_job,
+            patch("hylde.downloaders.gallerydl.GoodJob", return_value=job) as good_job,
+            patch(
+                "hylde.downloaders.gallerydl.FileCollector",
+                return_value=self._fake_collector([]),
+            ),
+            patch("hylde.downloaders.gallerydl.ratelimit.throttled"),
+        ):
+            result = gallerydl.download_url("https://page.example.com/a", "key_a")
+
+        assert result == []
+        resolve_job.assert_not_called()
+        good_job.assert_called_once()
+        # the cached direct urls are still good for the next attempt
+        assert (
+            gallerydl._resolved.get("https://page.example.com/a") is resolver.messages
+        )
+
+    def test_failed_download_is_not_cached(self, resolver):
+        fc = self._fake_collector([])
+        fc.errors = ["error"]
+
+        with (
+            patch("hylde.downloaders.gallerydl.ResolveJob", return_value=resolver),
+            patch("hylde.downloaders.gallerydl.GoodJob", return_value=self._fake_job()),
+            patch("hylde.downloaders.gallerydl.FileCollector", return_value=fc),
+        ):
+            result = gallerydl.download_url("https://page.example.com/a", "key_a")
+
+        assert result is None
+        assert gallerydl._resolved.get("https://page.example.com/a") is None
+
+    def test_no_extractor_results_is_retryable(self):
+        resolver = MagicMock()
+        resolver.messages = []
+
+        with (
+            patch("hylde.downloaders.gallerydl.ResolveJob", return_value=resolver),
+            patch("hylde.downloaders.gallerydl.GoodJob") as good_job,
+        ):
+            result = gallerydl.download_url("https://page.example.com/a", "key_a")
+
+        assert result == []
+        good_job.assert_not_called()
+
+    def test_reuses_file_of_page_with_same_media(self, resolver, tmp_path):
+        cached = tmp_path / "cache" / "key_a" / "file.mp4"
+        cached.parent.mkdir(parents=True)
+        cached.write_text("data")
+        gallerydl._media_owners.set(MEDIA_URL, "key_a")
+        fake_settings = MagicMock()
+        fake_settings.cachedir = str(tmp_path / "cache")
+
+        with (
+            patch("hylde.downloaders.gallerydl.settings", fake_settings),
+            patch("hylde.downloaders.gallerydl.ResolveJob", return_value=resolver),
+            patch("hylde.downloaders.gallerydl.GoodJob") as good_job,
+        ):
+            result = gallerydl.download_url("https://page.example.com/b", "key_b")
+
+        good_job.assert_not_called()
+        assert len(result) == 1
+        assert result[0].name == "file.mp4"
+        assert result[0].read_text() == "data"
+        assert cached.exists()
+
+    def test_downloads_when_owner_file_is_gone(self, resolver, downloaded, tmp_path):
+        gallerydl._media_owners.set(MEDIA_URL, "key_a")
+        fake_settings = MagicMock()
+        fake_settings.cachedir = str(tmp_path / "cache")
+
+        with (
+            patch("hylde.downloaders.gallerydl.settings", fake_settings),
+            patch("hylde.downloaders.gallerydl.ResolveJob", return_value=resolver),
+            patch("hylde.downloaders.gallerydl.GoodJob", return_value=self._fake_job()),
+            patch(
+                "hylde.downloaders.gallerydl.FileCollector",
+                return_value=self._fake_collector([downloaded]),
+            ),
+        ):
+            result = gallerydl.download_url("https://page.example.com/b", "key_b")
+
+        assert result == [downloaded]
+        assert gallerydl._media_owners.get(MEDIA_URL) == "key_b"
+
+
+class TestGoodJobReplay:
+    """Tests for replaying resolved messages through GoodJob.dispatch."""
+
+    def test_replays_copies_of_resolved_messages(self):
+        kwdict = {"id": 1}
+        messages = [(Message.Url, MEDIA_URL, kwdict)]
+        job = gallerydl.GoodJob.__new__(gallerydl.GoodJob)
+        job.messages = messages
+
+        with patch.object(gdl.job.DownloadJob, "dispatch") as dispatch:
+            job.dispatch(iter(()))
+
+        replayed = dispatch.call_args.args[0]
+        assert replayed == messages
+        assert replayed[0][2] is not kwdict
+
+
+class TestCancellation:
+    """Tests for stopping gallery-dl jobs that were cancelled."""
+
+    def test_no_further_files_after_cancel(self):
+        job = gallerydl.GoodJob.__new__(gallerydl.GoodJob)
+        token = cancellation.CancelToken("key")
+        token.cancel()
+
+        with (
+            patch.object(gdl.job.DownloadJob, "handle_url") as handle_url,
+            cancellation.use(token),
+            pytest.raises(cancellation.Cancelled),
+        ):
+            job.handle_url(MEDIA_URL, {})
+
+        handle_url.assert_not_called()
+
+    def test_progress_stops_running_file(self):
+        token = cancellation.CancelToken("key")
+        with cancellation.use(token):
+            output = gallerydl.ProgressOutput("key")
+        output.progress(100, 10, 10)
+        token.cancel()
+
+        with pytest.raises(cancellation.Cancelled):
+            output.progress(100, 20, 10)
+
+    def test_cancelled_job_deletes_its_files(self, tmp_path):
+        def run():
+            directory = config_set.call_args.args[2]
+            partial = tmp_path.joinpath(*directory) / "file.mp4.part"
+            partial.parent.mkdir(parents=True)
+            partial.write_text("da")
+            raise cancellation.Cancelled("request")
+
+        job = MagicMock()
+        job.run.side_effect = run
+        with (
+            patch.object(gdl.config, "set") as config_set,
+            patch("hylde.downloaders.gallerydl.output_dir", tmp_path),
+            patch("hylde.downloaders.gallerydl.GoodJob", return_value=job),
+            pytest.raises(cancellation.Cancelled),
+        ):
+            gallerydl._download(MEDIA_URL, "key", [])
+
+        assert list((tmp_path / "key").iterdir()) == []
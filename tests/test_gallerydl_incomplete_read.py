@@ -6,6 +6,8 @@ from unittest.mock import MagicMock, patch
 import pytest
 
 import gallery_dl as gdl
+from gallery_dl.extractor.message import Message
+from hylde.downloaders import gallerydl
 from hylde.downloaders.gallerydl import (
     _IncompleteReadAdapter,
     download_url,
@@ -20,6 +22,7 @@ class TestIncompleteReadAdapter:
         """Return a mock job object with a has_incomplete_read flag."""
         j = MagicMock()
         j.has_incomplete_read = False
+        j.was_throttled = False
         j._logger_extra = {}
         return j
 
@@ -56,6 +59,17 @@ class TestIncompleteReadAdapter:
         adapter.warning("Error: %s", "IncompleteRead(100 bytes)")
         assert job.has_incomplete_read is True
 
+    def test_detects_throttling(self, adapter, job):
+        adapter.error(
+            "%s: %s", "HttpError", "'429 Too Many Requests' for 'https://x.com/a'"
+        )
+        assert job.was_throttled is True
+        assert job.has_incomplete_read is False
+
+    def test_ignores_numbers_in_urls(self, adapter, job):
+        adapter.warning("Skipping https://x.com/429/503.jpg")
+        assert job.was_throttled is False
+
 
 class TestDownloadUrl:
     """Tests for download_url IncompleteRead handling."""
@@ -65,6 +79,7 @@ class TestDownloadUrl:
         """Return a fake GoodJob-like object."""
         job = MagicMock()
         job.has_incomplete_read = False
+        job.was_throttled = False
         return job
 
     @pytest.fixture
@@ -85,6 +100,16 @@ class TestDownloadUrl:
         with patch.object(gdl.config, "set"):
             yield
 
+    @pytest.fixture(autouse=True)
+    def patch_resolver(self):
+        """Skip the real extractor and start with empty extractor caches."""
+        resolver = MagicMock()
+        resolver.messages = [(Message.Url, "https://cdn.example.com/file.mp4", {})]
+        gallerydl._resolved.clear()
+        gallerydl._media_owners.clear()
+        with patch("hylde.downloaders.gallerydl.ResolveJob", return_value=resolver):
+            yield resolver
+
     def test_returns_empty_list_on_incomplete_read(self, fake_job, fake_collector):
         fake_job.has_incomplete_read = True
 
@@ -111,6 +136,25 @@ class TestDownloadUrl:
 
         assert not temp_file.exists()
 
+    def test_throttling_is_retryable_and_slows_down_host(
+        self, fake_job, fake_collector
+    ):
+        fake_job.was_throttled = True
+
+        with (
+            patch("hylde.downloaders.gallerydl.GoodJob", return_value=fake_job),
+            patch(
+                "hylde.downloaders.gallerydl.FileCollector",
+                return_value=fake_collector,
+            ),
+            patch("hylde.downloaders.gallerydl.ratelimit.throttled") as throttled,
+        ):
+            result = download_url("https://example.com/file", "key")
+
+        assert result == []
+        throttled.assert_called_once_with("https://example.com/file")
+        assert not fake_collector.files[0].exists()
+
     def test_returns_none_on_regular_errors(self, fake_job, fake_collector):
         fake_job.has_incomplete_read = False
         fake_collector.errors = [Path("/tmp/error.txt")]
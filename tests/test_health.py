@@ -0,0 +1,149 @@
+"""Tests for hylde.health module."""
+
+import threading
+import time
+from unittest.mock import MagicMock, patch
+
+import pytest
+from dynaconf import DataDict
+
+from hylde import cancellation, health
+
+
+@pytest.fixture(autouse=True)
+def health_settings():
+    fake_settings = MagicMock()
+    fake_settings.health = DataDict(
+        enabled=True, failures=2, cooldown=0.05, maxcooldown=0.2
+    )
+    health.reset()
+    with patch("hylde.health.settings", fake_settings):
+        yield fake_settings.health
+    health.reset()
+
+
+def _breaker(probe=None):
+    return health.Breaker("jdownloader", 2, 0.05, 0.2, probe)
+
+
+class TestBreaker:
+    def test_opens_after_consecutive_errors(self):
+        breaker = _breaker()
+
+        breaker.failed(RuntimeError("relay down"))
+        breaker.succeeded()
+        breaker.failed(RuntimeError("relay down"))
+        assert breaker.allow()
+        breaker.failed(RuntimeError("relay down"))
+
+        assert breaker.state == health.OPEN
+        assert not breaker.allow()
+        assert breaker.retry_after() == 1
+        assert breaker.as_dict()["last_error"] == "relay down"
+
+    def test_half_open_lets_one_download_through(self):
+        breaker = _breaker()
+        breaker.failed("a")
+        breaker.failed("b")
+        time.sleep(0.06)
+
+        assert breaker.retry_after() == 0
+        assert breaker.allow()
+        assert breaker.state == health.HALF_OPEN
+        assert not breaker.allow()
+
+        breaker.succeeded()
+        assert breaker.state == health.CLOSED
+        assert breaker.allow()
+
+    def test_failed_probe_doubles_cooldown(self):
+        breaker = _breaker()
+        breaker.failed("a")
+        breaker.failed("b")
+        time.sleep(0.06)
+        breaker.allow()
+
+        breaker.failed("c")
+
+        assert breaker.state == health.OPEN
+        assert breaker.cooldown == 0.1
+
+    def test_abandoned_probe_frees_half_open_slot(self):
+        breaker = _breaker()
+        breaker.failed("a")
+        breaker.failed("b")
+        time.sleep(0.06)
+        breaker.allow()
+
+        breaker.abandoned()
+
+        assert breaker.allow()
+
+    def test_probe_hook_closes_breaker_in_background(self):
+        probed = threading.Event()
+        attempts = []
+
+        def probe():
+            attempts.append(time.monotonic())
+            if len(attempts) < 2:
+                raise RuntimeError("still down")
+            probed.set()
+
+        breaker = _breaker(probe)
+        breaker.failed("a")
+        breaker.failed("b")
+
+        assert not breaker.allow()
+        assert probed.wait(1)
+        for _ in range(100):
+            if breaker.state == health.CLOSED:
+                break
+            time.sleep(0.01)
+        assert breaker.state == health.CLOSED
+        # the second probe waited for the doubled cooldown
+        assert attempts[1] - attempts[0] >= 0.09
+
+
+class TestModule:
+    def _downloader(self, name="jdownloader"):
+        return MagicMock(__name__=f"hylde.downloaders.{name}", spec=["download_url"])
+
+    def test_check_raises_while_open(self):
+        downloader = self._downloader()
+        health.record(downloader, RuntimeError("a"))
+        health.record(downloader, RuntimeError("b"))
+
+        with pytest.raises(health.BackendUnavailable) as e:
+            health.check(downloader)
+
+        assert e.value.backend == "jdownloader"
+        assert e.value.retry_after >= 1
+        assert health.get_status()["jdownloader"]["state"] == health.OPEN
+
+    def test_cancelled_downloads_do_not_count(self):
+        downloader = self._downloader()
+
+        health.record(downloader, cancellation.Cancelled("request"))
+        health.record(downloader, cancellation.Cancelled("request"))
+
+        health.check(downloader)
+        assert health.get_breaker(downloader).failures == 0
+
+    def test_retry_after_only_when_all_are_down(self):
+        down, up = self._downloader("jdownloader"), self._downloader("gallerydl")
+        health.record(down, RuntimeError("a"))
+        health.record(down, RuntimeError("b"))
+
+        assert health.is_degraded()
+        assert health.get_retry_after([down, up]) is None
+        assert health.get_retry_after([down]) >= 1
+
+    def test_disabled_skips_breakers(self, health_settings):
+        health_settings.enabled = False
+        downloader = self._downloader()
+
+        for _ in range(3):
+            health.record(downloader, RuntimeError("a"))
+        health.check(downloader)
+
+        assert health.get_status() == {}
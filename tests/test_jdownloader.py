@@ -0,0 +1,165 @@
+"""Tests for the JDownloader downloader over the local API."""
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import ClassVar
+from unittest.mock import MagicMock, patch
+from urllib.parse import unquote, urlsplit
+
+import pytest
+from dynaconf import DataDict
+
+from hylde.downloaders import jdownloader
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """Stand-in for the "Deprecated API" of a JDownloader that finishes downloads at once."""
+
+    protocol_version = "HTTP/1.1"
+    packages: ClassVar[dict] = {}
+    calls: ClassVar[list] = []
+    authorizations: ClassVar[list] = []
+
+    def _reply(self, status: int, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        params = [json.loads(unquote(p)) for p in parts.query.split("&") if p]
+        type(self).calls.append((parts.path, params))
+        type(self).authorizations.append(self.headers.get("Authorization"))
+
+        if parts.path == "/linkgrabberv2/addLinks":
+            query = params[0]
+            uuid = len(self.packages) + 1
+            self.packages[uuid] = {
+                "uuid": uuid,
+                "name": query["packageName"],
+                "saveTo": f"/output/{query['packageName']}",
+                "status": "Finished",
+                "finished": True,
+                "bytesLoaded": 4,
+                "bytesTotal": 4,
+                "links": [query["links"]],
+            }
+            self._reply(200, {"data": {"id": uuid}})
+        elif parts.path == "/downloadsV2/queryPackages":
+            packages = [
+                {k: v for k, v in p.items() if k != "links"}
+                for p in self.packages.values()
+            ]
+            self._reply(200, {"data": packages[: params[0]["maxResults"]]})
+        elif parts.path == "/downloadsV2/queryLinks":
+            uuids = params[0]["packageUUIDs"]
+            links = [
+                {"uuid": 100 + uuid, "name": "a.jpg", "packageUUID": uuid}
+                for uuid in uuids
+                if uuid in self.packages
+            ]
+            self._reply(200, {"data": links})
+        elif parts.path == "/downloadsV2/cleanup":
+            for uuid in params[1]:
+                self.packages.pop(uuid, None)
+            self._reply(200, {"data": True})
+        else:
+            self._reply(404, {"type": "API_COMMAND_NOT_FOUND"})
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def device():
+    handler = type(
+        "Handler", (_Handler,), {"packages": {}, "calls": [], "authorizations": []}
+    )
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(
+        target=httpd.serve_forever, kwargs={"poll_interval": 0.01}, daemon=True
+    )
+    thread.start()
+    yield handler, f"http://127.0.0.1:{httpd.server_port}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture(autouse=True)
+def jdownloader_settings(tmp_path, device):
+    _, base_url = device
+    values = {"transport": "local", "localurl": base_url + "/", "localtimeout": 1}
+    fake_settings = MagicMock()
+    fake_settings.downloader.jdownloader = DataDict(
+        outputdir="/output", externaloutputdir=str(tmp_path)
+    )
+    with (
+        patch.object(
+            jdownloader,
+            "_setting",
+            side_effect=lambda name, default: values.get(name, default),
+        ),
+        patch.object(jdownloader, "settings", fake_settings),
+    ):
+        yield values
+
+
+class TestLocalTransport:
+    def test_download_over_local_api(self, device, tmp_path):
+        handler, _ = device
+        (tmp_path / "key").mkdir()
+        (tmp_path / "key" / "a.jpg").write_bytes(b"jpeg")
+
+        files = jdownloader.download_url("https://example.com/a?b=1&c=2", "key")
+
+        assert files == [tmp_path / "key" / "a.jpg"]
+        # the link stays a single parameter
+        add = next(params for path, params in handler.calls if "addLinks" in path)
+        assert add[0]["links"] == "https://example.com/a?b=1&c=2"
+        assert add[0]["packageName"] == "key"
+        # the package was removed again
+        assert handler.packages == {}
+
+    def test_skips_cloud_credentials(self):
+        with patch.object(jdownloader, "MyJDConnector") as connector:
+            device = jdownloader.connect()
+
+        connector.assert_not_called()
+        assert isinstance(device.connection_helper, jdownloader._LocalConnectionHelper)
+
+    def test_probe_queries_device(self, device):
+        handler, _ = device
+
+        jdownloader.probe()
+
+        [(path, params)] = handler.calls
+        assert path == "/downloadsV2/queryPackages"
+        assert params[0]["maxResults"] == 1
+
+    def test_sends_connector_headers(self, device):
+        handler, _ = device
+        connector = jdownloader.DirectConnector
+        headers = {"Authorization": "Basic aGk6aGk="}
+
+        with patch.object(
+            jdownloader, "DirectConnector", lambda url: connector(url, headers)
+        ):
+            jdownloader.probe()
+
+        assert handler.authorizations == ["Basic aGk6aGk="]
+
+    def test_api_errors_raise(self):
+        jdownloader.connect()
+
+        with pytest.raises(jdownloader.requests.HTTPError):
+            jdownloader.JDD.connection_helper.action("/nothing/here")
+
+    def test_unreachable_device_raises(self, jdownloader_settings):
+        jdownloader_settings["localurl"] = "http://127.0.0.1:9"
+
+        with pytest.raises(jdownloader.requests.ConnectionError):
+            jdownloader.probe()
@@ -0,0 +1,105 @@
+"""Tests for the job journal."""
+
+import json
+import time
+from unittest.mock import patch
+
+from hylde.journal import Journal
+
+
+class TestJournal:
+    def test_pending_keeps_last_state_until_done(self, tmp_path):
+        journal = Journal(tmp_path / "journal.jsonl")
+        journal.queued("https://a", "a")
+        journal.queued("https://b", "b")
+        journal.running("https://a", "a")
+        journal.done("b")
+
+        jobs = journal.pending()
+
+        assert list(jobs) == ["a"]
+        assert jobs["a"]["state"] == "running"
+        assert jobs["a"]["url"] == "https://a"
+
+    def test_survives_a_new_instance(self, tmp_path):
+        journal = Journal(tmp_path / "journal.jsonl")
+        journal.queued("https://a", "a")
+        journal.flush()
+
+        assert list(Journal(tmp_path / "journal.jsonl").pending()) == ["a"]
+
+    def test_skips_torn_lines(self, tmp_path):
+        path = tmp_path / "journal.jsonl"
+        journal = Journal(path)
+        journal.queued("https://a", "a")
+        journal.flush()
+        with open(path, "a") as f:
+            f.write('{"url_key": "b", "sta')
+
+        assert list(journal.pending()) == ["a"]
+
+    def test_compact_rewrites_given_jobs(self, tmp_path):
+        path = tmp_path / "journal.jsonl"
+        journal = Journal(path)
+        journal.queued("https://a", "a")
+        journal.queued("https://b", "b")
+        journal.done("a")
+
+        journal.compact()
+        journal.running("https://b", "b")
+        journal.flush()
+
+        lines = [json.loads(line) for line in path.read_text().splitlines()]
+        assert [(r["url_key"], r["state"]) for r in lines] == [
+            ("b", "queued"),
+            ("b", "running"),
+        ]
+
+    def test_disabled_without_path(self, tmp_path):
+        journal = Journal("")
+        journal.queued("https://a", "a")
+
+        assert journal.pending() == {}
+
+    def test_write_errors_disable_journal(self, tmp_path):
+        (tmp_path / "file").write_text("")
+        journal = Journal(tmp_path / "file" / "journal.jsonl")
+
+        journal.queued("https://a", "a")
+        journal.flush()
+        journal.queued("https://b", "b")
+
+        assert journal._broken
+
+    def test_records_are_written_in_batches(self, tmp_path):
+        path = tmp_path / "journal.jsonl"
+        journal = Journal(path)
+
+        with patch("hylde.journal.os.fsync") as fsync:
+            with journal._condition:
+                # the writer waits for the lock while records pile up
+                for i in range(10):
+                    journal.queued(f"https://{i}", str(i))
+            journal.flush()
+
+        fsync.assert_called_once()
+        assert len(path.read_text().splitlines()) == 10
+
+    def test_compacts_after_done_records(self, tmp_path):
+        path = tmp_path / "journal.jsonl"
+        journal = Journal(path, compactevery=2)
+        journal.queued("https://a", "a")
+        journal.queued("https://b", "b")
+        journal.done("a")
+        journal.flush()
+        journal.queued("https://c", "c")
+        journal.done("c")
+        journal.flush()
+
+        for _ in range(100):
+            if len(path.read_text().splitlines()) == 1:
+                break
+            time.sleep(0.01)
+        assert [
+            json.loads(line)["url_key"] for line in path.read_text().splitlines()
+        ] == ["b"]
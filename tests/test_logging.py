@@ -0,0 +1,45 @@
+"""Tests for the log sink filter in hylde/__init__.py."""
+
+from unittest.mock import MagicMock, patch
+
+import hylde
+
+
+def _record(level: str, **extra) -> dict:
+    return {"level": hylde.lolg.level(level), "extra": extra}
+
+
+class TestSampleDebug:
+    def test_keeps_info_and_above_for_unsampled_keys(self):
+        with patch.object(hylde, "settings", MagicMock(debugsamplerate=0.0)):
+            assert hylde._sample_debug(_record("INFO", url_key="abc"))
+            assert hylde._sample_debug(_record("ERROR", url_key="abc"))
+
+    def test_drops_debug_for_unsampled_keys(self):
+        with patch.object(hylde, "settings", MagicMock(debugsamplerate=0.0)):
+            assert not hylde._sample_debug(_record("DEBUG", url_key="abc"))
+            assert not hylde._sample_debug(_record("TRACE", url_key="abc"))
+
+    def test_keeps_debug_without_url_key(self):
+        with patch.object(hylde, "settings", MagicMock(debugsamplerate=0.0)):
+            assert hylde._sample_debug(_record("DEBUG"))
+
+    def test_keeps_debug_for_sampled_keys(self):
+        with patch.object(hylde, "settings", MagicMock(debugsamplerate=1.0)):
+            assert hylde._sample_debug(_record("DEBUG", url_key="abc"))
+
+
+class TestContextualize:
+    def test_file_request_records_carry_url_key(self):
+        from hylde import server
+
+        records = []
+        sink = hylde.lolg.add(lambda m: records.append(m.record), level="DEBUG")
+        try:
+            with patch.object(server, "get_status", return_value=({}, 404, {})):
+                server.app.test_client().head("/file?url=https://example.com/a")
+        finally:
+            hylde.lolg.remove(sink)
+
+        url_key = server.get_url_key("https://example.com/a")
+        assert any(r["extra"].get("url_key") == url_key for r in records)
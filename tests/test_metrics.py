@@ -0,0 +1,76 @@
+"""Tests for hylde.metrics module."""
+
+import pytest
+
+from hylde import metrics
+
+
+@pytest.fixture(autouse=True)
+def isolated_registry():
+    """Keep test metrics out of the global registry."""
+    registered = list(metrics._metrics)
+    yield
+    metrics._metrics[:] = registered
+
+
+class TestCounter:
+    """Tests for Counter."""
+
+    def test_renders_labelled_values(self):
+        c = metrics.Counter("test_total", "Test counter.", ("result",))
+        c.labels(result="hit").inc()
+        c.labels(result="hit").inc(2)
+        c.labels(result="miss").inc()
+
+        lines = c.render()
+        assert lines[0] == "# HELP test_total Test counter."
+        assert lines[1] == "# TYPE test_total counter"
+        assert 'test_total{result="hit"} 3' in lines
+        assert 'test_total{result="miss"} 1' in lines
+
+    def test_escapes_label_values(self):
+        c = metrics.Counter("test_total", "Test counter.", ("path",))
+        c.labels(path='a"b\\c').inc()
+        assert 'test_total{path="a\\"b\\\\c"} 1' in c.render()
+
+
+class TestHistogram:
+    """Tests for Histogram."""
+
+    def test_cumulative_buckets(self):
+        h = metrics.Histogram("test_seconds", "Test histogram.", buckets=(1, 5))
+        h.observe(0.5)
+        h.observe(1)
+        h.observe(3)
+        h.observe(10)
+
+        lines = h.render()
+        assert 'test_seconds_bucket{le="1"} 2' in lines
+        assert 'test_seconds_bucket{le="5"} 3' in lines
+        assert 'test_seconds_bucket{le="+Inf"} 4' in lines
+        assert "test_seconds_sum 14.5" in lines
+        assert "test_seconds_count 4" in lines
+
+    def test_time_observes_duration(self):
+        h = metrics.Histogram("test_seconds", "Test histogram.", ("phase",))
+        with h.labels(phase="a").time():
+            pass
+        assert 'test_seconds_count{phase="a"} 1' in h.render()
+
+
+class TestGauge:
+    """Tests for Gauge."""
+
+    def test_reads_callback(self):
+        values = [1, 2]
+        g = metrics.Gauge("test_items", "Test gauge.", lambda: len(values))
+        values.append(3)
+        assert "test_items 3" in g.render()
+
+
+def test_render_includes_all_metrics():
+    metrics.Counter("test_a_total", "A.").inc()
+    metrics.Gauge("test_b", "B.", lambda: 7)
+    text = metrics.render()
+    assert "test_a_total 1\n" in text
+    assert "test_b 7\n" in text
@@ -0,0 +1,107 @@
+"""Tests for hylde.profiling module."""
+
+import io
+import pstats
+import threading
+
+import pytest
+
+from hylde import profiling
+
+
+def _busy(stop: threading.Event):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+@pytest.fixture
+def busy_thread():
+    stop = threading.Event()
+    thread = threading.Thread(target=_busy, args=(stop,), name="busy")
+    thread.start()
+    yield thread
+    stop.set()
+    thread.join()
+
+
+class TestProfile:
+    def _profile(self):
+        profile = profiling.Profile(interval=0.01)
+        outer = ("a.py", 1, "outer")
+        inner = ("a.py", 10, "inner")
+        profile.samples["main", (outer, inner)] = 3
+        profile.samples["main", (outer,)] = 1
+        return profile
+
+    def test_collapsed_stacks(self):
+        collapsed = self._profile().collapsed()
+
+        assert collapsed.splitlines() == [
+            "outer (a.py:1);inner (a.py:10) 3",
+            "outer (a.py:1) 1",
+        ]
+
+    def test_collapsed_stacks_by_thread(self):
+        assert self._profile().collapsed(by_thread=True).startswith("main;outer")
+
+    def test_pstats_can_be_loaded(self, tmp_path):
+        path = tmp_path / "hylde.pstats"
+        path.write_bytes(self._profile().pstats())
+
+        stats = pstats.Stats(str(path), stream=io.StringIO())
+
+        _, nc, tt, ct, callers = stats.stats[("a.py", 10, "inner")]
+        assert (nc, round(tt, 3), round(ct, 3)) == (3, 0.03, 0.03)
+        assert list(callers) == [("a.py", 1, "outer")]
+        assert round(stats.stats[("a.py", 1, "outer")][3], 3) == 0.04
+        assert round(stats.total_tt, 3) == 0.04
+
+    def test_records_other_threads(self, busy_thread):
+        profile = profiling.record_profile(0.05, 0.005, {busy_thread.ident: "key"})
+
+        assert profile.n_samples > 1
+        assert "_busy" in profile.collapsed()
+        assert "busy [key];" in profile.collapsed(by_thread=True)
+        assert "record_profile" not in profile.collapsed()
+
+    def test_one_profile_at_a_time(self):
+        with profiling._profile_lock, pytest.raises(profiling.ProfilerBusy):
+            profiling.record_profile(0.01, 0.005)
+
+
+class TestDumpThreads:
+    def test_labels_threads_with_url_keys(self, busy_thread):
+        dump = profiling.dump_threads({busy_thread.ident: "key"})
+
+        assert f'Thread "busy" (id {busy_thread.ident}) url_key=key' in dump
+        assert "in _busy" in dump
+        assert 'Thread "MainThread"' in dump
+
+
+class TestTracemalloc:
+    @pytest.fixture(autouse=True)
+    def stop_tracing(self):
+        yield
+        profiling.stop_tracing()
+
+    def test_snapshot_and_diff(self):
+        first, previous = profiling.take_snapshot(5)
+        assert previous is None
+
+        blocks = [bytearray(1024) for _ in range(100)]
+        second, previous = profiling.take_snapshot(5)
+
+        assert previous is first
+        diff = profiling.format_snapshot(second, previous)
+        assert "test_profiling.py" in diff.splitlines()[1]
+        assert blocks
+
+    def test_collapsed_snapshot(self):
+        profiling.take_snapshot(5)
+        blocks = [bytearray(1024) for _ in range(100)]  # noqa: F841
+        snapshot, _ = profiling.take_snapshot(5)
+
+        lines = profiling.collapse_snapshot(snapshot).splitlines()
+
+        assert any("test_profiling.py" in line for line in lines)
+        assert all(int(line.rsplit(" ", 1)[1]) > 0 for line in lines)
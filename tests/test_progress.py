@@ -0,0 +1,78 @@
+"""Tests for hylde.progress module."""
+
+import pytest
+
+from hylde import progress
+
+
+class TestProgress:
+    """Tests for the progress registry."""
+
+    @pytest.fixture(autouse=True)
+    def cleanup(self):
+        yield
+        progress.finish("key")
+
+    def test_update_ignores_unknown_keys(self):
+        progress.update("key", 10, 100)
+        assert progress.get("key") is None
+
+    def test_start_and_update(self):
+        progress.start("key")
+        progress.update("key", 10, 100)
+
+        p = progress.get("key")
+        assert p.bytes_done == 10
+        assert p.bytes_total == 100
+
+    def test_update_keeps_known_total(self):
+        progress.start("key")
+        progress.update("key", 10, 100)
+        progress.update("key", 20)
+
+        assert progress.get("key").bytes_total == 100
+
+    def test_eta_from_average_rate(self):
+        p = progress.start("key")
+        p.started -= 10
+        progress.update("key", 100, 300)
+
+        assert p.rate() == pytest.approx(10, rel=0.01)
+        assert p.eta() == pytest.approx(20, rel=0.01)
+
+    def test_eta_unknown_without_total(self):
+        p = progress.start("key")
+        p.started -= 10
+        progress.update("key", 100)
+
+        assert p.eta() is None
+
+    def test_finish_removes_entry(self):
+        progress.start("key")
+        progress.finish("key")
+        assert progress.get("key") is None
+
+
+class TestGalleryDlProgressOutput:
+    """Tests for forwarding gallery-dl progress."""
+
+    @pytest.fixture(autouse=True)
+    def cleanup(self):
+        progress.start("key")
+        yield
+        progress.finish("key")
+
+    def test_accumulates_finished_files(self, tmp_path):
+        from hylde.downloaders.gallerydl import ProgressOutput
+
+        f = tmp_path / "a.jpg"
+        f.write_bytes(b"x" * 50)
+        out = ProgressOutput("key")
+
+        out.progress(50, 25, 10)
+        assert progress.get("key").bytes_done == 25
+        out.success(str(f))
+        out.progress(100, 10, 10)
+
+        assert progress.get("key").bytes_done == 60
+        assert progress.get("key").bytes_total == 150
@@ -0,0 +1,67 @@
+"""Tests for hylde.ramcache module."""
+
+from pathlib import Path
+from unittest.mock import patch
+
+from hylde.ramcache import RamCache
+
+
+def _file(tmp_path, name, size):
+    path = tmp_path / name
+    path.write_bytes(b"x" * size)
+    return path
+
+
+class TestRamCache:
+    def test_put_and_get(self, tmp_path):
+        cache = RamCache(budget=100, max_file_size=10)
+        entry = cache.put("k", "k/a.png", _file(tmp_path, "a.png", 4))
+
+        assert cache.get("k") is entry
+        assert entry.data == b"xxxx"
+        assert entry.headers["Content-Type"] == "image/png"
+        assert entry.headers["Content-Length"] == "4"
+        assert "Last-Modified" in entry.headers
+        assert cache.nbytes == 4
+
+    def test_skips_files_over_threshold(self, tmp_path):
+        cache = RamCache(budget=100, max_file_size=10)
+        assert cache.put("k", "k/a.bin", _file(tmp_path, "a.bin", 11)) is None
+        assert cache.get("k") is None
+
+    def test_zero_budget_keeps_nothing(self, tmp_path):
+        cache = RamCache(budget=0, max_file_size=10)
+        assert cache.put("k", "k/a.bin", _file(tmp_path, "a.bin", 1)) is None
+        # not even empty files, without looking at them
+        empty = _file(tmp_path, "c.bin", 0)
+        with patch.object(Path, "stat") as stat:
+            assert cache.put("k", "k/c.bin", empty) is None
+        stat.assert_not_called()
+        assert len(cache) == 0
+
+    def test_missing_file_is_ignored(self, tmp_path):
+        cache = RamCache(budget=100, max_file_size=10)
+        assert cache.put("k", "k/a.bin", tmp_path / "missing") is None
+
+    def test_evicts_least_recently_used_over_budget(self, tmp_path):
+        cache = RamCache(budget=10, max_file_size=10)
+        cache.put("a", "a/f", _file(tmp_path, "a", 4))
+        cache.put("b", "b/f", _file(tmp_path, "b", 4))
+        cache.get("a")
+        cache.put("c", "c/f", _file(tmp_path, "c", 4))
+
+        assert cache.get("b") is None
+        assert cache.get("a") is not None
+        assert cache.get("c") is not None
+        assert cache.nbytes == 8
+
+    def test_replacing_and_popping_keep_byte_count(self, tmp_path):
+        cache = RamCache(budget=100, max_file_size=10)
+        cache.put("a", "a/f", _file(tmp_path, "a", 4))
+        cache.put("a", "a/g", _file(tmp_path, "g", 6))
+        assert cache.nbytes == 6
+
+        cache.pop("a")
+        cache.pop("a")
+        assert cache.nbytes == 0
+        assert len(cache) == 0
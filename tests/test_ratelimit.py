@@ -0,0 +1,121 @@
+"""Tests for hylde.ratelimit module."""
+
+import threading
+import time
+from unittest.mock import MagicMock, patch
+
+import pytest
+from dynaconf import DataDict
+
+from hylde import ratelimit
+
+
+@pytest.fixture(autouse=True)
+def ratelimit_settings():
+    fake_settings = MagicMock()
+    fake_settings.ratelimit = DataDict(
+        enabled=True,
+        rate=0,
+        burst=1,
+        concurrency=0,
+        minrate=1,
+        decrease=0.5,
+        increase=0.25,
+        hosts=[["mirror", 5, 1, 1]],
+    )
+    ratelimit.reset()
+    with patch("hylde.ratelimit.settings", fake_settings):
+        yield fake_settings.ratelimit
+    ratelimit.reset()
+
+
+class TestHostLimit:
+    def test_token_bucket_spaces_out_starts(self):
+        limit = ratelimit.HostLimit("host", rate=20, burst=1, concurrency=0)
+
+        assert limit.acquire() < 0.01
+        assert limit.acquire() >= 0.04
+
+    def test_concurrency_cap_waits_for_release(self):
+        limit = ratelimit.HostLimit("host", rate=0, burst=1, concurrency=1)
+        limit.acquire()
+        acquired = threading.Event()
+        thread = threading.Thread(
+            target=lambda: (limit.acquire(), acquired.set()), daemon=True
+        )
+        thread.start()
+
+        assert not acquired.wait(0.05)
+        limit.release()
+        assert acquired.wait(1)
+
+    def test_throttle_halves_rate_and_success_recovers_it(self):
+        limit = ratelimit.HostLimit("host", rate=8, burst=1, concurrency=0)
+
+        limit.throttled()
+        limit.throttled()
+        assert limit.rate == 2
+        limit.succeeded()
+        assert limit.rate == 4
+        for _ in range(10):
+            limit.succeeded()
+        assert limit.rate == 8
+
+    def test_throttle_respects_min_rate(self):
+        limit = ratelimit.HostLimit("host", rate=1.5, burst=1, concurrency=0)
+
+        limit.throttled()
+        limit.throttled()
+
+        assert limit.rate == 1
+
+    def test_throttle_delay_pauses_host(self):
+        limit = ratelimit.HostLimit("host", rate=0, burst=1, concurrency=0)
+
+        before = time.monotonic()
+        limit.throttled(delay=0.05)
+        limit.acquire()
+
+        # measured from before the throttle, the pause cannot end early
+        assert time.monotonic() - before >= 0.05
+
+
+class TestGetLimit:
+    def test_hosts_have_own_limits(self):
+        a = ratelimit.get_limit("https://a.com/1")
+
+        assert ratelimit.get_limit("https://a.com/2") is a
+        assert ratelimit.get_limit("https://b.com/1") is not a
+
+    def test_pattern_hosts_share_configured_limit(self):
+        limit = ratelimit.get_limit("https://mirror.la/a")
+
+        assert ratelimit.get_limit("https://cdn.mirror.si/b") is limit
+        assert (limit.rate, limit.concurrency) == (5, 1)
+
+
+class TestAcquire:
+    def test_holds_slot_while_downloading(self):
+        limit = ratelimit.get_limit("https://a.com/")
+
+        with ratelimit.acquire("https://a.com/x", "key"):
+            assert limit.active == 1
+        assert limit.active == 0
+
+    def test_releases_slot_on_error(self):
+        limit = ratelimit.get_limit("https://a.com/")
+
+        with pytest.raises(RuntimeError), ratelimit.acquire("https://a.com/x", "key"):
+            raise RuntimeError()
+        assert limit.active == 0
+
+    def test_disabled_skips_limits(self, ratelimit_settings):
+        ratelimit_settings.enabled = False
+        start = time.monotonic()
+
+        with ratelimit.acquire("https://a.com/x", "key"):
+            pass
+        ratelimit.throttled("https://a.com/x", 10)
+
+        assert ratelimit._limits == {}
+        assert time.monotonic() - start < 0.1
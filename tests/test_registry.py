@@ -95,3 +95,195 @@ class TestGetDownloaderForUrl:
                 registry.get_downloader_for_url("https://other.com")
 
         mock_mod.assert_not_called()
+
+
+class TestRegisterDownloader:
+    """Tests for register_downloader."""
+
+    def test_appends_by_default(self):
+        mock_mod = MagicMock()
+        mock_mod.__name__ = "mod"
+        patterns = [(r"example\.com", MagicMock())]
+
+        with patch.object(registry, "DOWNLOADER_PATTERNS", patterns):
+            registry.register_downloader(r"other\.com", mock_mod)
+            result = registry.get_downloader_for_url("https://other.com")
+
+        assert patterns[-1] == (r"other\.com", mock_mod)
+        assert result is mock_mod
+
+    def test_inserts_at_index(self):
+        mock_mod = MagicMock()
+        mock_mod.__name__ = "mod"
+        fallback = MagicMock()
+        fallback.__name__ = "fallback"
+        patterns = [(".", fallback)]
+
+        with patch.object(registry, "DOWNLOADER_PATTERNS", patterns):
+            registry.register_downloader(r"example\.com", mock_mod, index=0)
+            result = registry.get_downloader_for_url("https://example.com")
+
+        assert result is mock_mod
+
+
+class TestLazyLoading:
+    """Tests for downloaders referenced by name."""
+
+    @pytest.fixture(autouse=True)
+    def clear_loaded(self):
+        with patch.dict(registry._loaded, clear=True):
+            yield
+
+    def test_imports_builtin_on_first_match(self):
+        mock_mod = MagicMock()
+        mock_mod.__name__ = "hylde.downloaders.mod"
+
+        with (
+            patch.object(registry, "DOWNLOADER_PATTERNS", [(r"example\.com", "mod")]),
+            patch.object(registry, "entry_points", return_value=[]),
+            patch.object(
+                registry.importlib, "import_module", return_value=mock_mod
+            ) as import_module,
+        ):
+            with pytest.raises(ValueError):
+                registry.get_downloader_for_url("https://other.com")
+            import_module.assert_not_called()
+            result = registry.get_downloader_for_url("https://example.com")
+            registry.get_downloader_for_url("https://example.com")
+
+        assert result is mock_mod
+        import_module.assert_called_once_with("hylde.downloaders.mod")
+
+    def test_dotted_name_is_imported_as_is(self):
+        with (
+            patch.object(registry, "entry_points", return_value=[]),
+            patch.object(registry.importlib, "import_module") as import_module,
+        ):
+            registry.load_downloader("plugin.downloader")
+
+        import_module.assert_called_once_with("plugin.downloader")
+
+    def test_entry_point_takes_precedence(self):
+        mock_mod = MagicMock()
+        entry_point = MagicMock()
+        entry_point.load.return_value = mock_mod
+
+        with (
+            patch.object(registry, "entry_points", return_value=[entry_point]) as eps,
+            patch.object(registry.importlib, "import_module") as import_module,
+        ):
+            result = registry.load_downloader("plugin")
+
+        assert result is mock_mod
+        eps.assert_called_once_with(group="hylde.downloaders", name="plugin")
+        import_module.assert_not_called()
+
+    def test_unmatched_downloaders_are_not_imported(self):
+        with (
+            patch.object(
+                registry,
+                "DOWNLOADER_PATTERNS",
+                [
+                    (r"example\.com", MagicMock(__name__="mod")),
+                    (r"other\.com", "heavy"),
+                ],
+            ),
+            patch.object(
+                registry, "load_downloader", wraps=registry.load_downloader
+            ) as load,
+            patch.object(registry.importlib, "import_module") as import_module,
+        ):
+            registry.get_downloader_for_url("https://example.com")
+
+        load.assert_called_once()
+        import_module.assert_not_called()
+
+    def test_warm_up_loads_all_and_survives_errors(self):
+        good = MagicMock()
+
+        def import_module(name):
+            if name == "hylde.downloaders.broken":
+                raise ValueError("credentials not set")
+            return good
+
+        with (
+            patch.object(
+                registry, "DOWNLOADER_PATTERNS", [("a", "broken"), ("b", "good")]
+            ),
+            patch.object(registry, "entry_points", return_value=[]),
+            patch.object(
+                registry.importlib, "import_module", side_effect=import_module
+            ),
+        ):
+            registry.warm_up()
+
+        assert registry._loaded == {"good": good}
+
+
+class TestFallbackChains:
+    """Tests for downloader chains ordered by their results per host."""
+
+    @pytest.fixture(autouse=True)
+    def chain(self):
+        first = MagicMock(__name__="first")
+        second = MagicMock(__name__="second")
+        with (
+            patch.object(
+                registry, "DOWNLOADER_PATTERNS", [("example", [first, second])]
+            ),
+            patch.object(registry, "_stats", {}),
+        ):
+            yield first, second
+
+    def test_returns_chain_in_configured_order(self, chain):
+        assert registry.get_downloaders_for_url("https://example.com") == list(chain)
+        assert registry.get_downloader_for_url("https://example.com") is chain[0]
+
+    def test_failing_downloader_moves_back(self, chain):
+        first, second = chain
+        for _ in range(5):
+            registry.record_result("https://example.com/a", first, False, 1)
+
+        assert registry.get_downloaders_for_url("https://example.com") == [
+            second,
+            first,
+        ]
+        assert registry.get_downloaders_for_url("https://example.org") == [
+            first,
+            second,
+        ]
+
+    def test_few_results_keep_configured_order(self, chain):
+        first, second = chain
+        registry.record_result("https://example.com/a", first, False, 1)
+
+        assert registry.get_downloaders_for_url("https://example.com") == [
+            first,
+            second,
+        ]
+
+    def test_faster_downloader_moves_forward(self, chain):
+        first, second = chain
+        for _ in range(5):
+            registry.record_result("https://example.com", first, True, 10)
+            registry.record_result("https://example.com", second, True, 1)
+
+        assert registry.get_downloaders_for_url("https://example.com")[0] is second
+
+    def test_latency_is_averaged(self):
+        stats = registry.BackendStats()
+        stats.record(True, 10)
+        stats.record(True, 20)
+        stats.record(False, 100)
+
+        assert stats.latency == 13
+        assert stats.success_rate() == 0.6
+
+    def test_warm_up_loads_chains(self):
+        with (
+            patch.object(registry, "DOWNLOADER_PATTERNS", [("a", ["x", "y"])]),
+            patch.object(registry, "load_downloader") as load,
+        ):
+            registry.warm_up()
+
+        assert [c.args[0] for c in load.call_args_list] == ["x", "y"]
@@ -0,0 +1,90 @@
+"""Tests for hylde.retry module."""
+
+import threading
+from unittest.mock import MagicMock, patch
+
+import pytest
+from dynaconf import DataDict
+
+from hylde import retry
+
+
+@pytest.fixture(autouse=True)
+def retry_settings():
+    fake_settings = MagicMock()
+    fake_settings.retry = DataDict(
+        enabled=True, delay=1, maxdelay=5, maxattempts=3, hostbudget=2, hostwindow=60
+    )
+    with patch("hylde.retry.settings", fake_settings):
+        yield fake_settings.retry
+
+
+@pytest.fixture
+def clock():
+    now = [1000.0]
+    with patch("hylde.retry.time.monotonic", side_effect=lambda: now[0]):
+        yield now
+
+
+@pytest.fixture
+def scheduler():
+    scheduler = retry.RetryScheduler(MagicMock())
+    scheduler._start = MagicMock()
+    return scheduler
+
+
+class TestRetryScheduler:
+    def test_delay_doubles_up_to_max(self, scheduler):
+        assert [scheduler.get_delay(n) for n in (1, 2, 3, 4)] == [1, 2, 4, 5]
+
+    def test_schedule_backs_off_per_attempt(self, scheduler, clock):
+        assert scheduler.schedule("http://a.com/1", "k") == 1001
+        assert scheduler.schedule("http://a.com/1", "k") == 1002
+        assert scheduler.pending("k") == 2
+        assert len(scheduler) == 1
+
+    def test_gives_up_after_max_attempts(self, scheduler, clock):
+        for _ in range(3):
+            assert scheduler.schedule("http://a.com/1", "k") is not None
+        assert scheduler.schedule("http://a.com/1", "k") is None
+        assert "k" not in scheduler.attempts
+
+    def test_forget_drops_pending_retry(self, scheduler, clock):
+        scheduler.schedule("http://a.com/1", "k")
+        scheduler.forget("k")
+        scheduler.schedule("http://a.com/2", "j")
+        clock[0] += 10
+
+        assert scheduler._next_due() == ("http://a.com/2", "j")
+        assert scheduler.pending("k") is None
+
+    def test_due_retries_come_in_order(self, scheduler, clock):
+        scheduler.schedule("http://a.com/1", "k")
+        scheduler.schedule("http://b.com/1", "j")
+        scheduler.schedule("http://b.com/1", "j")
+        scheduler.attempts["k"] = 2
+        scheduler.schedule("http://a.com/1", "k")  # now due in 4s, after j
+        clock[0] += 10
+
+        assert scheduler._next_due() == ("http://b.com/1", "j")
+        assert scheduler._next_due() == ("http://a.com/1", "k")
+
+    def test_host_budget_defers_retries(self, scheduler, clock):
+        for i in range(3):
+            scheduler.schedule(f"http://a.com/{i}", f"k{i}")
+        scheduler.schedule("http://b.com/0", "j")
+        clock[0] += 1
+
+        due = [scheduler._next_due()[1] for _ in range(3)]
+
+        assert sorted(due) == ["j", "k0", "k1"]
+        assert scheduler._take_host_budget("a.com", clock[0]) == 60
+
+    def test_runs_callback_in_background(self, retry_settings):
+        retry_settings.delay = 0
+        called = threading.Event()
+        scheduler = retry.RetryScheduler(lambda url, url_key: called.set())
+
+        scheduler.schedule("http://a.com/1", "k")
+
+        assert called.wait(2)
@@ -1,10 +1,49 @@
 """Tests for hylde.server module."""
 
+import os
+import threading
+import time
+import zipfile
 from unittest.mock import MagicMock, patch
 
 import pytest
+from dynaconf import DataDict
 
-from hylde import server
+from hylde import (
+    cancellation,
+    diskspace,
+    events,
+    health,
+    journal,
+    progress,
+    ramcache,
+    server,
+)
+
+
+@pytest.fixture(autouse=True)
+def clear_ram_cache():
+    """Keep files served from memory in one test out of the next."""
+    server.ram_cache.clear()
+    yield
+    server.ram_cache.clear()
+
+
+@pytest.fixture(autouse=True)
+def retry_scheduler():
+    """Keep background retries from outliving a test."""
+    with patch("hylde.server.retry_scheduler") as scheduler:
+        scheduler.pending.return_value = None
+        yield scheduler
+
+
+@pytest.fixture(autouse=True)
+def job_journal(tmp_path):
+    """Journal jobs of a test into its temp directory."""
+    with patch.object(
+        server, "job_journal", journal.Journal(tmp_path / "journal.jsonl")
+    ) as job_journal:
+        yield job_journal
 
 
 class TestShimRoute:
@@ -25,6 +64,9 @@ class TestHandleRequest:
         """Use a temp directory and tiny timeout for all server tests."""
         fake_settings = MagicMock()
         fake_settings.maxtimeout = 0.01
+        fake_settings.retryafter = 7
+        fake_settings.maxretryafter = 60
+        fake_settings.servemode = "python"
         with (
             patch("hylde.server._cache_dir", return_value=tmp_path),
             patch("hylde.server._cache_file", return_value=tmp_path / "cache.db"),
@@ -50,6 +92,9 @@ class TestHandleRequest:
         fake_thread.join.assert_called_once()
         assert resp.status_code == 429
         assert b"Come back later" in resp.data
+        assert resp.headers["Retry-After"] == "7"
+
+        server.active_threads.clear()
 
     def test_active_thread_joins_and_returns_429_if_still_alive(self):
         url = "http://example.com/img.jpg"
@@ -138,6 +183,287 @@ class TestHandleRequest:
         assert resp.data == b"image data"
 
 
+class TestRamCache:
+    """Tests for serving small files from memory."""
+
+    @pytest.fixture(autouse=True)
+    def patch_settings(self, tmp_path):
+        with (
+            patch("hylde.server._cache_dir", return_value=tmp_path),
+            patch("hylde.server._cache_file", return_value=tmp_path / "cache.db"),
+            patch.object(server, "ram_cache", ramcache.RamCache(1 << 20, 1024)),
+        ):
+            yield
+
+    def _cache(self, tmp_path, url, data=b"jpeg"):
+        url_key = server.get_url_key(url)
+        (tmp_path / url_key).mkdir()
+        (tmp_path / url_key / "a.jpg").write_bytes(data)
+        server.set_cached_file(url_key, f"{url_key}/a.jpg")
+        return url_key
+
+    def test_first_serve_populates_and_later_hits_skip_the_index(self, tmp_path):
+        url = "http://example.com/a.jpg"
+        url_key = self._cache(tmp_path, url)
+
+        with server.app.test_client() as client:
+            first = client.get(f"/file?url={url}")
+            with patch("hylde.server.get_cached_file") as get_cached_file:
+                second = client.get(f"/file?url={url}")
+
+        get_cached_file.assert_not_called()
+        assert first.data == second.data == b"jpeg"
+        assert second.headers["Content-Type"] == "image/jpeg"
+        assert second.headers["Content-Length"] == "4"
+        assert url_key in server.ram_cache._entries
+
+    def test_large_files_are_served_from_disk(self, tmp_path):
+        url = "http://example.com/a.jpg"
+        url_key = self._cache(tmp_path, url, b"x" * 2048)
+
+        with server.app.test_client() as client:
+            resp = client.get(f"/file?url={url}")
+
+        assert resp.data == b"x" * 2048
+        assert server.ram_cache.get(url_key) is None
+
+    def test_download_populates_on_ingest(self, tmp_path):
+        url = "http://example.com/a.jpg"
+        url_key = self._cache(tmp_path, url)
+        server.ram_cache.clear()
+
+        with patch("hylde.server.hydl.download_file", return_value=f"{url_key}/a.jpg"):
+            server.download_file(url, url_key)
+
+        assert server.ram_cache.get(url_key).data == b"jpeg"
+
+    def test_removing_cache_entry_invalidates(self, tmp_path):
+        url = "http://example.com/a.jpg"
+        url_key = self._cache(tmp_path, url)
+        with server.app.test_client() as client:
+            client.get(f"/file?url={url}")
+
+        server.remove_cached_file(url_key)
+
+        assert server.ram_cache.get(url_key) is None
+
+    def test_proxy_serve_modes_skip_memory(self, tmp_path):
+        url = "http://example.com/a.jpg"
+        url_key = self._cache(tmp_path, url)
+
+        with (
+            patch.object(server.settings, "servemode", "accel"),
+            server.app.test_client() as client,
+        ):
+            resp = client.get(f"/file?url={url}")
+
+        assert "X-Accel-Redirect" in resp.headers
+        assert server.ram_cache.get(url_key) is None
+
+    def test_range_requests_go_to_disk(self, tmp_path):
+        url = "http://example.com/a.jpg"
+        self._cache(tmp_path, url)
+
+        with server.app.test_client() as client:
+            client.get(f"/file?url={url}")
+            resp = client.get(f"/file?url={url}", headers={"Range": "bytes=1-2"})
+
+        assert resp.status_code == 206
+        assert resp.data == b"pe"
+
+
+class TestStatus:
+    """Tests for /status, HEAD /file and Retry-After hints."""
+
+    @pytest.fixture(autouse=True)
+    def patch_settings(self, tmp_path):
+        fake_settings = MagicMock()
+        fake_settings.retryafter = 7
+        fake_settings.maxretryafter = 60
+        with (
+            patch("hylde.server._cache_dir", return_value=tmp_path),
+            patch("hylde.server._cache_file", return_value=tmp_path / "cache.db"),
+            patch("hylde.server.settings", fake_settings),
+        ):
+            yield
+        server.active_threads.clear()
+        server.queued_urls.clear()
+
+    def test_status_requires_url_or_key(self):
+        with server.app.test_client() as client:
+            resp = client.get("/status")
+        assert resp.status_code == 400
+
+    def test_status_unknown_url(self):
+        with server.app.test_client() as client:
+            resp = client.get("/status?url=http://example.com/a.jpg")
+        assert resp.get_json()["state"] == "unknown"
+
+    def test_status_reports_progress(self):
+        url_key = server.get_url_key("http://example.com/a.jpg")
+        server.active_threads[url_key] = MagicMock()
+        p = progress.start(url_key)
+        p.started -= 10
+        progress.update(url_key, 100, 400)
+
+        with server.app.test_client() as client:
+            resp = client.get(f"/status?key={url_key}")
+
+        progress.finish(url_key)
+        data = resp.get_json()
+        assert data["state"] == "in-progress"
+        assert data["bytes_done"] == 100
+        assert data["bytes_total"] == 400
+        assert data["eta"] == pytest.approx(30, abs=1)
+        assert data["retry_after"] in (30, 31)
+
+    def test_status_reports_queued(self):
+        url_key = server.get_url_key("http://example.com/a.jpg")
+        server.queued_urls[url_key] = "http://example.com/a.jpg"
+
+        with server.app.test_client() as client:
+            resp = client.get(f"/status?key={url_key}")
+
+        assert resp.get_json()["state"] == "queued"
+        assert resp.get_json()["retry_after"] == 7
+
+    def test_head_does_not_start_download(self):
+        with (
+            patch("hylde.server.start_download") as start,
+            server.app.test_client() as client,
+        ):
+            resp = client.head("/file?url=http://example.com/a.jpg")
+
+        start.assert_not_called()
+        assert resp.status_code == 404
+        assert resp.headers["X-Hylde-State"] == "unknown"
+
+    def test_head_in_progress_returns_429_with_retry_after(self):
+        url_key = server.get_url_key("http://example.com/a.jpg")
+        thread = MagicMock()
+        server.active_threads[url_key] = thread
+
+        with server.app.test_client() as client:
+            resp = client.head("/file?url=http://example.com/a.jpg")
+
+        thread.join.assert_not_called()
+        assert resp.status_code == 429
+        assert resp.headers["Retry-After"] == "7"
+
+    def test_head_cached_file(self, tmp_path):
+        url_key = server.get_url_key("http://example.com/a.jpg")
+        cached = tmp_path / url_key / "a.jpg"
+        cached.parent.mkdir(parents=True)
+        cached.write_text("image")
+        server.set_cached_file(url_key, f"{url_key}/a.jpg")
+
+        with server.app.test_client() as client:
+            resp = client.head("/file?url=http://example.com/a.jpg")
+
+        assert resp.status_code == 200
+        assert resp.headers["Content-Length"] == "5"
+        assert resp.headers["X-Hylde-State"] == "cached"
+
+    def test_head_failed_download(self):
+        url_key = server.get_url_key("http://example.com/a.jpg")
+        server.set_cached_file(url_key, "FAILED")
+
+        with server.app.test_client() as client:
+            resp = client.head("/file?url=http://example.com/a.jpg")
+
+        assert resp.status_code == 500
+        assert server.get_cached_file(url_key) == "FAILED"
+
+    def test_retry_after_is_capped(self):
+        p = progress.start("key")
+        p.started -= 1
+        progress.update("key", 1, 10_000)
+
+        assert server.get_retry_after("key") == 60
+        progress.finish("key")
+
+
+class TestEvents:
+    """Tests for the /events stream."""
+
+    @pytest.fixture(autouse=True)
+    def patch_settings(self, tmp_path):
+        fake_settings = MagicMock()
+        fake_settings.eventkeepalive = 0.01
+        with (
+            patch("hylde.server._cache_dir", return_value=tmp_path),
+            patch("hylde.server._cache_file", return_value=tmp_path / "cache.db"),
+            patch("hylde.server.settings", fake_settings),
+        ):
+            yield
+        server.active_threads.clear()
+
+    def test_requires_keys(self):
+        with server.app.test_client() as client:
+            resp = client.get("/events")
+        assert resp.status_code == 400
+
+    def test_answers_finished_downloads_immediately(self):
+        server.set_cached_file("a", "a/file.jpg")
+        server.set_cached_file("b", "FAILED")
+
+        with server.app.test_client() as client:
+            resp = client.get("/events?key=a&key=b")
+
+        assert resp.mimetype == "text/event-stream"
+        body = resp.get_data(as_text=True)
+        assert 'event: success\ndata: {"url_key": "a", "result": "success"}' in body
+        assert "event: failed" in body
+
+    def test_pushes_result_of_running_download(self, tmp_path):
+        url = "http://example.com/a.jpg"
+        url_key = server.get_url_key(url)
+        server.active_threads[url_key] = MagicMock()
+
+        with server.app.test_client() as client:
+            resp = client.get(f"/events?url={url}", buffered=False)
+            stream = resp.response
+            assert next(stream) == b": keepalive\n\n"
+            with patch(
+                "hylde.server.hydl.download_file", return_value=f"{url_key}/a.jpg"
+            ):
+                server.download_file(url, url_key)
+            body = b"".join(stream).decode()
+            resp.close()
+
+        assert "event: success" in body
+        assert url_key not in events._subscribers
+
+
+class TestMetrics:
+    """Tests for the /metrics endpoint and request instrumentation."""
+
+    def test_metrics_endpoint(self):
+        with server.app.test_client() as client:
+            resp = client.get("/metrics")
+        assert resp.status_code == 200
+        assert resp.mimetype == "text/plain"
+        assert b"# TYPE hylde_active_downloads gauge" in resp.data
+
+    def test_file_requests_are_observed_by_status(self):
+        child = server.FILE_REQUEST_DURATION.labels(status=400)
+        before = sum(child.counts)
+
+        with server.app.test_client() as client:
+            client.get("/file")
+
+        assert sum(child.counts) == before + 1
+
+    def test_cache_lookups_are_counted(self, tmp_path):
+        miss = server.CACHE_LOOKUPS.labels(result="miss")
+        before = miss.value
+
+        with patch("hylde.server._cache_file", return_value=tmp_path / "cache.db"):
+            server.get_cached_file("nope")
+
+        assert miss.value == before + 1
+
+
 class TestCacheHelpers:
     """Tests for shelve cache helpers."""
 
@@ -285,3 +611,874 @@ class TestDownloadFileHelper:
 
         assert server.get_cached_file(url_key) == f"{url_key}/recovered.txt"
         assert url_key not in server.active_threads
+
+
+class TestPrefetch:
+    """Tests for the /prefetch endpoint."""
+
+    @pytest.fixture(autouse=True)
+    def patch_settings(self, tmp_path):
+        fake_settings = MagicMock()
+        fake_settings.maxprefetch = 3
+        with (
+            patch("hylde.server._cache_dir", return_value=tmp_path),
+            patch("hylde.server._cache_file", return_value=tmp_path / "cache.db"),
+            patch("hylde.server.settings", fake_settings),
+            patch("hylde.server._start_prefetch_workers"),
+        ):
+            yield
+        server.queued_urls.clear()
+        server.active_threads.clear()
+        while not server.prefetch_queue.empty():
+            server.prefetch_queue.get_nowait()
+
+    def _prefetch(self, urls):
+        with server.app.test_client() as client:
+            return client.post("/prefetch", json={"urls": urls})
+
+    def _states(self, resp):
+        return [r["state"] for r in resp.get_json()["results"]]
+
+    def test_invalid_body_returns_400(self):
+        with server.app.test_client() as client:
+            resp = client.post("/prefetch", json={"url": "x"})
+        assert resp.status_code == 400
+
+    def test_too_many_urls_returns_413(self):
+        resp = self._prefetch(["a", "b", "c", "d"])
+        assert resp.status_code == 413
+
+    def test_queues_unknown_urls(self):
+        url = "http://example.com/img.jpg"
+        resp = self._prefetch([url])
+
+        assert resp.status_code == 202
+        assert self._states(resp) == ["queued"]
+        url_key = server.get_url_key(url)
+        assert server.queued_urls == {url_key: url}
+        assert server.prefetch_queue.get_nowait() == (url, url_key)
+
+    def test_duplicate_urls_are_queued_once(self):
+        url = "http://example.com/img.jpg"
+        resp = self._prefetch([url, url])
+
+        assert self._states(resp) == ["queued", "queued"]
+        assert server.prefetch_queue.qsize() == 1
+
+    def test_reports_cached_failed_and_in_progress(self):
+        cached, failed, active = "http://a.com", "http://b.com", "http://c.com"
+        server.set_cached_file(server.get_url_key(cached), "key/file.jpg")
+        server.set_cached_file(server.get_url_key(failed), "FAILED")
+        server.active_threads[server.get_url_key(active)] = MagicMock()
+
+        resp = self._prefetch([cached, failed, active])
+
+        assert self._states(resp) == ["cached", "failed", "in-progress"]
+        assert server.prefetch_queue.empty()
+
+    def test_requeues_retryable_urls(self):
+        url = "http://example.com/img.jpg"
+        url_key = server.get_url_key(url)
+        server.set_cached_file(url_key, "")
+
+        resp = self._prefetch([url])
+
+        assert self._states(resp) == ["queued"]
+        assert server.get_cached_file(url_key) is None
+
+
+class TestNegativeCache:
+    """Tests for failure records and backoff of failed downloads."""
+
+    @pytest.fixture(autouse=True)
+    def patch_settings(self, tmp_path):
+        fake_settings = MagicMock()
+        fake_settings.maxtimeout = 0.01
+        fake_settings.maxprefetch = 10
+        fake_settings.negativecache = DataDict(
+            enabled=True, failed=100, retryable=10, error=20, maxttl=1000, jitter=0
+        )
+        with (
+            patch("hylde.server._cache_dir", return_value=tmp_path),
+            patch("hylde.server._cache_file", return_value=tmp_path / "cache.db"),
+            patch("hylde.server.settings", fake_settings),
+            patch("hylde.server._start_prefetch_workers"),
+        ):
+            yield fake_settings
+        server.queued_urls.clear()
+        server.active_threads.clear()
+        while not server.prefetch_queue.empty():
+            server.prefetch_queue.get_nowait()
+
+    def _download(self, result, url="http://example.com/img.jpg"):
+        url_key = server.get_url_key(url)
+        with patch("hylde.server.hydl.download_file", **result):
+            server.download_file(url, url_key)
+        return url_key
+
+    def test_backoff_doubles_per_failure_up_to_max(self):
+        assert server.get_backoff_ttl("failed", 1) == 100
+        assert server.get_backoff_ttl("failed", 3) == 400
+        assert server.get_backoff_ttl("failed", 20) == 1000
+        assert server.get_backoff_ttl("retryable", 2) == 20
+
+    def test_backoff_is_jittered(self, patch_settings):
+        patch_settings.negativecache.jitter = 0.5
+        ttls = {server.get_backoff_ttl("retryable", 1) for _ in range(20)}
+        assert len(ttls) > 1
+        assert all(5 <= ttl <= 15 for ttl in ttls)
+
+    def test_failure_classes_decide_ttl(self):
+        with patch("hylde.server.time.time", return_value=1000):
+            failed = self._download({"return_value": None}, "http://a.com")
+            retryable = self._download({"return_value": ""}, "http://b.com")
+            error = self._download({"side_effect": RuntimeError}, "http://c.com")
+
+        assert server.get_failure(failed) == {
+            "class": "failed",
+            "count": 1,
+            "until": 1100,
+        }
+        assert server.get_failure(retryable)["until"] == 1010
+        assert server.get_failure(error)["until"] == 1020
+
+    def test_consecutive_failures_are_counted_and_success_clears(self, tmp_path):
+        self._download({"return_value": ""})
+        url_key = self._download({"return_value": ""})
+        assert server.get_failure(url_key)["count"] == 2
+
+        self._download({"return_value": f"{url_key}/file.jpg"})
+        assert server.get_failure(url_key) is None
+
+    def test_disabled_records_nothing(self, patch_settings):
+        patch_settings.negativecache.enabled = False
+        url_key = self._download({"return_value": None})
+        assert server.get_failure(url_key) is None
+
+    def test_file_answers_from_cache_during_backoff(self):
+        url = "http://example.com/img.jpg"
+        url_key = self._download({"return_value": None}, url)
+
+        with (
+            patch("hylde.server.start_download") as start_download,
+            server.app.test_client() as client,
+        ):
+            resp = client.get(f"/file?url={url}")
+            resp2 = client.get(f"/file?url={url}")
+
+        start_download.assert_not_called()
+        assert resp.status_code == resp2.status_code == 500
+        assert 99 <= int(resp.headers["Retry-After"]) <= 100
+        assert server.get_cached_file(url_key) == "FAILED"
+
+    def test_file_downloads_again_after_backoff(self):
+        url = "http://example.com/img.jpg"
+        url_key = self._download({"return_value": ""}, url)
+        fake_thread = MagicMock()
+        fake_thread.is_alive.return_value = True
+
+        with (
+            patch("hylde.server.time.time", return_value=10**10),
+            patch("hylde.server.start_download", return_value=fake_thread) as start,
+            server.app.test_client() as client,
+        ):
+            resp = client.get(f"/file?url={url}")
+
+        start.assert_called_once_with(url, url_key)
+        assert resp.status_code == 429
+        assert server.get_failure(url_key)["count"] == 1
+
+    def test_status_reports_backoff(self):
+        url_key = self._download({"return_value": ""})
+
+        status, code, headers = server.get_status(url_key)
+
+        assert code == 503
+        assert status["state"] == "retryable"
+        assert 9 <= status["retry_after"] <= 10
+        assert headers["Retry-After"] == str(status["retry_after"])
+
+    def test_prefetch_skips_urls_in_backoff(self):
+        url = "http://example.com/img.jpg"
+        self._download({"return_value": ""}, url)
+
+        with server.app.test_client() as client:
+            resp = client.post("/prefetch", json={"urls": [url]})
+
+        result = resp.get_json()["results"][0]
+        assert result["state"] == "retryable"
+        assert 9 <= result["retry_after"] <= 10
+        assert server.prefetch_queue.empty()
+
+    def test_prefetch_requeues_failed_urls_after_backoff(self):
+        url = "http://example.com/img.jpg"
+        self._download({"return_value": None}, url)
+
+        with (
+            patch("hylde.server.time.time", return_value=10**10),
+            server.app.test_client() as client,
+        ):
+            resp = client.post("/prefetch", json={"urls": [url]})
+
+        assert resp.get_json()["results"][0]["state"] == "queued"
+        assert not server.prefetch_queue.empty()
+
+    def test_retryable_failures_are_retried_in_background(self, retry_scheduler):
+        url = "http://example.com/img.jpg"
+        url_key = self._download({"return_value": ""}, url)
+        retry_scheduler.schedule.assert_called_once_with(url, url_key)
+
+        self._download({"return_value": None}, url)
+        retry_scheduler.forget.assert_called_once_with(url_key)
+
+    def test_retry_after_points_at_scheduled_retry(self, retry_scheduler):
+        url_key = self._download({"return_value": ""})
+        retry_scheduler.pending.return_value = 2.5
+
+        status, _, _ = server.get_status(url_key)
+
+        assert status["retry_after"] == 4
+
+    def test_background_retry_requeues_retryable_download(self):
+        url = "http://example.com/img.jpg"
+        url_key = self._download({"return_value": ""}, url)
+
+        server._retry_download(url, url_key)
+
+        assert server.queued_urls == {url_key: url}
+        assert server.get_cached_file(url_key) is None
+        assert server.get_failure(url_key)["count"] == 1
+
+    def test_background_retry_skips_answered_downloads(self):
+        url = "http://example.com/img.jpg"
+        url_key = self._download(
+            {"return_value": f"{server.get_url_key(url)}/a.jpg"}, url
+        )
+
+        server._retry_download(url, url_key)
+
+        assert server.queued_urls == {}
+
+    def test_consumed_result_after_wait_returns_503(self):
+        url = "http://example.com/img.jpg"
+        fake_thread = MagicMock()
+        fake_thread.is_alive.return_value = False
+
+        with (
+            patch("hylde.server.start_download", return_value=fake_thread),
+            server.app.test_client() as client,
+        ):
+            resp = client.get(f"/file?url={url}")
+
+        assert resp.status_code == 503
+
+
+class TestStartDownload:
+    """Tests for start_download and the prefetch worker."""
+
+    def test_returns_existing_thread(self):
+        existing = MagicMock()
+        server.active_threads["key"] = existing
+
+        with patch("hylde.server.threading.Thread") as thread_cls:
+            assert server.start_download("http://a.com", "key") is existing
+
+        thread_cls.assert_not_called()
+        server.active_threads.clear()
+
+    def test_starts_and_registers_thread(self):
+        fake_thread = MagicMock()
+        server.queued_urls["key"] = "http://a.com"
+
+        with patch("hylde.server.threading.Thread", return_value=fake_thread):
+            thread = server.start_download("http://a.com", "key")
+
+        assert thread is fake_thread
+        fake_thread.start.assert_called_once()
+        assert server.active_threads["key"] is fake_thread
+        assert "key" not in server.queued_urls
+        server.active_threads.clear()
+
+    def test_worker_skips_urls_started_elsewhere(self):
+        server.prefetch_queue.put(("http://a.com", "key"))
+        server.prefetch_queue.put(("http://b.com", "other"))
+        server.queued_urls["other"] = "http://b.com"
+
+        with (
+            patch("hylde.server.start_download", side_effect=KeyboardInterrupt) as sd,
+            pytest.raises(KeyboardInterrupt),
+        ):
+            server._prefetch_worker()
+
+        sd.assert_called_once_with("http://b.com", "other")
+        server.queued_urls.clear()
+
+
+class TestRecoverJobs:
+    """Tests for resuming interrupted downloads after a restart."""
+
+    @pytest.fixture(autouse=True)
+    def patch_settings(self, tmp_path):
+        with (
+            patch("hylde.server._cache_file", return_value=tmp_path / "cache.db"),
+            patch("hylde.server.queue_download") as queue_download,
+        ):
+            yield queue_download
+
+    def test_requeues_interrupted_downloads(self, job_journal, patch_settings):
+        job_journal.queued("http://a.com", "a")
+        job_journal.running("http://b.com", "b")
+        downloader = MagicMock()
+
+        with patch(
+            "hylde.server.registry.get_downloaders_for_url", return_value=[downloader]
+        ):
+            assert server.recover_jobs() == 2
+
+        assert patch_settings.call_args_list == [
+            (("http://a.com", "a"),),
+            (("http://b.com", "b"),),
+        ]
+        assert [c.args for c in downloader.cleanup.call_args_list] == [("a",), ("b",)]
+
+    def test_skips_downloads_with_a_result(self, job_journal, patch_settings):
+        job_journal.running("http://a.com", "a")
+        server.set_cached_file("a", "a/file.jpg")
+
+        with patch("hylde.server.registry.get_downloaders_for_url"):
+            assert server.recover_jobs() == 0
+
+        patch_settings.assert_not_called()
+        assert job_journal.pending() == {}
+
+    def test_drops_old_downloads(self, job_journal, patch_settings):
+        job_journal.running("http://a.com", "a")
+        fake_settings = MagicMock()
+        fake_settings.journalmaxage = -1
+
+        with (
+            patch("hylde.server.settings", fake_settings),
+            patch("hylde.server.registry.get_downloaders_for_url"),
+        ):
+            assert server.recover_jobs() == 0
+
+        patch_settings.assert_not_called()
+
+    def test_download_file_marks_job_done(self, job_journal, tmp_path):
+        job_journal.running("http://a.com", "a")
+
+        with (
+            patch("hylde.server._cache_dir", return_value=tmp_path),
+            patch("hylde.server.hydl.download_file", return_value="a/file.jpg"),
+        ):
+            server.download_file("http://a.com", "a")
+
+        assert job_journal.pending() == {}
+
+
+class TestCoordination:
+    """Tests for sharing downloads with other instances."""
+
+    @pytest.fixture(autouse=True)
+    def coordinator(self, tmp_path):
+        coordinator = MagicMock()
+        coordinator.shared = True
+        with (
+            patch("hylde.server._cache_file", return_value=tmp_path / "cache.db"),
+            patch("hylde.server.coordinator", coordinator),
+            patch("hylde.server.time.sleep"),
+        ):
+            yield coordinator
+        server.active_threads.clear()
+        cancellation._tokens.clear()
+
+    def test_joins_download_claimed_elsewhere(self, coordinator):
+        coordinator.claim.return_value = False
+
+        with (
+            patch("hylde.server._join_download") as join,
+            patch("hylde.server.download_file") as download_file,
+        ):
+            server._run_download("http://a.com", "key")
+
+        join.assert_called_once_with("http://a.com", "key")
+        download_file.assert_not_called()
+
+    def test_claims_in_download_thread(self, coordinator, job_journal):
+        claiming, claimed = threading.Event(), threading.Event()
+
+        def claim(url_key):
+            claiming.set()
+            return claimed.wait(1)
+
+        coordinator.claim.side_effect = claim
+
+        with patch("hylde.server.download_file") as download_file:
+            thread = server.start_download("http://a.com", "key")
+            assert claiming.wait(1)
+            # other requests find the download while the claim is in flight
+            assert server.start_download("http://a.com", "key") is thread
+            claimed.set()
+            thread.join()
+
+        download_file.assert_called_once_with("http://a.com", "key")
+        assert job_journal.pending()["key"]["state"] == "running"
+
+    def test_join_waits_for_result_of_other_instance(self, coordinator):
+        coordinator.holder.side_effect = ["other", None]
+        server.set_cached_file("key", "key/file.jpg")
+        server.active_threads["key"] = MagicMock()
+
+        with patch("hylde.server.events.publish") as publish:
+            server._join_download("http://a.com", "key")
+
+        publish.assert_called_once_with("key", events.SUCCESS)
+        coordinator.claim.assert_not_called()
+        assert "key" not in server.active_threads
+
+    @pytest.mark.parametrize("cancelled", [False, True])
+    def test_join_marks_job_done(self, coordinator, job_journal, cancelled):
+        coordinator.holder.return_value = "other"
+        job_journal.queued("http://a.com", "key")
+        server.set_cached_file("key", "key/file.jpg")
+        if cancelled:
+            cancellation.start("key").cancel()
+        else:
+            coordinator.holder.side_effect = ["other", None]
+
+        with patch("hylde.server.events.publish"):
+            server._join_download("http://a.com", "key")
+
+        assert job_journal.pending() == {}
+
+    def test_join_takes_over_stale_claim(self, coordinator):
+        coordinator.holder.return_value = None
+        coordinator.claim.return_value = True
+
+        with patch("hylde.server.download_file") as download_file:
+            server._join_download("http://a.com", "key")
+
+        download_file.assert_called_once_with("http://a.com", "key")
+
+    def test_index_is_locked_by_coordinator(self, coordinator, tmp_path):
+        server.set_cached_file("key", "key/file.jpg")
+
+        coordinator.index_lock.assert_called_with(tmp_path / "cache.db")
+        assert server.get_cached_file("key") == "key/file.jpg"
+
+
+class TestAdmin:
+    """Tests for the admin profiling endpoints."""
+
+    @pytest.fixture(autouse=True)
+    def admin_settings(self):
+        fake_settings = MagicMock()
+        fake_settings.admin = DataDict(
+            token="secret", maxprofileseconds=0.05, tracemallocframes=1
+        )
+        with patch("hylde.server.settings", fake_settings):
+            yield fake_settings.admin
+
+    def _get(self, path, token="secret"):
+        headers = {"Authorization": f"Bearer {token}"} if token else {}
+        with server.app.test_client() as client:
+            return client.get(path, headers=headers)
+
+    def test_hidden_without_configured_token(self, admin_settings):
+        admin_settings.token = ""
+        assert self._get("/admin/threads").status_code == 404
+
+    def test_rejects_wrong_token(self):
+        assert self._get("/admin/threads", token="guess").status_code == 403
+        assert self._get("/admin/threads", token=None).status_code == 403
+
+    def test_threads_are_labelled_with_url_keys(self):
+        thread = MagicMock(ident=threading.get_ident())
+        server.active_threads["key"] = thread
+        try:
+            resp = self._get("/admin/threads")
+        finally:
+            server.active_threads.clear()
+
+        assert resp.status_code == 200
+        assert "url_key=key" in resp.get_data(as_text=True)
+
+    def test_profile_is_bounded(self):
+        resp = self._get("/admin/profile?seconds=100&format=pstats")
+
+        assert resp.status_code == 200
+        assert resp.headers["Content-Disposition"].endswith("hylde.pstats")
+
+    def test_tracemalloc_snapshot(self):
+        try:
+            resp = self._get("/admin/tracemalloc?limit=3")
+            diff = self._get("/admin/tracemalloc?diff=1")
+        finally:
+            with server.app.test_client() as client:
+                client.delete(
+                    "/admin/tracemalloc", headers={"Authorization": "Bearer secret"}
+                )
+
+        assert resp.get_data(as_text=True).startswith("Traced memory:")
+        assert diff.status_code == 200
+
+
+class TestServeMode:
+    """Tests for handing file transfers to a reverse proxy."""
+
+    @pytest.fixture(autouse=True)
+    def patch_settings(self, tmp_path):
+        fake_settings = MagicMock()
+        fake_settings.maxtimeout = 0.01
+        fake_settings.accelprefix = "/internal/"
+        with (
+            patch("hylde.server._cache_dir", return_value=tmp_path),
+            patch("hylde.server._cache_file", return_value=tmp_path / "cache.db"),
+            patch("hylde.server.settings", fake_settings),
+            patch.object(server, "ram_cache", ramcache.RamCache(0, 0)),
+        ):
+            yield fake_settings
+
+    def _get(self, tmp_path, url="http://example.com/a b.jpg"):
+        url_key = server.get_url_key(url)
+        (tmp_path / url_key).mkdir()
+        (tmp_path / url_key / "a b.jpg").write_bytes(b"jpeg")
+        server.set_cached_file(url_key, f"{url_key}/a b.jpg")
+        with server.app.test_client() as client:
+            return client.get("/file", query_string={"url": url}), url_key
+
+    def test_python_streams_file(self, tmp_path, patch_settings):
+        patch_settings.servemode = "python"
+
+        resp, _ = self._get(tmp_path)
+
+        assert resp.data == b"jpeg"
+        assert "X-Accel-Redirect" not in resp.headers
+
+    def test_accel_redirects_to_internal_location(self, tmp_path, patch_settings):
+        patch_settings.servemode = "accel"
+
+        resp, url_key = self._get(tmp_path)
+
+        assert resp.status_code == 200
+        assert resp.data == b""
+        assert resp.headers["X-Accel-Redirect"] == f"/internal/{url_key}/a%20b.jpg"
+        assert resp.headers["Content-Type"] == "image/jpeg"
+
+    def test_sendfile_names_absolute_path(self, tmp_path, patch_settings):
+        patch_settings.servemode = "sendfile"
+
+        resp, url_key = self._get(tmp_path)
+
+        assert resp.headers["X-Sendfile"] == str(tmp_path / url_key / "a b.jpg")
+        assert resp.data == b""
+
+
+class TestCancel:
+    """Tests for cancelling downloads."""
+
+    @pytest.fixture(autouse=True)
+    def patch_settings(self, tmp_path):
+        with (
+            patch("hylde.server._cache_dir", return_value=tmp_path),
+            patch("hylde.server._cache_file", return_value=tmp_path / "cache.db"),
+        ):
+            yield
+        server.queued_urls.clear()
+        server.active_threads.clear()
+        cancellation._tokens.clear()
+
+    def _delete(self, url_key):
+        with server.app.test_client() as client:
+            return client.delete("/file", query_string={"key": url_key})
+
+    def test_requires_url_or_key(self):
+        with server.app.test_client() as client:
+            assert client.delete("/file").status_code == 400
+
+    def test_nothing_to_cancel_returns_404(self):
+        server.set_cached_file("key", "key/file.jpg")
+
+        resp = self._delete("key")
+
+        assert resp.status_code == 404
+        assert resp.get_json()["state"] == "cached"
+
+    def test_running_download_is_cancelled(self):
+        server.active_threads["key"] = MagicMock()
+        token = cancellation.start("key")
+
+        resp = self._delete("key")
+
+        assert resp.status_code == 202
+        assert resp.get_json()["state"] == "cancelling"
+        assert token.reason == "request"
+
+    def test_queued_download_is_dropped(self, job_journal):
+        server.queued_urls["key"] = "http://a.com"
+        job_journal.queued("http://a.com", "key")
+        subscription = events.subscribe(["key"])
+
+        resp = self._delete("key")
+
+        assert resp.status_code == 200
+        assert "key" not in server.queued_urls
+        assert job_journal.pending() == {}
+        assert subscription.get_nowait() == ("key", events.CANCELLED)
+        events.unsubscribe(subscription, ["key"])
+
+    def test_scheduled_retry_is_dropped(self, retry_scheduler):
+        retry_scheduler.pending.return_value = 3.0
+
+        assert self._delete("key").status_code == 200
+        retry_scheduler.forget.assert_called_once_with("key")
+
+    def test_cancelled_download_leaves_no_result(self, retry_scheduler):
+        url = "http://example.com"
+        url_key = server.get_url_key(url)
+        server.active_threads[url_key] = MagicMock()
+        cancellation.start(url_key)
+
+        with (
+            patch(
+                "hylde.server.hydl.download_file",
+                side_effect=cancellation.Cancelled("request"),
+            ),
+            patch("hylde.server.events.publish") as publish,
+        ):
+            server.download_file(url, url_key)
+
+        assert server.get_cached_file(url_key) is None
+        assert server.get_failure(url_key) is None
+        retry_scheduler.schedule.assert_not_called()
+        publish.assert_called_once_with(url_key, events.CANCELLED)
+        assert cancellation.get(url_key) is None
+        assert url_key not in server.active_threads
+
+    def test_requests_keep_download_alive(self):
+        url = "http://example.com"
+        url_key = server.get_url_key(url)
+        server.active_threads[url_key] = MagicMock()
+        token = cancellation.start(url_key, idle_timeout=60)
+        token.touched -= 30
+
+        with server.app.test_client() as client:
+            client.get("/status", query_string={"key": url_key})
+
+        assert token.touched > time.monotonic() - 1
+
+
+class TestHealth:
+    """Tests for failing fast while downloader backends are down."""
+
+    @pytest.fixture(autouse=True)
+    def patch_settings(self, tmp_path):
+        health.reset()
+        downloader = MagicMock(__name__="hylde.downloaders.jdownloader", spec=[])
+        with (
+            patch("hylde.server._cache_dir", return_value=tmp_path),
+            patch("hylde.server._cache_file", return_value=tmp_path / "cache.db"),
+            patch(
+                "hylde.server.registry.get_downloaders_for_url",
+                return_value=[downloader],
+            ),
+        ):
+            yield downloader
+        health.reset()
+        server.active_threads.clear()
+
+    def _break(self, downloader):
+        for _ in range(3):
+            health.record(downloader, RuntimeError("relay down"))
+
+    def test_health_reports_backends(self, patch_settings):
+        with server.app.test_client() as client:
+            assert client.get("/health").get_json()["status"] == "ok"
+            self._break(patch_settings)
+            resp = client.get("/health")
+
+        assert resp.status_code == 200
+        data = resp.get_json()
+        assert data["status"] == "degraded"
+        assert data["backends"]["jdownloader"]["state"] == "open"
+        assert data["backends"]["jdownloader"]["last_error"] == "relay down"
+
+    def test_file_fails_fast_while_backends_are_down(self, patch_settings):
+        self._break(patch_settings)
+
+        with (
+            patch("hylde.server.start_download") as start_download,
+            server.app.test_client() as client,
+        ):
+            resp = client.get("/file?url=http://example.com/a")
+
+        assert resp.status_code == 503
+        assert int(resp.headers["Retry-After"]) >= 1
+        start_download.assert_not_called()
+
+    def test_unavailable_backend_is_retryable(self):
+        url = "http://example.com"
+        url_key = server.get_url_key(url)
+        server.active_threads[url_key] = MagicMock()
+
+        with patch(
+            "hylde.server.hydl.download_file",
+            side_effect=health.BackendUnavailable("jdownloader", 30),
+        ):
+            server.download_file(url, url_key)
+
+        assert server.get_cached_file(url_key) == ""
+        assert server.get_failure(url_key)["class"] == "retryable"
+
+
+class TestArchiveMembers:
+    """Tests for serving and listing single files of cached archives."""
+
+    @pytest.fixture(autouse=True)
+    def patch_settings(self, tmp_path):
+        fake_settings = MagicMock()
+        fake_settings.maxtimeout = 0.01
+        fake_settings.servemode = "accel"
+        with (
+            patch("hylde.server._cache_dir", return_value=tmp_path),
+            patch("hylde.server._cache_file", return_value=tmp_path / "cache.db"),
+            patch("hylde.server.settings", fake_settings),
+        ):
+            yield fake_settings
+
+    def _cache(self, tmp_path, url="http://example.com/gallery"):
+        url_key = server.get_url_key(url)
+        (tmp_path / url_key).mkdir()
+        with zipfile.ZipFile(tmp_path / url_key / "gallery.zip", "w") as zf:
+            zf.writestr("01.jpg", b"first")
+            zf.writestr("02.png", b"second")
+        server.set_cached_file(url_key, f"{url_key}/gallery.zip")
+        return url, url_key
+
+    def test_serves_member_by_name_or_index(self, tmp_path):
+        url, _ = self._cache(tmp_path)
+
+        with server.app.test_client() as client:
+            by_name = client.get("/file", query_string={"url": url, "member": "02.png"})
+            by_index = client.get("/file", query_string={"url": url, "member": "0"})
+
+        assert by_name.status_code == 200
+        assert by_name.data == b"second"
+        assert by_name.headers["Content-Type"] == "image/png"
+        assert by_name.headers["Content-Length"] == "6"
+        # reverse proxies can only send whole files
+        assert "X-Accel-Redirect" not in by_name.headers
+        assert by_index.data == b"first"
+
+    def test_unknown_member(self, tmp_path):
+        url, _ = self._cache(tmp_path)
+
+        with server.app.test_client() as client:
+            resp = client.get("/file", query_string={"url": url, "member": "03.jpg"})
+
+        assert resp.status_code == 404
+
+    def test_member_of_single_file(self, tmp_path):
+        url = "http://example.com/a.jpg"
+        url_key = server.get_url_key(url)
+        (tmp_path / url_key).mkdir()
+        (tmp_path / url_key / "a.jpg").write_bytes(b"jpeg")
+        server.set_cached_file(url_key, f"{url_key}/a.jpg")
+
+        with server.app.test_client() as client:
+            resp = client.get("/file", query_string={"url": url, "member": "0"})
+            members = client.get("/members", query_string={"url": url})
+
+        assert resp.status_code == 400
+        assert members.status_code == 400
+
+    def test_lists_members(self, tmp_path):
+        _, url_key = self._cache(tmp_path)
+
+        with server.app.test_client() as client:
+            resp = client.get("/members", query_string={"key": url_key})
+
+        assert resp.status_code == 200
+        assert [m["name"] for m in resp.get_json()["members"]] == ["01.jpg", "02.png"]
+        assert resp.get_json()["members"][1] == {
+            "index": 1,
+            "name": "02.png",
+            "size": 6,
+            "stored": True,
+        }
+
+    def test_members_never_starts_download(self):
+        with (
+            patch("hylde.server.start_download") as start_download,
+            server.app.test_client() as client,
+        ):
+            resp = client.get("/members?url=http://example.com/missing")
+            missing = client.get("/members")
+
+        assert resp.status_code == 404
+        assert resp.get_json()["state"] == "unknown"
+        assert missing.status_code == 400
+        start_download.assert_not_called()
+
+
+class TestDiskSpace:
+    """Tests for evicting cached files and deferring downloads without disk space."""
+
+    @pytest.fixture(autouse=True)
+    def patch_settings(self, tmp_path):
+        with (
+            patch("hylde.server._cache_dir", return_value=tmp_path),
+            patch("hylde.server._cache_file", return_value=tmp_path / "cache.db"),
+        ):
+            yield
+        server.active_threads.clear()
+
+    def _cache(self, tmp_path, url_key, size, used):
+        (tmp_path / url_key).mkdir()
+        path = tmp_path / url_key / "a.jpg"
+        path.write_bytes(b"x" * size)
+        os.utime(path, (used, used))
+        server.set_cached_file(url_key, f"{url_key}/a.jpg")
+
+    def test_evicts_least_recently_used_first(self, tmp_path):
+        self._cache(tmp_path, "old", 10, 1000)
+        self._cache(tmp_path, "new", 10, 3000)
+        self._cache(tmp_path, "running", 10, 0)
+        server.active_threads["running"] = MagicMock()
+        (tmp_path / ".staging").mkdir()
+
+        evictions = server.select_evictions(5)
+        for url_key, _ in evictions:
+            server.evict_cached_file(url_key)
+
+        assert evictions == [("old", 10)]
+        assert not (tmp_path / "old").exists()
+        assert server.get_cached_file("old") is None
+        assert server.get_cached_file("new") == "new/a.jpg"
+        assert (tmp_path / "running").exists()
+        assert (tmp_path / ".staging").exists()
+
+    def test_full_disk_is_retryable(self):
+        url = "http://example.com"
+        url_key = server.get_url_key(url)
+        server.active_threads[url_key] = MagicMock()
+
+        with patch(
+            "hylde.server.hydl.download_file",
+            side_effect=diskspace.DiskFull(server._cache_dir(), 1024),
+        ):
+            server.download_file(url, url_key)
+
+        assert server.get_cached_file(url_key) == ""
+
+    def test_health_reports_reservations(self, tmp_path):
+        with (
+            patch.dict(diskspace.settings.diskspace, enabled=True),
+            diskspace.admit("key", tmp_path),
+            server.app.test_client() as client,
+        ):
+            data = client.get("/health").get_json()
+
+        assert data["status"] == "ok"
+        assert data["disk"]["reservations"][0]["url_key"] == "key"
+        assert data["disk"]["volumes"][0]["path"] == str(tmp_path)
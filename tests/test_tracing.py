@@ -0,0 +1,116 @@
+"""Tests for hylde.tracing module."""
+
+import json
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from hylde import tracing
+
+
+@pytest.fixture
+def fake_settings(tmp_path):
+    s = MagicMock()
+    s.tracing.enabled = True
+    s.tracing.samplerate = 1.0
+    s.tracing.format = "jsonl"
+    s.tracing.file = str(tmp_path / "traces.jsonl")
+    s.tracing.endpoint = ""
+    with patch("hylde.tracing.settings", s):
+        yield s
+
+
+@pytest.fixture
+def submitted():
+    spans = []
+    with patch("hylde.tracing._submit", side_effect=spans.append):
+        yield spans
+
+
+class TestSpan:
+    """Tests for the span context manager."""
+
+    def test_disabled_yields_noop(self, fake_settings, submitted):
+        fake_settings.tracing.enabled = False
+        with tracing.span("phase", "key") as s:
+            s.set("a", 1)
+        assert s is tracing.NOOP_SPAN
+        assert submitted == []
+
+    def test_records_nested_spans(self, fake_settings, submitted):
+        with (
+            tracing.span("outer", "key") as outer,
+            tracing.span("inner", "key", files=2),
+        ):
+            pass
+
+        inner = submitted[0]
+        assert [s.name for s in submitted] == ["inner", "outer"]
+        assert inner.parent_id == outer.span_id
+        assert outer.parent_id is None
+        assert inner.attributes == {"files": 2}
+        assert outer.end_ns >= inner.end_ns
+
+    def test_other_url_keys_are_not_children(self, fake_settings, submitted):
+        with tracing.span("outer", "key"), tracing.span("inner", "other"):
+            pass
+        assert submitted[0].parent_id is None
+
+    def test_records_errors(self, fake_settings, submitted):
+        with pytest.raises(ValueError), tracing.span("phase", "key"):
+            raise ValueError("boom")
+        assert submitted[0].error == "ValueError: boom"
+
+    def test_sampling_is_stable_per_url_key(self, fake_settings):
+        fake_settings.tracing.samplerate = 0.5
+        keys = [f"key{i}" for i in range(200)]
+        sampled = [tracing.is_sampled(k) for k in keys]
+        assert sampled == [tracing.is_sampled(k) for k in keys]
+        assert 50 < sum(sampled) < 150
+
+    def test_zero_samplerate_drops_everything(self, fake_settings, submitted):
+        fake_settings.tracing.samplerate = 0
+        with tracing.span("phase", "key"):
+            pass
+        assert submitted == []
+
+
+class TestExport:
+    """Tests for span export formats."""
+
+    def _span(self):
+        s = tracing.Span("phase", "0123456789abcdef0123456789abcdef", None, {"n": 1})
+        s.end_ns = s.start_ns + 2_000_000
+        return s
+
+    def test_jsonl(self, fake_settings, tmp_path):
+        tracing.export([self._span(), self._span()])
+
+        lines = (tmp_path / "traces.jsonl").read_text().splitlines()
+        record = json.loads(lines[0])
+        assert len(lines) == 2
+        assert record["name"] == "phase"
+        assert record["trace_id"] == "0123456789abcdef0123456789abcdef"
+        assert record["duration_ms"] == 2
+        assert record["attributes"] == {"n": 1}
+
+    def test_otlp(self, fake_settings, tmp_path):
+        fake_settings.tracing.format = "otlp"
+        tracing.export([self._span()])
+
+        payload = json.loads((tmp_path / "traces.jsonl").read_text())
+        span = payload["resourceSpans"][0]["scopeSpans"][0]["spans"][0]
+        assert span["traceId"] == "0123456789abcdef0123456789abcdef"
+        assert span["name"] == "phase"
+        assert {"key": "n", "value": {"intValue": "1"}} in span["attributes"]
+        assert "parentSpanId" not in span
+
+    def test_posts_to_collector(self, fake_settings):
+        fake_settings.tracing.file = ""
+        fake_settings.tracing.endpoint = "http://collector:4318/"
+
+        with patch("hylde.tracing.requests.post") as post:
+            tracing.export([self._span()])
+
+        assert post.call_args.args[0] == "http://collector:4318/v1/traces"
+        assert "resourceSpans" in post.call_args.kwargs["json"]
@@ -0,0 +1,73 @@
+"""Tests for hylde.util module."""
+
+from unittest.mock import patch
+
+from hylde.util import TTLCache, is_key_sampled, md5
+
+
+class TestMd5:
+    """Tests for md5."""
+
+    def test_returns_hex_digest(self):
+        assert md5("hello") == "5d41402abc4b2a76b9719d911017c592"
+
+
+class TestTTLCache:
+    """Tests for TTLCache."""
+
+    def test_get_returns_default_when_missing(self):
+        cache = TTLCache(maxsize=2, ttl=10)
+        assert cache.get("nope", "default") == "default"
+
+    def test_set_and_get(self):
+        cache = TTLCache(maxsize=2, ttl=10)
+        cache.set("a", 1)
+        assert cache.get("a") == 1
+        assert "a" in cache
+
+    def test_entries_expire(self):
+        cache = TTLCache(maxsize=2, ttl=10)
+        with patch("hylde.util.time.monotonic", return_value=100):
+            cache.set("a", 1)
+        with patch("hylde.util.time.monotonic", return_value=111):
+            assert cache.get("a") is None
+        assert len(cache) == 0
+
+    def test_per_entry_ttl(self):
+        cache = TTLCache(maxsize=2, ttl=10)
+        with patch("hylde.util.time.monotonic", return_value=100):
+            cache.set("a", 1, ttl=100)
+        with patch("hylde.util.time.monotonic", return_value=150):
+            assert cache.get("a") == 1
+
+    def test_evicts_least_recently_used(self):
+        cache = TTLCache(maxsize=2, ttl=10)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        assert "a" in cache
+        assert "b" not in cache
+        assert "c" in cache
+
+    def test_pop_removes_entry(self):
+        cache = TTLCache(maxsize=2, ttl=10)
+        cache.set("a", 1)
+        assert cache.pop("a") == 1
+        assert cache.pop("a", "gone") == "gone"
+
+
+class TestIsKeySampled:
+    def test_full_rate_keeps_everything(self):
+        assert is_key_sampled("abc", 1.0)
+
+    def test_zero_rate_drops_everything(self):
+        assert not any(is_key_sampled(md5(str(i)), 0.0) for i in range(100))
+
+    def test_decision_is_stable_per_key(self):
+        key = md5("https://example.com/a")
+        assert {is_key_sampled(key, 0.5) for _ in range(10)} in ({True}, {False})
+
+    def test_keeps_roughly_the_rate(self):
+        kept = sum(is_key_sampled(md5(str(i)), 0.25) for i in range(4000))
+        assert 800 < kept < 1200
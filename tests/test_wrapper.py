@@ -1,12 +1,14 @@
 """Tests for hylde.wrapper module."""
 
+import threading
+import time
 import zipfile
 from pathlib import Path
 from unittest.mock import MagicMock, patch
 
 import pytest
 
-from hylde import wrapper
+from hylde import cancellation, diskspace, health, progress, ratelimit, wrapper
 
 
 class TestZipFilesToCache:
@@ -126,6 +128,14 @@ class TestMoveFileToCache:
 class TestDownloadFile:
     """Tests for download_file."""
 
+    @pytest.fixture(autouse=True)
+    def reset_rate_limits(self):
+        ratelimit.reset()
+        health.reset()
+        yield
+        ratelimit.reset()
+        health.reset()
+
     def test_returns_none_on_downloader_error(self, tmp_path: Path):
         mock_downloader = MagicMock()
         mock_downloader.download_url.return_value = None
@@ -133,7 +143,9 @@ class TestDownloadFile:
 
         with (
             patch("hylde.wrapper._cache_dir", return_value=tmp_path),
-            patch("hylde.wrapper.get_downloader_for_url", return_value=mock_downloader),
+            patch(
+                "hylde.wrapper.get_downloaders_for_url", return_value=[mock_downloader]
+            ),
         ):
             result = wrapper.download_file("http://example.com", "key")
 
@@ -146,7 +158,9 @@ class TestDownloadFile:
 
         with (
             patch("hylde.wrapper._cache_dir", return_value=tmp_path),
-            patch("hylde.wrapper.get_downloader_for_url", return_value=mock_downloader),
+            patch(
+                "hylde.wrapper.get_downloaders_for_url", return_value=[mock_downloader]
+            ),
         ):
             result = wrapper.download_file("http://example.com", "key")
 
@@ -162,12 +176,16 @@ class TestDownloadFile:
 
         with (
             patch("hylde.wrapper._cache_dir", return_value=tmp_path),
-            patch("hylde.wrapper.get_downloader_for_url", return_value=mock_downloader),
+            patch(
+                "hylde.wrapper.get_downloaders_for_url", return_value=[mock_downloader]
+            ),
         ):
             result = wrapper.download_file("http://example.com", "key")
 
         assert result == "key/file.txt"
         assert (tmp_path / "key" / "file.txt").exists()
+        # the emptied staging directory goes as well
+        mock_downloader.cleanup.assert_called_once_with("key")
 
     def test_zips_multiple_files(self, tmp_path: Path):
         f1 = tmp_path / "dl" / "a.txt"
@@ -182,7 +200,9 @@ class TestDownloadFile:
 
         with (
             patch("hylde.wrapper._cache_dir", return_value=tmp_path),
-            patch("hylde.wrapper.get_downloader_for_url", return_value=mock_downloader),
+            patch(
+                "hylde.wrapper.get_downloaders_for_url", return_value=[mock_downloader]
+            ),
         ):
             result = wrapper.download_file("http://example.com", "key")
 
@@ -196,10 +216,279 @@ class TestDownloadFile:
 
         with (
             patch("hylde.wrapper._cache_dir", return_value=tmp_path),
-            patch("hylde.wrapper.get_downloader_for_url", return_value=mock_downloader),
+            patch(
+                "hylde.wrapper.get_downloaders_for_url", return_value=[mock_downloader]
+            ),
         ):
             wrapper.download_file("http://example.com/page", "abc123")
 
         mock_downloader.download_url.assert_called_once_with(
             "http://example.com/page", "abc123"
         )
+
+    def test_observes_download_metrics(self, tmp_path: Path):
+        src = tmp_path / "dl" / "file.txt"
+        src.parent.mkdir(parents=True)
+        src.write_text("data")
+        mock_downloader = MagicMock()
+        mock_downloader.download_url.return_value = [src]
+        mock_downloader.__name__ = "hylde.downloaders.metricsdl"
+        duration = wrapper.DOWNLOAD_DURATION.labels(
+            downloader="metricsdl", result="success"
+        )
+        size = wrapper.DOWNLOAD_BYTES.labels(downloader="metricsdl")
+
+        with (
+            patch("hylde.wrapper._cache_dir", return_value=tmp_path),
+            patch(
+                "hylde.wrapper.get_downloaders_for_url", return_value=[mock_downloader]
+            ),
+        ):
+            wrapper.download_file("http://example.com", "key")
+
+        assert sum(duration.counts) == 1
+        assert size.sum == 4
+
+    def test_downloads_within_host_limit(self, tmp_path: Path):
+        limit = ratelimit.get_limit("http://example.com")
+        src = tmp_path / "dl" / "file.txt"
+        src.parent.mkdir(parents=True)
+        src.write_text("data")
+        mock_downloader = MagicMock()
+        mock_downloader.download_url.side_effect = lambda url, url_key: (
+            [src] if limit.active == 1 else None
+        )
+        mock_downloader.__name__ = "MockDownloader"
+
+        with (
+            patch("hylde.wrapper._cache_dir", return_value=tmp_path),
+            patch(
+                "hylde.wrapper.get_downloaders_for_url", return_value=[mock_downloader]
+            ),
+            patch.object(limit, "succeeded") as succeeded,
+            patch.dict(ratelimit.settings.ratelimit, enabled=True),
+        ):
+            result = wrapper.download_file("http://example.com", "key")
+
+        assert result == "key/file.txt"
+        assert limit.active == 0
+        succeeded.assert_called_once()
+
+
+class TestFallbackAndHedging:
+    """Tests for downloading with a chain of downloaders."""
+
+    @pytest.fixture(autouse=True)
+    def reset_state(self):
+        ratelimit.reset()
+        health.reset()
+        with patch("hylde.wrapper.record_result") as record_result:
+            yield record_result
+        ratelimit.reset()
+        health.reset()
+
+    def _downloader(self, name, result=None, side_effect=None):
+        downloader = MagicMock(__name__=name)
+        downloader.download_url.return_value = result
+        downloader.download_url.side_effect = side_effect
+        return downloader
+
+    def _file(self, tmp_path, name="file.txt"):
+        path = tmp_path / "dl" / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text("data")
+        return path
+
+    def test_falls_back_until_one_succeeds(self, tmp_path, reset_state):
+        src = self._file(tmp_path)
+        failed = self._downloader("failed", None)
+        broken = self._downloader("broken", side_effect=RuntimeError("boom"))
+        good = self._downloader("good", [src])
+
+        file_paths, downloader = wrapper._download_with_fallback(
+            "http://example.com", "key", [failed, broken, good]
+        )
+
+        assert (file_paths, downloader) == ([src], good)
+        # the url-specific failure of the first downloader is not counted
+        assert [c.args[2] for c in reset_state.call_args_list] == [False, True]
+
+    def test_chain_is_retryable_unless_all_failed(self):
+        failed = self._downloader("failed", None)
+        retryable = self._downloader("retryable", [])
+
+        assert wrapper._download_with_fallback(
+            "http://example.com", "key", [failed, retryable]
+        ) == ([], retryable)
+        assert (
+            wrapper._download_with_fallback(
+                "http://example.com", "key", [failed, failed]
+            )[0]
+            is None
+        )
+
+    def test_skips_downloaders_that_are_down(self, tmp_path):
+        src = self._file(tmp_path)
+        down = self._downloader("down", side_effect=RuntimeError("relay down"))
+        good = self._downloader("good", [src])
+        for _ in range(3):
+            health.record(down, RuntimeError("relay down"))
+
+        assert wrapper._download_with_fallback(
+            "http://example.com", "key", [down, good]
+        ) == ([src], good)
+        down.download_url.assert_not_called()
+        with pytest.raises(health.BackendUnavailable):
+            wrapper._download_with_fallback("http://example.com", "key", [down])
+
+    def test_full_disk_stops_chain_without_counting(self, tmp_path, reset_state):
+        full = self._downloader("full", side_effect=diskspace.DiskFull(tmp_path, 1024))
+        other = self._downloader("other", [self._file(tmp_path)])
+
+        with pytest.raises(diskspace.DiskFull):
+            wrapper._download_with_fallback("http://example.com", "key", [full, other])
+
+        other.download_url.assert_not_called()
+        reset_state.assert_not_called()
+        assert health.get_breaker(full).failures == 0
+
+    def test_single_downloader_errors_are_raised(self):
+        broken = self._downloader("broken", side_effect=RuntimeError("boom"))
+
+        with pytest.raises(RuntimeError):
+            wrapper._download_with_fallback("http://example.com", "key", [broken])
+
+    def test_hedge_starts_when_primary_is_silent(self, tmp_path):
+        src = self._file(tmp_path, "slow.txt")
+        fast_src = self._file(tmp_path, "fast.txt")
+        release = threading.Event()
+
+        def slow_download(url, url_key):
+            release.wait(1)
+            return [src]
+
+        slow = self._downloader("slow", side_effect=slow_download)
+        fast = self._downloader("fast", [fast_src])
+
+        file_paths, downloader = wrapper._download_hedged(
+            "http://example.com", "key", [slow, fast], delay=0.01
+        )
+        release.set()
+
+        assert (file_paths, downloader) == ([fast_src], fast)
+        for _ in range(100):
+            if not src.exists():
+                break
+            time.sleep(0.01)
+        assert not src.exists()
+        assert fast_src.exists()
+
+    def test_no_hedge_once_primary_transfers(self, tmp_path):
+        src = self._file(tmp_path)
+
+        def download(url, url_key):
+            progress.update(url_key, 1)
+            time.sleep(0.05)
+            return [src]
+
+        primary = self._downloader("primary", side_effect=download)
+        secondary = self._downloader("secondary", [])
+        progress.start("key")
+        try:
+            _, downloader = wrapper._download_hedged(
+                "http://example.com", "key", [primary, secondary], delay=0.01
+            )
+        finally:
+            progress.finish("key")
+
+        assert downloader is primary
+        secondary.download_url.assert_not_called()
+
+    def test_hedge_shares_host_slot_with_primary(self, tmp_path):
+        src = self._file(tmp_path)
+        limit = ratelimit.get_limit("http://example.com")
+        release = threading.Event()
+
+        def slow_download(url, url_key):
+            release.wait(5)
+            return []
+
+        slow = self._downloader("slow", side_effect=slow_download)
+        fast = self._downloader("fast", [src])
+        start = time.monotonic()
+
+        with (
+            patch.dict(ratelimit.settings.ratelimit, enabled=True),
+            patch.object(limit, "concurrency", 1),
+        ):
+            result = wrapper._download_hedged(
+                "http://example.com", "key", [slow, fast], delay=0.01
+            )
+        release.set()
+
+        assert result == ([src], fast)
+        # the hedge did not wait for the slot of its primary
+        assert time.monotonic() - start < 2
+        assert limit.active == 0
+
+    def test_hedged_chain_falls_back_on_failure(self, tmp_path):
+        src = self._file(tmp_path)
+        failed = self._downloader("failed", None)
+        good = self._downloader("good", [src])
+
+        assert wrapper._download_hedged(
+            "http://example.com", "key", [failed, good], delay=10
+        ) == ([src], good)
+
+    def test_cancelled_chain_stops_without_recording_results(self, reset_state):
+        token = cancellation.CancelToken("key")
+
+        def cancelled(url, url_key):
+            token.cancel()
+            cancellation.check()
+
+        first = self._downloader("first", side_effect=cancelled)
+        second = self._downloader("second", [])
+
+        with cancellation.use(token), pytest.raises(cancellation.Cancelled):
+            wrapper._download_with_fallback(
+                "http://example.com", "key", [first, second]
+            )
+
+        second.download_url.assert_not_called()
+        reset_state.assert_not_called()
+
+    def test_hedge_losers_are_cancelled(self, tmp_path):
+        src = self._file(tmp_path)
+        stopped = threading.Event()
+
+        def slow_download(url, url_key):
+            try:
+                cancellation.sleep(5)
+            except cancellation.Cancelled:
+                stopped.set()
+                raise
+
+        slow = self._downloader("slow", side_effect=slow_download)
+        fast = self._downloader("fast", [src])
+
+        assert wrapper._download_hedged(
+            "http://example.com", "key", [slow, fast], delay=0.01
+        ) == ([src], fast)
+        assert stopped.wait(1)
+
+    def test_cancelling_download_stops_hedged_attempts(self):
+        token = cancellation.CancelToken("key")
+
+        def wait(url, url_key):
+            cancellation.sleep(5)
+
+        a = self._downloader("a", side_effect=wait)
+        b = self._downloader("b", side_effect=wait)
+        threading.Timer(0.05, token.cancel).start()
+        start = time.monotonic()
+
+        with cancellation.use(token), pytest.raises(cancellation.Cancelled):
+            wrapper._download_hedged("http://example.com", "key", [a, b], delay=0.01)
+
+        assert time.monotonic() - start < 2